@@ -48,8 +48,10 @@ REST_FRAMEWORK = {
 
 
 MIDDLEWARE = [
+    'loans.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'loans.middleware.ReplicaRoutingMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -88,6 +90,22 @@ WSGI_APPLICATION = 'credit_system.wsgi.application'
 # }
 
 import os
+import sys
+
+TESTING = sys.argv[1:2] == ["test"]
+
+# Connection lifecycle. Web processes serve many short requests; Celery workers run
+# long ingest tasks. Each gets its own profile (DB_PROFILE, defaulting to "worker"
+# under celery), and every value can be overridden from the environment.
+# DB_POOL=1 swaps persistent connections for a psycopg 3 pool per process, which
+# pays off under ASGI where one process serves many concurrent requests.
+DB_PROFILES = {
+    "web": {"conn_max_age": 60, "pool_min_size": 2, "pool_max_size": 10, "pool_timeout": 10},
+    "worker": {"conn_max_age": 600, "pool_min_size": 1, "pool_max_size": 4, "pool_timeout": 30},
+}
+DB_PROFILE = os.getenv("DB_PROFILE") or ("worker" if "celery" in os.path.basename(sys.argv[0]) else "web")
+_db_profile = DB_PROFILES[DB_PROFILE]
+DB_POOL = os.getenv("DB_POOL", "0").lower() in ("1", "true", "yes")
 
 DATABASES = {
     "default": {
@@ -97,8 +115,46 @@ DATABASES = {
         "PASSWORD": os.getenv("DATABASE_PASSWORD", "creditpass"),
         "HOST": os.getenv("DATABASE_HOST", "db"),
         "PORT": os.getenv("DATABASE_PORT", 5432),
+        # a pool owns connection reuse, so Django must close (return) them per request
+        "CONN_MAX_AGE": 0 if DB_POOL else int(os.getenv("DB_CONN_MAX_AGE", _db_profile["conn_max_age"])),
+        # persistent connections are pinged before reuse, so a restarted database
+        # costs one reconnect instead of a failed request
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            "connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", 5)),
+        },
     }
 }
+if DB_POOL:
+    DATABASES["default"]["OPTIONS"]["pool"] = {
+        "min_size": int(os.getenv("DB_POOL_MIN_SIZE", _db_profile["pool_min_size"])),
+        "max_size": int(os.getenv("DB_POOL_MAX_SIZE", _db_profile["pool_max_size"])),
+        # seconds a request may wait for a free connection before failing
+        "timeout": float(os.getenv("DB_POOL_TIMEOUT", _db_profile["pool_timeout"])),
+        "max_idle": float(os.getenv("DB_POOL_MAX_IDLE", 300)),
+        "max_lifetime": float(os.getenv("DB_POOL_MAX_LIFETIME", 3600)),
+    }
+
+# Read replicas: DATABASE_REPLICA_HOSTS="host1,host2" adds aliases replica_0, replica_1, ...
+# with the primary's credentials. loans.routers sends the read-only endpoints there.
+DATABASE_REPLICAS = []
+for _index, _host in enumerate(h.strip() for h in os.getenv("DATABASE_REPLICA_HOSTS", "").split(",") if h.strip()):
+    DATABASES[f"replica_{_index}"] = {
+        **DATABASES["default"],
+        "HOST": _host,
+        "OPTIONS": dict(DATABASES["default"]["OPTIONS"]),
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica_{_index}")
+if TESTING and not DATABASE_REPLICAS:
+    # a second alias on the test database, so replica routing can be tested locally
+    DATABASES["replica"] = {**DATABASES["default"], "TEST": {"MIRROR": "default"}}
+DATABASE_ROUTERS = ["loans.routers.ReplicaRouter"]
+# how long a client's reads stay on the primary after it registers / creates a loan
+READ_YOUR_WRITES_SECONDS = int(os.getenv("READ_YOUR_WRITES_SECONDS", 10))
+# replicas further behind than this are skipped; lag is re-checked at most this often
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 5))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", 5))
 
 
 
@@ -150,3 +206,73 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CELERY_BROKER_URL = f"redis://{os.getenv('REDIS_HOST', 'redis')}:{os.getenv('REDIS_PORT', 6379)}/0"
 CELERY_RESULT_BACKEND = CELERY_BROKER_URL
+
+# Caches: Redis when configured (docker-compose sets REDIS_HOST), LocMem otherwise
+# and always under the test runner. "loans" holds only view-loan(s) responses
+# (loans.cache) so bulk loads can clear it wholesale.
+if os.getenv("REDIS_HOST") and not TESTING:
+    _redis_cache = f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT', 6379)}"
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": f"{_redis_cache}/1"},
+        "loans": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": f"{_redis_cache}/2"},
+    }
+else:
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "default"},
+        "loans": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "loans"},
+    }
+# upper bound for cached view-loan(s) responses; view-loans entries also end at midnight
+LOAN_CACHE_TIMEOUT = int(os.getenv("LOAN_CACHE_TIMEOUT", 300))
+
+# rows per bulk upsert statement / transaction in the ingest tasks
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 1000))
+# parallel shard tasks per file in the ingest_files canvas
+INGEST_SHARDS = int(os.getenv("INGEST_SHARDS", 4))
+
+# ids leased per process at a time where database sequences are unavailable (loans.ids)
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", 50))
+
+ELIGIBILITY_BATCH_MAX_ITEMS = int(os.getenv("ELIGIBILITY_BATCH_MAX_ITEMS", 5000))
+
+# page size cap for GET /api/view-loans/<id>?limit=...
+VIEW_LOANS_MAX_LIMIT = int(os.getenv("VIEW_LOANS_MAX_LIMIT", 500))
+# rows fetched per round trip by server-side cursors in streamed responses
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 2000))
+# rows per keyset page (one short statement each) of GET /api/export/loans and export_loans
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", 50000))
+
+# loan-offers: amounts are multiples of the step; the step grows when the grid
+# would exceed the point limit
+LOAN_OFFER_AMOUNT_STEP = int(os.getenv("LOAN_OFFER_AMOUNT_STEP", 1000))
+LOAN_OFFER_MAX_GRID_POINTS = int(os.getenv("LOAN_OFFER_MAX_GRID_POINTS", 5000))
+
+RESCORE_CHUNK_SIZE = int(os.getenv("RESCORE_CHUNK_SIZE", 50000))
+
+# loans deactivated per transaction by the maturity sweeper (loans.maturity)
+MATURITY_SWEEP_BATCH_SIZE = int(os.getenv("MATURITY_SWEEP_BATCH_SIZE", 1000))
+
+# closed loans that ended more than this many days ago move to LoanArchive (loans.archive)
+LOAN_ARCHIVE_AFTER_DAYS = int(os.getenv("LOAN_ARCHIVE_AFTER_DAYS", 365))
+LOAN_ARCHIVE_BATCH_SIZE = int(os.getenv("LOAN_ARCHIVE_BATCH_SIZE", 1000))
+
+# counter rows per portfolio rollup bucket (loans.portfolio); concurrent writers pick
+# one at random, so they rarely wait on each other's row locks
+PORTFOLIO_ROLLUP_SLOTS = int(os.getenv("PORTFOLIO_ROLLUP_SLOTS", 8))
+
+from celery.schedules import crontab
+
+CELERY_BEAT_SCHEDULE = {
+    # before rescoring, so the scores see tonight's matured loans as closed
+    "sweep-matured-loans-nightly": {
+        "task": "loans.tasks.sweep_matured_loans_task",
+        "schedule": crontab(hour=int(os.getenv("MATURITY_SWEEP_HOUR", 1)), minute=0),
+    },
+    "archive-closed-loans-nightly": {
+        "task": "loans.tasks.archive_closed_loans_task",
+        "schedule": crontab(hour=int(os.getenv("LOAN_ARCHIVE_HOUR", 1)), minute=30),
+    },
+    "rescore-portfolio-nightly": {
+        "task": "loans.tasks.rescore_portfolio_task",
+        "schedule": crontab(hour=int(os.getenv("RESCORE_HOUR", 2)), minute=0),
+    },
+}
@@ -16,13 +16,14 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from loans.views import healthz
+from loans.views import healthz, metrics_view
 from django.conf import settings
 from django.conf.urls.static import static
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("healthz/", healthz),  
+    path("metrics", metrics_view, name="metrics"),
     path("api/", include("loans.urls")),
 ]
 
@@ -1,10 +1,82 @@
 from django.contrib import admin
-from .models import Customer, Loan
+from django.db import transaction
+from .models import (
+    Customer, Loan, CustomerCreditSnapshot, CreditScoreHistory, LoanArchive, CustomerArchiveRollup, PortfolioRollup
+)
+from .archive import refresh_archive_rollups
+from .cache import invalidate
+from .portfolio import ARCHIVED_LOAN_FIELDS, LOAN_FIELDS, add_loan, apply_deltas, batched, forget_customers
+from .utils import refresh_credit_snapshots
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ("id", "customer_id", "first_name", "last_name", "phone_number", "monthly_income", "approved_limit")
 
+    def delete_queryset(self, request, queryset):
+        # bulk delete bypasses Customer.delete; drop their cached responses and
+        # portfolio rollup counts here
+        with transaction.atomic():
+            forget_customers(queryset.values_list("pk", flat=True))
+            invalidate(
+                Loan.objects.filter(customer__in=queryset).values_list("loan_id", flat=True),
+                queryset.values_list("pk", "customer_id"),
+            )
+            super().delete_queryset(request, queryset)
+
 @admin.register(Loan)
 class LoanAdmin(admin.ModelAdmin):
     list_display = ("id", "loan_id" ,"customer", "loan_amount", "tenure", "interest_rate", "is_active")
+
+    def delete_queryset(self, request, queryset):
+        # bulk delete bypasses Loan.delete, so rebuild the touched snapshots and
+        # portfolio rollups and drop the cached responses here
+        with transaction.atomic(), batched():
+            customer_ids = set(queryset.values_list("customer_id", flat=True))
+            loan_ids = list(queryset.values_list("loan_id", flat=True))
+            rollup = {}
+            for loan in queryset.only(*LOAN_FIELDS):
+                add_loan(rollup, loan, -1)
+            super().delete_queryset(request, queryset)
+            apply_deltas(rollup)
+            refresh_credit_snapshots(customer_ids)
+            invalidate(loan_ids, Customer.objects.filter(pk__in=customer_ids).values_list("pk", "customer_id"))
+
+@admin.register(CustomerCreditSnapshot)
+class CustomerCreditSnapshotAdmin(admin.ModelAdmin):
+    list_display = ("customer", "current_loans_amount", "current_emis", "loans_count", "activity_year", "activity_count", "score_band", "income_band", "updated_at")
+    readonly_fields = ("updated_at",)
+
+@admin.register(CreditScoreHistory)
+class CreditScoreHistoryAdmin(admin.ModelAdmin):
+    list_display = ("customer", "scored_on", "credit_score", "created_at")
+    list_filter = ("scored_on",)
+
+@admin.register(LoanArchive)
+class LoanArchiveAdmin(admin.ModelAdmin):
+    list_display = ("id", "loan_id", "customer", "loan_amount", "tenure", "end_date", "archived_at")
+
+    def delete_queryset(self, request, queryset):
+        # archived loans only reach scoring through the rollups; rebuild them and the snapshots,
+        # and take the loans out of the portfolio's new-loan counts
+        with transaction.atomic(), batched():
+            customer_ids = set(queryset.values_list("customer_id", flat=True))
+            loan_ids = list(queryset.values_list("loan_id", flat=True))
+            rollup = {}
+            for loan in queryset.only(*ARCHIVED_LOAN_FIELDS):
+                add_loan(rollup, loan, -1)
+            super().delete_queryset(request, queryset)
+            apply_deltas(rollup)
+            refresh_archive_rollups(customer_ids)
+            refresh_credit_snapshots(customer_ids)
+            invalidate(loan_ids, Customer.objects.filter(pk__in=customer_ids).values_list("pk", "customer_id"))
+
+@admin.register(CustomerArchiveRollup)
+class CustomerArchiveRollupAdmin(admin.ModelAdmin):
+    list_display = ("customer", "loans_count", "emis_paid_on_time", "total_tenure", "updated_at")
+    readonly_fields = ("updated_at",)
+
+@admin.register(PortfolioRollup)
+class PortfolioRollupAdmin(admin.ModelAdmin):
+    list_display = ("dimension", "bucket", "count", "exposure", "monthly_emis", "updated_at")
+    list_filter = ("dimension",)
+    readonly_fields = ("updated_at",)
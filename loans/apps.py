@@ -3,3 +3,8 @@ from django.apps import AppConfig
 class LoansConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'loans'
+
+    def ready(self):
+        from . import connections, metrics
+        connections.install()
+        metrics.install()
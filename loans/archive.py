@@ -0,0 +1,138 @@
+# loans/archive.py
+"""
+Archive tier for closed loans.
+
+archive_closed_loans() moves loans out of Loan into LoanArchive once they are
+closed (is_active=False), ended more than LOAN_ARCHIVE_AFTER_DAYS ago and
+started before the current year, and keeps each customer's archived count,
+tenure and on-time EMIs in CustomerArchiveRollup. Credit profiles add the
+rollup to the Loan aggregates (utils.with_archive, scoring.portfolio_profiles),
+so scores do not change while the hot table keeps only the recent book.
+Archived loans contribute nothing to exposure, EMIs or this year's activity:
+the filter above guarantees that for every later day too.
+
+Like the maturity sweeper, it works in short transactions of at most
+batch_size loans, locking each batch's customers in pk order; moved loans
+leave the candidate filter, so an interrupted run resumes where it stopped.
+Snapshots, portfolio rollups and cached responses stay valid (the totals and
+the view-loan detail are unchanged), so none of them is touched.
+"""
+import logging
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import Customer, CustomerArchiveRollup, Loan, LoanArchive
+from .portfolio import ARCHIVED_LOAN_FIELDS, add_loan, apply_deltas
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FIELDS = (
+    "loan_id", "loan_amount", "tenure", "interest_rate", "monthly_repayment",
+    "emis_paid_on_time", "start_date", "end_date", "source_hash",
+)
+
+
+def archivable_loans(today: date, older_than_days: int):
+    """Closed loans that ended before the cutoff and started before this year (served by loan_closed_end_idx)."""
+    return Loan.objects.filter(
+        is_active=False,
+        end_date__lt=today - timedelta(days=older_than_days),
+        start_date__lt=date(today.year, 1, 1),
+    )
+
+
+def archive_closed_loans(today: date = None, older_than_days: int = None, batch_size: int = None,
+                         max_batches: int = None) -> dict:
+    """Move archivable loans batch by batch; max_batches bounds one run. Returns counts and timing."""
+    started = time.monotonic()
+    today = today or timezone.now().date()
+    older_than_days = settings.LOAN_ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    batch_size = batch_size or settings.LOAN_ARCHIVE_BATCH_SIZE
+
+    archived = batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = _archive_batch(today, older_than_days, batch_size)
+        if not moved:
+            break
+        archived += moved
+        batches += 1
+
+    report = {
+        "archived_on": today.isoformat(),
+        "archived": archived,
+        "batches": batches,
+        "remaining": archivable_loans(today, older_than_days).exists(),
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    logger.info("loan archive: %(archived)s loans archived in %(batches)s batches (%(seconds)ss)", report)
+    return report
+
+
+def _archive_batch(today: date, older_than_days: int, batch_size: int) -> int:
+    with transaction.atomic():
+        candidates = archivable_loans(today, older_than_days).order_by("end_date", "pk")
+        customer_ids = {customer_id for _, customer_id in candidates.values_list("pk", "customer_id")[:batch_size]}
+        if not customer_ids:
+            return 0
+        list(Customer.objects.select_for_update().filter(pk__in=customer_ids).order_by("pk").values_list("pk"))
+        # re-read under the locks: a concurrent writer may have changed a candidate since
+        rows = list(
+            candidates.filter(customer_id__in=customer_ids).values("pk", "customer_id", *ARCHIVE_FIELDS)[:batch_size]
+        )
+        LoanArchive.objects.bulk_create([
+            LoanArchive(customer_id=row["customer_id"], **{field: row[field] for field in ARCHIVE_FIELDS})
+            for row in rows
+        ])
+        Loan.objects.filter(pk__in=[row["pk"] for row in rows]).delete()
+        refresh_archive_rollups(customer_ids)
+    return len(rows)
+
+
+def refresh_archive_rollups(customer_ids) -> None:
+    """Recompute CustomerArchiveRollup for these customers from LoanArchive (in the caller's transaction)."""
+    customer_ids = list(customer_ids)
+    rollups = [
+        CustomerArchiveRollup(customer_id=row.pop("customer"), **row)
+        for row in LoanArchive.objects.filter(customer_id__in=customer_ids).values("customer").annotate(
+            loans_count=Count("id"), emis_paid_on_time=Sum("emis_paid_on_time"), total_tenure=Sum("tenure"),
+        ).order_by()
+    ]
+    CustomerArchiveRollup.objects.bulk_create(
+        rollups, batch_size=1000, update_conflicts=True, unique_fields=["customer"],
+        update_fields=["loans_count", "emis_paid_on_time", "total_tenure", "updated_at"],
+    )
+    CustomerArchiveRollup.objects.filter(customer_id__in=customer_ids).exclude(
+        customer_id__in=[rollup.customer_id for rollup in rollups],
+    ).delete()
+
+
+def archived_rows(loan_ids) -> dict:
+    """{loan_id: (customer pk, source_hash)} for the given external ids that are archived."""
+    return {
+        loan_id: (customer_id, source_hash)
+        for loan_id, customer_id, source_hash in LoanArchive.objects.filter(loan_id__in=list(loan_ids))
+        .values_list("loan_id", "customer_id", "source_hash")
+    }
+
+
+def unarchive(owners: dict) -> None:
+    """
+    Drop archived loans that are about to be written to Loan again (owners is
+    {loan_id: customer pk}, see archived_rows), so a loan id never lives in both
+    tables. The caller rewrites the loans and refreshes the owners' snapshots
+    in the same transaction, with the owners locked.
+    """
+    if owners:
+        archived = LoanArchive.objects.filter(loan_id__in=list(owners))
+        # the rewritten loans are counted again by the caller (loans.portfolio)
+        rollup = {}
+        for loan in archived.only(*ARCHIVED_LOAN_FIELDS):
+            add_loan(rollup, loan, -1)
+        archived.delete()
+        refresh_archive_rollups(set(owners.values()))
+        apply_deltas(rollup)
@@ -0,0 +1,134 @@
+# loans/async_views.py
+"""
+Async variants of the hot endpoints, mounted under /api/async/ and meant to be
+served by the ASGI application (credit_system.asgi). Reads go through Django's
+async ORM; scoring, response shapes and cache entries are shared with the sync
+views in loans/views.py, so both paths answer identically.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+
+from .models import Customer, Loan, LoanArchive
+from .serializers import CheckEligibilityRequestSerializer
+from .utils import aget_credit_profile
+from .views import (
+    ViewLoanAPIView, ViewLoansByCustomerAPIView, create_loan_for, customers_by_identifiers,
+    eligibility_decision, loan_booked, loan_rejected, match_identifiers,
+)
+from . import cache
+
+
+async def aget_customer_by_identifier(identifier: int) -> Customer:
+    """get_customer_by_identifier for async views (same single OR query)."""
+    customers = [customer async for customer in customers_by_identifiers([identifier])]
+    customer = match_identifiers([identifier], customers).get(identifier)
+    if customer is None:
+        raise Customer.DoesNotExist(f"no customer with id or customer_id {identifier}")
+    return customer
+
+
+class AsyncAPIView(View):
+    """
+    Minimal async counterpart of DRF's APIView: CSRF-exempt, JSON request bodies
+    in, JSON out. DRF's own views are sync-only.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    @staticmethod
+    def validated(request, serializer_class):
+        """(validated_data, None) or (None, 400 response) for the request's JSON body."""
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return None, JsonResponse({"error": "invalid JSON body"}, status=status.HTTP_400_BAD_REQUEST)
+        ser = serializer_class(data=data)
+        if not ser.is_valid():
+            return None, JsonResponse(ser.errors, status=status.HTTP_400_BAD_REQUEST)
+        return ser.validated_data, None
+
+
+class AsyncCheckEligibilityView(AsyncAPIView):
+    """
+    POST /api/async/check-eligibility
+    """
+    async def post(self, request):
+        payload, error = self.validated(request, CheckEligibilityRequestSerializer)
+        if error is not None:
+            return error
+        try:
+            customer = await aget_customer_by_identifier(payload["customer_id"])
+        except Customer.DoesNotExist:
+            return JsonResponse({"error": "customer not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        profile = await aget_credit_profile(customer)
+        return JsonResponse(eligibility_decision(customer, profile, payload), status=status.HTTP_200_OK)
+
+
+class AsyncCreateLoanView(AsyncAPIView):
+    """
+    POST /api/async/create-loan
+    The customer lookup runs on the async ORM; the checks and the insert run in a
+    worker thread under the customer's row lock (see views.create_loan_for), as
+    transactions must.
+    """
+    async def post(self, request):
+        payload, error = self.validated(request, CheckEligibilityRequestSerializer)
+        if error is not None:
+            return error
+        try:
+            customer = await aget_customer_by_identifier(payload["customer_id"])
+        except Customer.DoesNotExist:
+            return JsonResponse({"error": "customer not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        decision, loan = await sync_to_async(create_loan_for)(customer, payload)
+        if not decision["approved"]:
+            return JsonResponse(loan_rejected(customer, decision["message"]), status=status.HTTP_200_OK)
+        return JsonResponse(loan_booked(loan, decision), status=status.HTTP_201_CREATED)
+
+
+class AsyncViewLoanView(AsyncAPIView):
+    """
+    GET /api/async/view-loan/<loan_id>
+    """
+    async def get(self, request, loan_id):
+        async def abuild():
+            try:
+                loan = await Loan.objects.select_related("customer").aget(loan_id=loan_id)
+            except Loan.DoesNotExist:
+                loan = await LoanArchive.objects.select_related("customer").filter(loan_id=loan_id).afirst()
+                if loan is None:
+                    return None
+            return ViewLoanAPIView.detail(loan)
+
+        resp = await cache.aget_loan_detail(loan_id, abuild)
+        if resp is None:
+            return JsonResponse({"error": "loan not found"}, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse(resp, status=status.HTTP_200_OK)
+
+
+class AsyncViewLoansByCustomerView(AsyncAPIView):
+    """
+    GET /api/async/view-loans/<customer_id>
+    The full (cached) list; pagination and streaming stay on the sync view.
+    """
+    async def get(self, request, customer_id):
+        async def abuild():
+            try:
+                customer = await aget_customer_by_identifier(customer_id)
+            except Customer.DoesNotExist:
+                return None
+            view = ViewLoansByCustomerAPIView
+            return [view.row(values) async for values in view.loans(customer)]
+
+        out = await cache.aget_customer_loans(customer_id, abuild)
+        if out is None:
+            return JsonResponse({"error": "customer not found"}, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse(out, status=status.HTTP_200_OK, safe=False)
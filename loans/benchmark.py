@@ -0,0 +1,374 @@
+# loans/benchmark.py
+"""
+Benchmark harness for the loans API.
+
+- seed_database() adds a synthetic portfolio of a given size.
+- generate_traffic() builds a weighted request mix over every route in
+  loans/urls.py; load_traffic() reads recorded traffic from a JSONL file.
+- run_load() replays requests from `concurrency` closed-loop client threads
+  (each sends its next request as soon as the previous one returns) through a
+  transport: InProcessTransport (Django test client, also counts SQL queries
+  per request) or HttpTransport (a running server).
+- time_active_set() times the reads that scan a customer's active loans (see
+  the sweep_matured_loans command's --benchmark).
+
+Results are plain dicts so they can be written as JSON and compared across runs.
+"""
+import json
+import math
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connections, transaction
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+# share of generated traffic per url name (see loans/urls.py)
+TRAFFIC_WEIGHTS = {
+    "check-eligibility": 20,
+    "view-loan": 15,
+    "view-loans": 15,
+    "view-loan-schedule": 5,
+    "check-eligibility-batch": 2,
+    "loan-offers": 5,
+    "create-loan": 5,
+    "register": 2,
+    "cache-stats": 1,
+    "db-stats": 1,
+    "export-loans": 1,
+    "portfolio-summary": 1,
+    "async-check-eligibility": 10,
+    "async-view-loan": 8,
+    "async-view-loans": 8,
+    "async-create-loan": 3,
+}
+WRITE_ENDPOINTS = {"register", "create-loan", "async-create-loan"}
+
+
+def percentile(samples: list, pct: float) -> float:
+    """Nearest-rank percentile of samples (sorted or not); None when empty."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = min(len(ordered), max(1, math.ceil(pct / 100 * len(ordered)))) - 1
+    return ordered[rank]
+
+
+def loan_url_names() -> list:
+    """Every named route of the loans app."""
+    from . import urls
+    return [pattern.name for pattern in urls.urlpatterns if pattern.name]
+
+
+def seed_database(customers: int, loans_per_customer: int = 5, seed: int = 0) -> dict:
+    """
+    Add `customers` synthetic customers with about `loans_per_customer` loans each
+    (bulk inserts), then build their credit snapshots and portfolio rollups and move
+    the id allocators past the new ids. Returns the counts written.
+    """
+    from .ids import sync_id_allocator
+    from .models import Customer, Loan
+    from .portfolio import add_loan, apply_deltas, batched
+    from .utils import calculate_emi, refresh_credit_snapshots
+
+    rng = random.Random(seed)
+    today = timezone.now().date()
+    first_customer_id = (Customer.objects.order_by("-customer_id").values_list("customer_id", flat=True).first() or 0) + 1
+    first_loan_id = (Loan.objects.order_by("-loan_id").values_list("loan_id", flat=True).first() or 0) + 1
+
+    new_customers = []
+    for offset in range(customers):
+        income = rng.randrange(20000, 300000, 1000)
+        customer_id = first_customer_id + offset
+        new_customers.append(Customer(
+            customer_id=customer_id, first_name=f"Bench{customer_id}", last_name="Customer",
+            age=rng.randint(21, 65), phone_number=f"7{customer_id:09d}"[-15:],
+            monthly_income=income, approved_limit=round(36 * income, -5),
+        ))
+    Customer.objects.bulk_create(new_customers, batch_size=1000)
+    pks = list(
+        Customer.objects.filter(customer_id__gte=first_customer_id)
+        .order_by("customer_id").values_list("pk", flat=True)[:customers]
+    )
+
+    new_loans, loan_id = [], first_loan_id
+    for pk in pks:
+        for _ in range(rng.randint(0, 2 * loans_per_customer)):
+            tenure = rng.choice([6, 12, 24, 36, 60, 120])
+            amount = rng.randrange(50000, 2000000, 5000)
+            rate = rng.choice([8, 10.5, 12, 14, 16, 18])
+            start = today - timedelta(days=rng.randint(0, 365 * 8))
+            end = start + timedelta(days=30 * tenure)
+            new_loans.append(Loan(
+                customer_id=pk, loan_id=loan_id, loan_amount=amount, tenure=tenure, interest_rate=rate,
+                monthly_repayment=Decimal(str(calculate_emi(amount, rate, tenure))),
+                emis_paid_on_time=rng.randint(0, tenure), start_date=start,
+                # matured loans are closed, as ingestion and the sweeper leave them (loans.maturity)
+                end_date=end, is_active=end >= today,
+            ))
+            loan_id += 1
+    with transaction.atomic(), batched():
+        Loan.objects.bulk_create(new_loans, batch_size=1000)
+        rollup = {}
+        for loan in new_loans:
+            add_loan(rollup, loan, 1)
+        apply_deltas(rollup)
+        refresh_credit_snapshots(pks, today=today)
+    sync_id_allocator("customer")
+    sync_id_allocator("loan")
+    return {"customers": len(pks), "loans": len(new_loans)}
+
+
+def _eligibility_body(rng, customer_ids):
+    return {
+        "customer_id": rng.choice(customer_ids),
+        "loan_amount": rng.randrange(10000, 1000000, 1000),
+        "interest_rate": rng.choice([8, 10.5, 12, 14, 16]),
+        "tenure": rng.choice([6, 12, 24, 36, 60]),
+    }
+
+
+def _request_for(name, rng, index, salt, customer_ids, loan_ids):
+    """(method, path, body) for one generated request to url name."""
+    if name in ("check-eligibility", "async-check-eligibility", "create-loan", "async-create-loan"):
+        return "POST", reverse(name), _eligibility_body(rng, customer_ids)
+    if name == "check-eligibility-batch":
+        return "POST", reverse(name), [_eligibility_body(rng, customer_ids) for _ in range(20)]
+    if name == "loan-offers":
+        return "POST", reverse(name), {"customer_id": rng.choice(customer_ids), "interest_rate": rng.choice([12, 14, 16, 18])}
+    if name == "register":
+        return "POST", reverse(name), {
+            "first_name": "Load", "last_name": f"Test{index}", "age": rng.randint(21, 65),
+            "monthly_income": rng.randrange(20000, 300000, 1000), "phone_number": f"6{salt:06d}{index:08d}",
+        }
+    if name in ("view-loan", "async-view-loan", "view-loan-schedule"):
+        return "GET", reverse(name, kwargs={"loan_id": rng.choice(loan_ids)}), None
+    if name in ("view-loans", "async-view-loans"):
+        return "GET", reverse(name, kwargs={"customer_id": rng.choice(customer_ids)}), None
+    if name in ("cache-stats", "db-stats"):
+        return "GET", reverse(name), None
+    if name == "export-loans":
+        # one week of originations, so a request stays small whatever the portfolio size
+        start = timezone.now().date() - timedelta(days=rng.randint(7, 365 * 8))
+        query = f"format={rng.choice(['csv', 'ndjson'])}&start_date_from={start}&start_date_to={start + timedelta(days=6)}"
+        return "GET", f"{reverse(name)}?{query}", None
+    if name == "portfolio-summary":
+        return "GET", f"{reverse(name)}?days={rng.choice([7, 30, 90])}", None
+    raise ValueError(f"no traffic generator for url name {name!r}")
+
+
+def generate_traffic(total: int, customer_ids: list, loan_ids: list, endpoints=None, seed: int = 0) -> list:
+    """
+    `total` requests as (endpoint, method, path, body), drawn from TRAFFIC_WEIGHTS
+    restricted to `endpoints` (default: every route in loans/urls.py).
+    """
+    if not customer_ids or not loan_ids:
+        raise ValueError("traffic needs at least one customer and one loan; seed the database first")
+    endpoints = list(endpoints or loan_url_names())
+    weights = [TRAFFIC_WEIGHTS.get(name, 1) for name in endpoints]
+    rng = random.Random(seed)
+    salt = int(time.time()) % 10**6  # keeps registered phone numbers unique across runs
+    traffic = []
+    for index, name in enumerate(rng.choices(endpoints, weights=weights, k=total)):
+        traffic.append((name, *_request_for(name, rng, index, salt, customer_ids, loan_ids)))
+    return traffic
+
+
+def load_traffic(path: str) -> list:
+    """
+    Recorded traffic: one JSON object per line with "method" and "path" (and
+    optionally "body"). The endpoint is the url name the path resolves to.
+    Lines that are not requests are skipped; ValueError if none are left.
+    """
+    traffic = []
+    with open(path) as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if not isinstance(record, dict) or "method" not in record or "path" not in record:
+                continue
+            match = resolve(record["path"].split("?")[0])
+            traffic.append((match.url_name or match.route, record["method"].upper(), record["path"], record.get("body")))
+    if not traffic:
+        raise ValueError(f"{path} has no replayable requests (expected JSON lines with \"method\" and \"path\")")
+    return traffic
+
+
+class HttpTransport:
+    """Send requests to a running server. SQL happens elsewhere, so queries are not counted."""
+    counts_queries = False
+
+    def __init__(self, base_url: str, timeout: float = 30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def __call__(self, method: str, path: str, body=None) -> tuple:
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(
+            self.base_url + path, data=data, method=method, headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status, None
+        except urllib.error.HTTPError as exc:
+            exc.read()
+            return exc.code, None
+
+
+class InProcessTransport:
+    """
+    Run requests through Django's test client in this process (full middleware
+    stack, no network) and count the SQL statements each one executes on every
+    database alias.
+    """
+    counts_queries = True
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def __call__(self, method: str, path: str, body=None) -> tuple:
+        from django.test import Client
+
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = Client()
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(count))
+            if method == "GET":
+                response = client.get(path)
+            else:
+                response = client.generic(method, path, json.dumps(body), content_type="application/json")
+            if response.streaming:
+                b"".join(response.streaming_content)
+        return response.status_code, queries[0]
+
+
+def summarize(samples: list, wall: float, counts_queries: bool) -> dict:
+    """samples: (latency ms, status, queries) for one endpoint."""
+    latencies = [latency for latency, _, _ in samples]
+    statuses = {}
+    for _, code, _ in samples:
+        statuses[str(code)] = statuses.get(str(code), 0) + 1
+    summary = {
+        "requests": len(samples),
+        "requests_per_second": round(len(samples) / wall, 1) if wall > 0 else None,
+        "mean_ms": round(statistics.fmean(latencies), 2) if latencies else None,
+        **{f"p{pct}_ms": round(percentile(latencies, pct), 2) if latencies else None for pct in (50, 95, 99)},
+        "max_ms": round(max(latencies), 2) if latencies else None,
+        "statuses": statuses,
+    }
+    if counts_queries:
+        queries = [count for _, _, count in samples]
+        summary["queries_per_request"] = round(statistics.fmean(queries), 2) if queries else None
+        summary["max_queries"] = max(queries) if queries else None
+    return summary
+
+
+def run_load(traffic: list, transport, concurrency: int = 1) -> dict:
+    """
+    Replay traffic [(endpoint, method, path, body), ...] through transport from
+    `concurrency` threads; concurrency=1 runs in the calling thread. Returns
+    overall and per-endpoint latency percentiles (ms), throughput, status counts
+    and, with an in-process transport, SQL queries per request.
+    """
+    samples, lock = {}, threading.Lock()
+    pending = iter(traffic)
+
+    def worker():
+        try:
+            while True:
+                with lock:
+                    item = next(pending, None)
+                if item is None:
+                    return
+                endpoint, method, path, body = item
+                started = time.perf_counter()
+                try:
+                    code, queries = transport(method, path, body)
+                except OSError:
+                    code, queries = "error", None
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    samples.setdefault(endpoint, []).append((elapsed, code, queries))
+        finally:
+            if concurrency > 1:
+                connections.close_all()
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(worker) for _ in range(concurrency)]:
+                future.result()
+    else:
+        worker()
+    wall = time.perf_counter() - started
+
+    every = [sample for endpoint_samples in samples.values() for sample in endpoint_samples]
+    return {
+        "concurrency": concurrency,
+        "seconds": round(wall, 3),
+        **summarize(every, wall, transport.counts_queries),
+        "endpoints": {
+            endpoint: summarize(endpoint_samples, wall, transport.counts_queries)
+            for endpoint, endpoint_samples in sorted(samples.items())
+        },
+    }
+
+
+def active_set_queries(customer_pks: list) -> dict:
+    """The reads whose cost grows with the number of is_active=True loans, as name -> callable."""
+    from django.db.models import Sum
+
+    from .models import Loan
+    from .utils import credit_profile_aggregates
+    from .views import ViewLoansByCustomerAPIView
+
+    return {
+        "view-loans rows": lambda pk: list(ViewLoansByCustomerAPIView.loans(pk)),
+        "active EMI/exposure sums": lambda pk: Loan.objects.filter(customer_id=pk, is_active=True).aggregate(
+            emis=Sum("monthly_repayment"), exposure=Sum("loan_amount"),
+        ),
+        "credit profile rebuild": lambda pk: Loan.objects.filter(customer_id=pk).aggregate(**credit_profile_aggregates()),
+        "portfolio active count": lambda pk: Loan.objects.filter(is_active=True).count(),
+    }
+
+
+def time_active_set(customer_pks: list, repeat: int = 3) -> dict:
+    """
+    Run every active_set_queries() read for each customer `repeat` times; returns
+    the active loan count and per-query latency percentiles (ms).
+    """
+    from .models import Loan
+
+    results = {"active_loans": Loan.objects.filter(is_active=True).count(), "queries": {}}
+    for name, query in active_set_queries(customer_pks).items():
+        latencies = []
+        for _ in range(repeat):
+            for pk in customer_pks:
+                started = time.perf_counter()
+                query(pk)
+                latencies.append((time.perf_counter() - started) * 1000)
+        results["queries"][name] = {
+            "runs": len(latencies),
+            "mean_ms": round(statistics.fmean(latencies), 3),
+            **{f"p{pct}_ms": round(percentile(latencies, pct), 3) for pct in (50, 95)},
+        }
+    return results
@@ -0,0 +1,146 @@
+# loans/cache.py
+"""
+Read-through cache for the view-loan / view-loans responses.
+
+Entries are keyed by loan_id and by the customer identifier a client used
+(internal id or external customer_id), and are deleted on commit of any
+write that changes them. view-loans output depends on today's date
+(repayments_left), so its keys carry the date and expire at midnight.
+
+Only reads from the primary fill the cache: a replica may not have replayed a
+write whose eviction already ran on commit, and caching what it returns would
+serve the old response to everyone for LOAN_CACHE_TIMEOUT. Replica reads are
+still answered from entries the primary filled.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .routers import reading_from_replica
+
+cache = caches["loans"]
+
+STATS_KEYS = {"hits": "loans:cache:hits", "misses": "loans:cache:misses"}
+
+
+def loan_key(loan_id) -> str:
+    return f"loans:loan:{loan_id}"
+
+
+def customer_loans_key(identifier, day) -> str:
+    return f"loans:customer-loans:{identifier}:{day.isoformat()}"
+
+
+def _seconds_until_midnight() -> int:
+    now = timezone.localtime()
+    midnight = timezone.make_aware(datetime.combine(now.date() + timedelta(days=1), time.min))
+    return max(1, int((midnight - now).total_seconds()))
+
+
+def _count(outcome: str):
+    key = STATS_KEYS[outcome]
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:  # evicted between add and incr
+        cache.add(key, 1, timeout=None)
+
+
+def read_through(key: str, build, timeout: int):
+    """
+    Return the cached value for key, or build() it and cache it unless it is None
+    or was read from a replica.
+    """
+    value = cache.get(key)
+    if value is not None:
+        _count("hits")
+        return value
+    _count("misses")
+    value = build()
+    if value is not None and not reading_from_replica():
+        cache.set(key, value, timeout)
+    return value
+
+
+async def _acount(outcome: str):
+    key = STATS_KEYS[outcome]
+    await cache.aadd(key, 0, timeout=None)
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        await cache.aadd(key, 1, timeout=None)
+
+
+async def aread_through(key: str, abuild, timeout: int):
+    """read_through for async views; abuild is a coroutine function."""
+    value = await cache.aget(key)
+    if value is not None:
+        await _acount("hits")
+        return value
+    await _acount("misses")
+    value = await abuild()
+    if value is not None and not reading_from_replica():
+        await cache.aset(key, value, timeout)
+    return value
+
+
+def get_loan_detail(loan_id, build):
+    return read_through(loan_key(loan_id), build, settings.LOAN_CACHE_TIMEOUT)
+
+
+async def aget_loan_detail(loan_id, abuild):
+    return await aread_through(loan_key(loan_id), abuild, settings.LOAN_CACHE_TIMEOUT)
+
+
+def _customer_loans_entry(identifier) -> tuple:
+    """(key, timeout) for today's view-loans entry of identifier."""
+    today = timezone.now().date()
+    return customer_loans_key(identifier, today), min(settings.LOAN_CACHE_TIMEOUT, _seconds_until_midnight())
+
+
+def get_customer_loans(identifier, build):
+    key, timeout = _customer_loans_entry(identifier)
+    return read_through(key, build, timeout)
+
+
+async def aget_customer_loans(identifier, abuild):
+    key, timeout = _customer_loans_entry(identifier)
+    return await aread_through(key, abuild, timeout)
+
+
+def cache_stats() -> dict:
+    values = cache.get_many(list(STATS_KEYS.values()))
+    stats = {name: int(values.get(key) or 0) for name, key in STATS_KEYS.items()}
+    total = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / total, 4) if total else None
+    return stats
+
+
+def invalidate(loan_ids=(), customers=()):
+    """
+    Drop cached responses once the current transaction commits (immediately under
+    autocommit). customers are (internal id, external customer_id) pairs; view-loans
+    entries may be keyed by either.
+    """
+    today = timezone.now().date()
+    keys = [loan_key(loan_id) for loan_id in loan_ids]
+    for pk, external_id in customers:
+        keys.append(customer_loans_key(pk, today))
+        keys.append(customer_loans_key(external_id, today))
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_loan_change(previous, current):
+    """invalidate() for a single Loan write (see Loan.save/delete)."""
+    loans = [loan for loan in (previous, current) if loan is not None]
+    customers = {(loan.customer.pk, loan.customer.customer_id) for loan in loans}
+    invalidate({loan.loan_id for loan in loans}, customers)
+
+
+def invalidate_all():
+    """For bulk loads that rewrite everything; the "loans" cache holds nothing else."""
+    transaction.on_commit(cache.clear)
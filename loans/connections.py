@@ -0,0 +1,69 @@
+# loans/connections.py
+"""
+Per-process database connection stats: how often connections are opened and,
+when DB_POOL is on, the psycopg pool's utilization and wait times. A steadily
+climbing connections_opened on a web process means connections are not being
+reused (CONN_MAX_AGE=0 and no pool).
+"""
+import threading
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+_lock = threading.Lock()
+_opened = {}
+
+
+def _count_connection(sender, connection, **kwargs):
+    with _lock:
+        _opened[connection.alias] = _opened.get(connection.alias, 0) + 1
+
+
+def install():
+    """Start counting new connections (called from LoansConfig.ready)."""
+    connection_created.connect(_count_connection, dispatch_uid="loans.connections.count")
+
+
+def pool_stats(pool) -> dict:
+    """Utilization and wait-time figures from a psycopg_pool.ConnectionPool."""
+    raw = pool.get_stats()
+    size, available, requests = raw.get("pool_size", 0), raw.get("pool_available", 0), raw.get("requests_num", 0)
+    in_use = size - available
+    wait_ms = raw.get("requests_wait_ms", 0)
+    return {
+        "min_size": raw.get("pool_min"),
+        "max_size": raw.get("pool_max"),
+        "size": size,
+        "available": available,
+        "in_use": in_use,
+        "utilization": round(in_use / raw["pool_max"], 4) if raw.get("pool_max") else None,
+        "requests": requests,
+        "requests_waiting": raw.get("requests_waiting", 0),
+        "requests_queued": raw.get("requests_queued", 0),
+        "requests_timed_out": raw.get("requests_errors", 0),
+        "wait_ms_total": wait_ms,
+        "wait_ms_avg": round(wait_ms / requests, 3) if requests else None,
+        "connections_made": raw.get("connections_num", 0),
+        "connect_ms_total": raw.get("connections_ms", 0),
+        "connections_lost": raw.get("connections_lost", 0),
+    }
+
+
+def connection_stats() -> dict:
+    """{alias: stats} for every configured database, for this process."""
+    stats = {}
+    for alias in connections:
+        conn = connections[alias]
+        pool = getattr(conn, "pool", None) if conn.settings_dict["OPTIONS"].get("pool") else None
+        with _lock:
+            opened = _opened.get(alias, 0)
+        stats[alias] = {
+            "vendor": conn.vendor,
+            "pooled": pool is not None,
+            "conn_max_age": conn.settings_dict["CONN_MAX_AGE"],
+            "health_checks": conn.settings_dict["CONN_HEALTH_CHECKS"],
+            "connections_opened": opened,
+        }
+        if pool is not None:
+            stats[alias]["pool"] = pool_stats(pool)
+    return stats
@@ -0,0 +1,89 @@
+# loans/emi.py
+"""
+Vectorized EMI / amortization engine.
+
+calculate_emis() is the array form of utils.calculate_emi: the same float
+formula evaluated element-wise, so results agree to the paisa.
+"""
+import numpy as np
+
+
+def round_paisa(values) -> np.ndarray:
+    """
+    Round to 2 decimals exactly like Python's round(x, 2). np.round scales by 100
+    first, which can flip values sitting next to a half-paisa; those few elements
+    are re-rounded in Python.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    flat = values.reshape(-1)
+    scaled = flat * 100.0
+    rounded = np.rint(scaled) / 100.0
+    near_half = (np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6) & np.isfinite(flat)
+    if near_half.any():
+        rounded[near_half] = [round(float(v), 2) for v in flat[near_half]]
+    return rounded.reshape(values.shape)
+
+
+def calculate_emis(principals, annual_rates_percent, tenures_months) -> np.ndarray:
+    """
+    EMIs for whole arrays of (principal, annual rate %, tenure in months).
+    Inputs broadcast against each other; returns float64 rounded to 2 decimals.
+    Non-positive tenures give 0.0, zero rates fall back to straight division.
+    """
+    P = np.asarray(principals, dtype=np.float64)
+    r = np.asarray(annual_rates_percent, dtype=np.float64) / 100.0 / 12.0
+    n = np.asarray(tenures_months, dtype=np.int64)
+    P, r, n = np.broadcast_arrays(P, r, n)
+
+    safe_n = np.where(n > 0, n, 1)
+    growth = (1 + r) ** safe_n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        emi = np.where(r == 0, P / safe_n, P * r * growth / (growth - 1))
+    emi = np.where(n > 0, emi, 0.0)
+    return round_paisa(emi)
+
+
+def amortization_schedule(principal, annual_rate_percent, tenure_months: int, emi: float = None) -> dict:
+    """
+    Month-by-month schedule for one loan as arrays (month, payment, interest,
+    principal, balance), all rounded to 2 decimals. emi defaults to the
+    calculate_emis() value; the last payment absorbs rounding so balance ends at 0.
+    An emi above the formula value pays the loan off early: the schedule stops
+    in the month the balance reaches 0, and that payment is only what is owed.
+    """
+    tenure_months = int(tenure_months)
+    if tenure_months <= 0:
+        empty = np.zeros(0)
+        return {"month": empty.astype(np.int64), "payment": empty, "interest": empty, "principal": empty, "balance": empty}
+
+    P = float(principal)
+    r = float(annual_rate_percent) / 100.0 / 12.0
+    if emi is None:
+        emi = float(calculate_emis(P, annual_rate_percent, tenure_months))
+
+    months = np.arange(1, tenure_months + 1)
+    # closing balance after k payments: P*g^k - emi*(g^k - 1)/r (or P - emi*k when r == 0)
+    if r == 0:
+        balance = P - emi * months
+    else:
+        growth = (1 + r) ** months
+        balance = P * growth - emi * (growth - 1) / r
+    # paid off in the first month whose closing balance is not positive (or at the tenure)
+    paid_off = np.flatnonzero(balance <= 0)
+    months = months[:paid_off[0] + 1] if len(paid_off) else months
+    opening = np.clip(np.concatenate(([P], balance[:len(months) - 1])), 0.0, None)
+
+    interest = opening * r
+    # never more than is still owed; the final installment settles whatever is left
+    payment = np.minimum(emi, opening + interest)
+    payment[-1] = opening[-1] + interest[-1]
+    principal_paid = payment - interest
+    balance = np.clip(opening - principal_paid, 0.0, None)
+
+    return {
+        "month": months,
+        "payment": round_paisa(payment),
+        "interest": round_paisa(interest),
+        "principal": round_paisa(principal_paid),
+        "balance": round_paisa(balance),
+    }
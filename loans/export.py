@@ -0,0 +1,148 @@
+# loans/export.py
+"""
+Bulk export of the loan portfolio, one row per loan with its customer, for
+GET /api/export/loans and the export_loans command.
+
+Rows are read in keyset pages on loan_id. Each page is a single statement run
+outside any transaction and iterated through a server-side cursor, so memory
+stays flat whatever the portfolio size, and the export never keeps a
+transaction (or its snapshot) open on the primary for longer than one page.
+Pages are read from a healthy replica when one is configured (loans.routers).
+Archived loans (loans.archive) follow the hot table unless excluded.
+"""
+import csv
+import json
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import BooleanField, Value
+
+from .models import Loan, LoanArchive
+from .routers import choose_replica
+
+EXPORT_COLUMNS = (
+    "loan_id", "customer_id", "first_name", "last_name", "phone_number", "monthly_income", "approved_limit",
+    "loan_amount", "tenure", "interest_rate", "monthly_repayment", "emis_paid_on_time",
+    "start_date", "end_date", "is_active", "archived",
+)
+# streamable formats -> content type (Parquet is written to files only, see write_parquet)
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+_SOURCE_FIELDS = (
+    "loan_id", "customer__customer_id", "customer__first_name", "customer__last_name", "customer__phone_number",
+    "customer__monthly_income", "customer__approved_limit", "loan_amount", "tenure", "interest_rate",
+    "monthly_repayment", "emis_paid_on_time", "start_date", "end_date", "is_active", "archived",
+)
+
+
+def _sources(active, start_date_from, start_date_to, include_archived) -> list:
+    filters = {}
+    if start_date_from is not None:
+        filters["start_date__gte"] = start_date_from
+    if start_date_to is not None:
+        filters["start_date__lte"] = start_date_to
+
+    loans = Loan.objects.filter(**filters).annotate(archived=Value(False, output_field=BooleanField()))
+    if active is not None:
+        loans = loans.filter(is_active=active)
+    sources = [loans]
+    # archived loans are all closed
+    if include_archived and not active:
+        sources.append(LoanArchive.objects.filter(**filters).annotate(
+            is_active=Value(False, output_field=BooleanField()), archived=Value(True, output_field=BooleanField()),
+        ))
+    return sources
+
+
+def iter_loan_rows(active: bool = None, start_date_from: date = None, start_date_to: date = None,
+                   include_archived: bool = True, page_size: int = None, chunk_size: int = None):
+    """
+    Yield export rows (tuples in EXPORT_COLUMNS order) ordered by loan_id, hot
+    loans first, then archived ones. active=None exports both active and closed loans.
+    """
+    page_size = page_size or settings.EXPORT_PAGE_SIZE
+    chunk_size = min(chunk_size or settings.STREAM_CHUNK_SIZE, page_size)
+    alias = choose_replica() or DEFAULT_DB_ALIAS
+    for source in _sources(active, start_date_from, start_date_to, include_archived):
+        after = None
+        while True:
+            page = source.using(alias).order_by("loan_id").values_list(*_SOURCE_FIELDS)
+            if after is not None:
+                page = page.filter(loan_id__gt=after)
+            count = 0
+            for row in page[:page_size].iterator(chunk_size=chunk_size):
+                count += 1
+                yield row
+            if count < page_size:
+                break
+            after = row[0]
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+class _Echo:
+    """File-like object whose write() returns the line, for csv.writer inside a generator."""
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    """CSV lines (header first) for export rows."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_ndjson(rows):
+    """One JSON object per line for export rows."""
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, map(_plain, row)))) + "\n"
+
+
+def encode(rows, fmt: str):
+    """Lines of the export in fmt ("csv" or "ndjson")."""
+    return iter_csv(rows) if fmt == "csv" else iter_ndjson(rows)
+
+
+def write_parquet(rows, path: str, row_group_size: int = None) -> int:
+    """Write export rows to a Parquet file one row group at a time (needs pyarrow). Returns the row count."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise ImportError("Writing .parquet files requires pyarrow (pip install pyarrow)") from exc
+
+    decimal = pa.decimal128(12, 2)
+    schema = pa.schema([
+        ("loan_id", pa.int64()), ("customer_id", pa.int64()), ("first_name", pa.string()),
+        ("last_name", pa.string()), ("phone_number", pa.string()), ("monthly_income", decimal),
+        ("approved_limit", decimal), ("loan_amount", decimal), ("tenure", pa.int32()),
+        ("interest_rate", pa.decimal128(5, 2)), ("monthly_repayment", decimal), ("emis_paid_on_time", pa.int32()),
+        ("start_date", pa.date32()), ("end_date", pa.date32()), ("is_active", pa.bool_()), ("archived", pa.bool_()),
+    ])
+    row_group_size = row_group_size or settings.STREAM_CHUNK_SIZE
+
+    def row_group(batch):
+        return pa.Table.from_pylist([dict(zip(EXPORT_COLUMNS, row)) for row in batch], schema=schema)
+
+    total, batch = 0, []
+    with pq.ParquetWriter(path, schema) as writer:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= row_group_size:
+                writer.write_table(row_group(batch))
+                total += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(row_group(batch))
+            total += len(batch)
+    return total
@@ -0,0 +1,144 @@
+# loans/ids.py
+"""
+Contention-free allocation of external ids (Customer.customer_id, Loan.loan_id).
+
+PostgreSQL uses a database sequence per id kind: nextval() never blocks and is
+not rolled back. Elsewhere each process leases a block of ids from the IdBlock
+table and hands them out locally, touching the table once per block. Ids written
+directly (ingestion) may land in a block another process already holds, so each
+id handed out from a block is checked against the id column's index first.
+"""
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connection, models, transaction
+
+from .models import Customer, IdBlock, Loan
+
+ID_COLUMNS = {
+    "customer": (Customer, "customer_id"),
+    "loan": (Loan, "loan_id"),
+}
+
+_lock = threading.Lock()
+_blocks = {}  # kind -> [next, end) still available in this process
+_ensured_sequences = set()
+
+
+def allocate_id(kind: str) -> int:
+    """Next unused external id for kind ("customer" or "loan")."""
+    if kind not in ID_COLUMNS:
+        raise ValueError(f"unknown id kind: {kind}")
+    if connection.vendor == "postgresql":
+        return _next_from_sequence(kind)
+    return _next_from_block(kind)
+
+
+def sync_id_allocator(kind: str) -> None:
+    """
+    Move the allocator past ids written directly (e.g. by ingestion), so it never
+    hands out an id that already exists.
+    """
+    if connection.vendor == "postgresql":
+        # setval reads the column's max itself
+        _ensured_sequences.discard(kind)
+        with connection.cursor() as cursor:
+            _ensure_sequence(cursor, kind)
+        return
+    model, field = ID_COLUMNS[kind]
+    current_max = model.objects.aggregate(m=models.Max(field))["m"] or 0
+    IdBlock.objects.filter(name=kind, next_value__lte=current_max).update(next_value=current_max + 1)
+    # the rest of a block this process already leased may now be taken; blocks
+    # held by other processes are caught by the check in _next_from_block
+    _skip_block(kind, current_max)
+
+
+def _sequence_name(kind: str) -> str:
+    return f"loans_{kind}_external_id_seq"
+
+
+def _ensure_sequence(cursor, kind: str) -> None:
+    model, field = ID_COLUMNS[kind]
+    seq = connection.ops.quote_name(_sequence_name(kind))
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(model._meta.get_field(field).column)
+    cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {seq}")
+    # only ever move forward: setval when the table already holds larger ids
+    cursor.execute(
+        f"SELECT setval('{seq}', m.max_id) "
+        f"FROM (SELECT COALESCE(MAX({column}), 0) AS max_id FROM {table}) m, {seq} s "
+        f"WHERE m.max_id > 0 AND (m.max_id > s.last_value OR (m.max_id = s.last_value AND NOT s.is_called))"
+    )
+    # CREATE SEQUENCE is transactional: only trust it once the caller's transaction
+    # has committed (immediately under autocommit), or a rollback would leave this
+    # process calling nextval() on a sequence that no longer exists
+    transaction.on_commit(lambda: _ensured_sequences.add(kind))
+
+
+def _next_from_sequence(kind: str) -> int:
+    with connection.cursor() as cursor:
+        if kind not in _ensured_sequences:
+            _ensure_sequence(cursor, kind)
+        cursor.execute("SELECT nextval(%s)", [_sequence_name(kind)])
+        return cursor.fetchone()[0]
+
+
+def _next_from_block(kind: str) -> int:
+    model, field = ID_COLUMNS[kind]
+    while True:
+        value, end = _take_from_block(kind)
+        # one range lookup on the unique index: the last id already written in
+        # what is left of this block, if any
+        taken = model.objects.filter(**{f"{field}__range": (value, end - 1)}).aggregate(m=models.Max(field))["m"]
+        if taken is None:
+            return value
+        _skip_block(kind, taken)
+
+
+def _take_from_block(kind: str) -> tuple:
+    """Next id from this process's block (leasing a new one when it runs out) and the block's end."""
+    with _lock:
+        block = _blocks.get(kind)
+        if block and block[0] < block[1]:
+            value = block[0]
+            block[0] += 1
+            return value, block[1]
+
+    start, end = _lease_block(kind, settings.ID_BLOCK_SIZE)
+
+    def install():
+        with _lock:
+            _blocks[kind] = [start + 1, end]
+
+    # if the caller's transaction rolls back, so does the lease; only keep the
+    # rest of the block once it is committed (immediately under autocommit)
+    transaction.on_commit(install)
+    return start, end
+
+
+def _skip_block(kind: str, taken: int) -> None:
+    """Move this process's block past taken (an exhausted block is simply re-leased)."""
+    with _lock:
+        block = _blocks.get(kind)
+        if block and block[0] <= taken:
+            block[0] = taken + 1
+
+
+def _lease_block(kind: str, size: int) -> tuple:
+    """Reserve ids [start, start + size) in IdBlock and return (start, end)."""
+    model, field = ID_COLUMNS[kind]
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                block = IdBlock.objects.select_for_update().filter(name=kind).first()
+                if block is None:
+                    current_max = model.objects.aggregate(m=models.Max(field))["m"] or 0
+                    block = IdBlock.objects.create(name=kind, next_value=current_max + 1)
+                start = block.next_value
+                block.next_value = start + size
+                block.save(update_fields=["next_value"])
+                return start, start + size
+        except IntegrityError:
+            # another process created the row first; lock it and retry
+            continue
+    raise RuntimeError(f"could not lease an id block for {kind}")
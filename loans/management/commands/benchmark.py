@@ -0,0 +1,85 @@
+import json
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from loans.benchmark import (
+    WRITE_ENDPOINTS, HttpTransport, InProcessTransport, generate_traffic, load_traffic,
+    loan_url_names, run_load, seed_database,
+)
+from loans.models import Customer, Loan
+
+class Command(BaseCommand):
+    help = ("Seed (optionally) and load-test every loans endpoint, reporting p50/p95/p99 latency, "
+            "req/s and SQL queries per request per endpoint")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed-customers", type=int, default=0,
+                            help="First add this many synthetic customers (and their loans) to the database")
+        parser.add_argument("--loans-per-customer", type=int, default=5, help="Average loans per seeded customer")
+        parser.add_argument("--requests", type=int, default=2000, help="Generated requests to send")
+        parser.add_argument("--concurrency", type=int, default=8, help="Concurrent client threads")
+        parser.add_argument("--endpoints", nargs="+", choices=loan_url_names(), default=None,
+                            help="Restrict generated traffic to these url names (default: all)")
+        parser.add_argument("--read-only", action="store_true",
+                            help="Leave out " + ", ".join(sorted(WRITE_ENDPOINTS)))
+        parser.add_argument("--replay", default=None,
+                            help='Replay a JSONL file of {"method", "path", "body"} lines instead of generated traffic')
+        parser.add_argument("--url", default=None,
+                            help="Send requests to a running server at this base URL instead of in-process "
+                                 "(SQL queries are then not counted)")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for seeding and traffic")
+        parser.add_argument("--output", default=None, help="Write the full report as JSON to this file")
+
+    def handle(self, *args, **options):
+        seeded = None
+        if options["seed_customers"]:
+            seeded = seed_database(options["seed_customers"], options["loans_per_customer"], options["seed"])
+            self.stdout.write(f"Seeded {seeded['customers']} customers and {seeded['loans']} loans")
+
+        if options["replay"]:
+            try:
+                traffic = load_traffic(options["replay"])
+            except (OSError, ValueError) as exc:
+                raise CommandError(str(exc))
+        else:
+            endpoints = options["endpoints"] or loan_url_names()
+            if options["read_only"]:
+                endpoints = [name for name in endpoints if name not in WRITE_ENDPOINTS]
+            customer_ids = list(Customer.objects.values_list("id", flat=True)[:10000])
+            loan_ids = list(Loan.objects.values_list("loan_id", flat=True)[:10000])
+            try:
+                traffic = generate_traffic(options["requests"], customer_ids, loan_ids, endpoints, options["seed"])
+            except ValueError as exc:
+                raise CommandError(f"{exc} (see --seed-customers)")
+
+        transport = HttpTransport(options["url"]) if options["url"] else InProcessTransport()
+        report = run_load(traffic, transport, options["concurrency"])
+
+        self.stdout.write(f"{'endpoint':<26}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}")
+        rows = list(report["endpoints"].items()) + [("total", report)]
+        for endpoint, stats in rows:
+            self.stdout.write(
+                f"{endpoint:<26}{stats['requests']:>9}{stats['requests_per_second']:>9}{stats['p50_ms']:>9}"
+                f"{stats['p95_ms']:>9}{stats['p99_ms']:>9}{str(stats.get('queries_per_request', '-')):>9}"
+            )
+        errors = {code: n for code, n in report["statuses"].items() if code == "error" or code >= "500"}
+        if errors:
+            self.stderr.write(f"Server errors: {errors}")
+
+        if options["output"]:
+            document = {
+                "started_at": timezone.now().isoformat(),
+                "database": connection.vendor,
+                "python": platform.python_version(),
+                "transport": "http" if options["url"] else "in-process",
+                "traffic": options["replay"] or "generated",
+                "seeded": seeded,
+                "customers": Customer.objects.count(),
+                "loans": Loan.objects.count(),
+                **report,
+            }
+            with open(options["output"], "w") as fh:
+                json.dump(document, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from loans.benchmark import HttpTransport, generate_traffic, run_load
+from loans.models import Customer, Loan
+
+# endpoint -> (sync url name, async url name)
+ENDPOINTS = {
+    "check-eligibility": ("check-eligibility", "async-check-eligibility"),
+    "view-loan": ("view-loan", "async-view-loan"),
+    "view-loans": ("view-loans", "async-view-loans"),
+    "create-loan": ("create-loan", "async-create-loan"),
+}
+
+class Command(BaseCommand):
+    help = ("Compare the sync views (gunicorn/WSGI) with their async variants (ASGI) "
+            "under the same concurrent load against running servers")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sync-url", default="http://localhost:8000", help="Base URL of the WSGI deployment")
+        parser.add_argument("--async-url", default=None, help="Base URL of the ASGI deployment (default: --sync-url)")
+        parser.add_argument("--requests", type=int, default=2000, help="Requests per endpoint and variant")
+        parser.add_argument("--concurrency", type=int, default=64, help="Concurrent clients")
+        parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS),
+                            default=["check-eligibility", "view-loan", "view-loans"],
+                            help="create-loan writes loans, so it only runs when listed explicitly")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", default=None, help="Also write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        customer_ids = list(Customer.objects.values_list("id", flat=True)[:10000])
+        loan_ids = list(Loan.objects.values_list("loan_id", flat=True)[:10000])
+        if not customer_ids or not loan_ids:
+            raise CommandError("Load customers and loans first; the benchmark samples ids from the database")
+        bases = {"sync": options["sync_url"], "async": options["async_url"] or options["sync_url"]}
+
+        results = {}
+        for endpoint in options["endpoints"]:
+            results[endpoint] = {}
+            for variant, url_name in zip(("sync", "async"), ENDPOINTS[endpoint]):
+                traffic = generate_traffic(options["requests"], customer_ids, loan_ids, [url_name], options["seed"])
+                report = run_load(traffic, HttpTransport(bases[variant]), options["concurrency"])
+                report.pop("endpoints")
+                results[endpoint][variant] = report
+                self.stdout.write(
+                    f"{endpoint:<18} {variant:<5} {report['requests_per_second']:>8} req/s  "
+                    f"p50 {report['p50_ms']} ms  p95 {report['p95_ms']} ms  p99 {report['p99_ms']} ms  "
+                    f"{report['statuses']}"
+                )
+
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
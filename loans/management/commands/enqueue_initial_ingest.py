@@ -1,5 +1,6 @@
-from django.core.management.base import BaseCommand
-from loans.tasks import ingest_customers, ingest_loans
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from loans.tasks import ingest_files, fast_ingest_files
 
 class Command(BaseCommand):
     help = "Enqueue background ingestion of customer and loan data"
@@ -7,12 +8,34 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("customers_file", type=str, help="Path to customer_data.xlsx")
         parser.add_argument("loans_file", type=str, help="Path to loan_data.xlsx")
+        parser.add_argument(
+            "--fast", action="store_true",
+            help="Stream both files through COPY and merge set-based (PostgreSQL; "
+                 "other backends use the bulk ORM path)",
+        )
+        parser.add_argument("--shards", type=int, default=None,
+                            help=f"Parallel shard tasks per file (default: INGEST_SHARDS={settings.INGEST_SHARDS})")
+        parser.add_argument("--reject-file", type=str, default=None,
+                            help="Where loans whose customer is missing are written "
+                                 "(default: <loans_file>.rejects.csv, suffixed per shard)")
+        parser.add_argument("--force", action="store_true",
+                            help="Re-read files already ingested to the end (unchanged rows are still not rewritten)")
 
     def handle(self, *args, **options):
         customers_file = options["customers_file"]
         loans_file = options["loans_file"]
 
-        ingest_customers.delay(customers_file)
-        ingest_loans.delay(loans_file)
+        if options["fast"]:
+            if options["shards"] is not None or options["force"]:
+                raise CommandError("--shards and --force only apply to the sharded ingest; drop --fast")
+            fast_ingest_files.delay(customers_file, loans_file, reject_file=options["reject_file"])
+            self.stdout.write(self.style.SUCCESS("Fast ingestion task enqueued"))
+            return
+
+        # customers shards -> barrier -> loan shards -> summary, so loans never race ahead
+        ingest_files.delay(
+            customers_file, loans_file, shards=options["shards"], reject_file=options["reject_file"],
+            force=options["force"],
+        )
 
         self.stdout.write(self.style.SUCCESS("Ingestion tasks enqueued"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from loans.utils import refresh_credit_snapshots, verify_credit_snapshots
+
+class Command(BaseCommand):
+    help = "Rebuild (or verify) the per-customer credit snapshots from loan history"
+
+    def add_arguments(self, parser):
+        parser.add_argument("customer_ids", nargs="*", type=int, help="Internal customer ids (default: all)")
+        parser.add_argument("--verify", action="store_true", help="Only report snapshots that differ from loan history")
+
+    def handle(self, *args, **options):
+        customer_ids = options["customer_ids"] or None
+
+        if options["verify"]:
+            mismatched = verify_credit_snapshots(customer_ids)
+            if mismatched:
+                preview = ", ".join(str(pk) for pk in mismatched[:20])
+                raise CommandError(f"{len(mismatched)} snapshot(s) missing or out of date: {preview}")
+            self.stdout.write(self.style.SUCCESS("All credit snapshots match loan history"))
+            return
+
+        rebuilt = refresh_credit_snapshots(customer_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(rebuilt)} credit snapshots"))
@@ -0,0 +1,64 @@
+import json
+import random
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from loans.benchmark import time_active_set
+from loans.maturity import sweep_matured_loans
+from loans.models import Customer
+from loans.tasks import sweep_matured_loans_task
+
+class Command(BaseCommand):
+    help = "Deactivate loans whose end date has passed, in short batched transactions (resumable)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", type=date.fromisoformat, default=None,
+                            help="Treat loans ending before this day as matured (YYYY-MM-DD; default: today)")
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Loans per transaction (default: MATURITY_SWEEP_BATCH_SIZE)")
+        parser.add_argument("--max-batches", type=int, default=None,
+                            help="Stop after this many batches; the next run continues from there")
+        parser.add_argument("--enqueue", action="store_true", help="Run as a Celery task instead of inline")
+        parser.add_argument("--benchmark", type=int, default=0, metavar="CUSTOMERS",
+                            help="Time the active-set reads for this many sampled customers before and after")
+        parser.add_argument("--output", default=None, help="Write the sweep report (and benchmark) as JSON to this file")
+
+    def handle(self, *args, **options):
+        if options["enqueue"]:
+            if options["benchmark"] or options["output"]:
+                raise CommandError("--benchmark and --output need an inline run; drop --enqueue")
+            sweep_matured_loans_task.delay(
+                batch_size=options["batch_size"], max_batches=options["max_batches"],
+                today=options["date"].isoformat() if options["date"] else None,
+            )
+            self.stdout.write(self.style.SUCCESS("Maturity sweep enqueued"))
+            return
+
+        sample = []
+        if options["benchmark"]:
+            pks = list(Customer.objects.values_list("pk", flat=True))
+            sample = random.Random(0).sample(pks, min(options["benchmark"], len(pks)))
+            before = time_active_set(sample)
+
+        report = sweep_matured_loans(today=options["date"], batch_size=options["batch_size"],
+                                     max_batches=options["max_batches"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deactivated {report['deactivated']} matured loans in {report['batches']} batches "
+            f"({report['seconds']}s){'; more remain' if report['remaining'] else ''}"
+        ))
+
+        if sample:
+            after = time_active_set(sample)
+            report["benchmark"] = {"customers": len(sample), "before": before, "after": after}
+            self.stdout.write(f"active loans: {before['active_loans']} -> {after['active_loans']}")
+            self.stdout.write(f"{'query':<28}{'before p50 ms':>15}{'after p50 ms':>15}{'before p95':>12}{'after p95':>12}")
+            for name, stats in before["queries"].items():
+                now = after["queries"][name]
+                self.stdout.write(
+                    f"{name:<28}{stats['p50_ms']:>15}{now['p50_ms']:>15}{stats['p95_ms']:>12}{now['p95_ms']:>12}"
+                )
+
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(report, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
@@ -0,0 +1,91 @@
+# loans/maturity.py
+"""
+Loan maturity sweeper.
+
+A loan is active until its end_date has passed. Ingestion sets is_active from
+end_date at load time; sweep_matured_loans() deactivates the loans that have
+matured since, so the is_active=True reads (credit snapshots, view-loans,
+rescoring) only ever see the current book instead of all of history.
+
+The sweep runs in short transactions of at most batch_size loans. Each batch
+locks its customers (in pk order, like ingestion, and like create-loan's
+per-customer lock), flips the loans, rebuilds those customers' snapshots,
+updates the portfolio rollups and drops their cached responses, then commits.
+Deactivated loans drop out of the sweep's own filter, so an interrupted run
+resumes where it stopped.
+"""
+import logging
+import time
+from datetime import date
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import invalidate
+from .models import Customer, Loan
+from .portfolio import LOAN_FIELDS, add_loan, apply_deltas, batched
+from .utils import refresh_credit_snapshots
+
+logger = logging.getLogger(__name__)
+
+
+def matured_loans(today: date):
+    """Loans still flagged active whose end date is before today (served by loan_active_end_idx)."""
+    return Loan.objects.filter(is_active=True, end_date__lt=today)
+
+
+def sweep_matured_loans(today: date = None, batch_size: int = None, max_batches: int = None) -> dict:
+    """
+    Deactivate matured loans batch by batch; max_batches bounds one run (the rest
+    is picked up by the next). Returns counts and timing.
+    """
+    started = time.monotonic()
+    today = today or timezone.now().date()
+    batch_size = batch_size or settings.MATURITY_SWEEP_BATCH_SIZE
+
+    deactivated = batches = 0
+    while max_batches is None or batches < max_batches:
+        swept = _sweep_batch(today, batch_size)
+        if not swept:
+            break
+        deactivated += swept
+        batches += 1
+
+    report = {
+        "swept_on": today.isoformat(),
+        "deactivated": deactivated,
+        "batches": batches,
+        "remaining": matured_loans(today).exists(),
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    logger.info("maturity sweep: %(deactivated)s loans deactivated in %(batches)s batches (%(seconds)ss)", report)
+    return report
+
+
+def _sweep_batch(today: date, batch_size: int) -> int:
+    with transaction.atomic():
+        batch = list(
+            matured_loans(today).order_by("end_date", "pk").values_list("pk", "loan_id", "customer_id")[:batch_size]
+        )
+        if not batch:
+            return 0
+        customer_ids = {customer_id for _, _, customer_id in batch}
+        customers = list(
+            Customer.objects.select_for_update().filter(pk__in=customer_ids).order_by("pk").values_list("pk", "customer_id")
+        )
+        # a concurrent writer may have changed a loan since it was read; only flip matured ones
+        matured = list(matured_loans(today).filter(pk__in=[pk for pk, _, _ in batch]).only(*LOAN_FIELDS))
+        swept = Loan.objects.filter(pk__in=[loan.pk for loan in matured]).update(is_active=False)
+        # QuerySet.update bypasses Loan.save: rebuild the snapshots, move the loans out of
+        # the active portfolio rollups and drop cached responses here
+        with batched():
+            rollup = {}
+            for loan in matured:
+                add_loan(rollup, loan, -1)
+                loan.is_active = False
+                add_loan(rollup, loan, 1)
+            apply_deltas(rollup)
+            refresh_credit_snapshots(customer_ids, today=today)
+        invalidate([loan_id for _, loan_id, _ in batch], customers)
+    return swept
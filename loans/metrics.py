@@ -0,0 +1,173 @@
+# loans/metrics.py
+"""
+Prometheus metrics for the API and the ingest tasks, exposed at /metrics.
+
+- MetricsMiddleware: per-endpoint latency, status counts, and SQL queries and
+  time per request (for streamed responses, once the body has been sent).
+  Queries are counted by a wrapper attached once to every new database
+  connection; outside a request it only does a ContextVar lookup.
+- timed(): latency of the scoring / EMI helpers.
+- Celery task durations (task_prerun/task_postrun) and ingest row counts
+  (record_ingest, fed by loans.tasks._report).
+
+With several processes (gunicorn workers, Celery children) set
+PROMETHEUS_MULTIPROC_DIR to a directory they all share; /metrics then
+aggregates every process's samples. Without it each process reports its own.
+"""
+import contextvars
+import os
+import socket
+import time
+from functools import wraps
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess, values,
+)
+
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+if MULTIPROCESS:
+    # containers sharing the directory reuse pids; keep their sample files apart
+    values.ValueClass = values.MultiProcessValue(lambda: f"{socket.gethostname()}_{os.getpid()}")
+
+LATENCY_BUCKETS = (0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FUNCTION_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+TASK_BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600)
+
+REQUEST_DURATION = Histogram(
+    "loans_http_request_duration_seconds", "Request latency", ["endpoint", "method"], buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter("loans_http_requests", "Requests served", ["endpoint", "method", "status"])
+DB_QUERIES = Histogram(
+    "loans_db_queries_per_request", "SQL statements executed per request", ["endpoint"], buckets=QUERY_BUCKETS,
+)
+DB_TIME = Histogram(
+    "loans_db_time_per_request_seconds", "Time spent in SQL per request", ["endpoint"], buckets=LATENCY_BUCKETS,
+)
+FUNCTION_DURATION = Histogram(
+    "loans_function_duration_seconds", "Time spent in scoring / EMI helpers", ["function"], buckets=FUNCTION_BUCKETS,
+)
+TASK_DURATION = Histogram(
+    "loans_celery_task_duration_seconds", "Celery task run time", ["task", "state"], buckets=TASK_BUCKETS,
+)
+INGEST_ROWS = Counter("loans_ingest_rows", "Rows handled by ingest tasks", ["kind", "outcome"])
+
+INGEST_OUTCOMES = ("inserted", "updated", "unchanged", "skipped", "rejected")
+
+_request_db = contextvars.ContextVar("loans_request_db", default=None)
+_task_started = {}
+
+
+class DbUsage:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+def _record_query(execute, sql, params, many, context):
+    usage = _request_db.get()
+    if usage is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        usage.queries += 1
+        usage.seconds += time.perf_counter() - started
+
+
+def _attach_query_recorder(sender, connection, **kwargs):
+    # sent on every connect (per request when pooled); the wrapper list outlives it
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def track_db_usage() -> tuple:
+    """Start counting this context's SQL; returns (usage, token for stop_db_usage)."""
+    usage = DbUsage()
+    return usage, _request_db.set(usage)
+
+
+def stop_db_usage(token):
+    _request_db.reset(token)
+
+
+def iter_tracked(iterable, usage: DbUsage):
+    """
+    Iterate iterable with its SQL counted into usage: a streamed response body
+    is produced after the view (and track_db_usage's context) has returned.
+    """
+    iterator = iter(iterable)
+    while True:
+        token = _request_db.set(usage)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _request_db.reset(token)
+        yield item
+
+
+def observe_request(endpoint: str, method: str, status: int, seconds: float, usage: DbUsage):
+    REQUEST_DURATION.labels(endpoint, method).observe(seconds)
+    REQUESTS.labels(endpoint, method, str(status)).inc()
+    DB_QUERIES.labels(endpoint).observe(usage.queries)
+    DB_TIME.labels(endpoint).observe(usage.seconds)
+
+
+def timed(name: str):
+    """Decorator: observe the wrapped function's run time as loans_function_duration_seconds{function=name}."""
+    histogram = FUNCTION_DURATION.labels(name)
+
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+def record_ingest(report: dict):
+    """Count the rows of one ingest report (see loans.tasks._report)."""
+    kind = report["kind"]
+    INGEST_ROWS.labels(kind, "processed").inc(report.get("rows", 0))
+    for outcome in INGEST_OUTCOMES:
+        if report.get(outcome):
+            INGEST_ROWS.labels(kind, outcome).inc(report[outcome])
+
+
+def _task_prerun(task_id=None, **kwargs):
+    _task_started[task_id] = time.monotonic()
+
+
+def _task_postrun(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_DURATION.labels(task.name, state or "UNKNOWN").observe(time.monotonic() - started)
+
+
+def install():
+    """Hook query counting into new DB connections and time Celery tasks (from LoansConfig.ready)."""
+    from celery.signals import task_postrun, task_prerun
+    from django.db.backends.signals import connection_created
+
+    connection_created.connect(_attach_query_recorder, dispatch_uid="loans.metrics.queries")
+    task_prerun.connect(_task_prerun, dispatch_uid="loans.metrics.task_prerun")
+    task_postrun.connect(_task_postrun, dispatch_uid="loans.metrics.task_postrun")
+
+
+def render() -> tuple:
+    """(body, content type) of the Prometheus text exposition."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
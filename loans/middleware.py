@@ -0,0 +1,126 @@
+# loans/middleware.py
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+from . import metrics
+from .routers import choose_replica, read_from
+
+# url names whose reads may be served by a replica
+REPLICA_READ_VIEWS = {
+    "check-eligibility", "check-eligibility-batch", "loan-offers", "view-loan", "view-loans",
+    "async-check-eligibility", "async-view-loan", "async-view-loans", "portfolio-summary",
+}
+# successful requests to these pin the client's reads to the primary for a while
+PRIMARY_STICKY_VIEWS = {"register", "create-loan", "async-create-loan"}
+
+STICKY_COOKIE = "read_primary"
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Route the reads of REPLICA_READ_VIEWS to a replica (see loans.routers), except
+    for clients that wrote recently: after a successful register/create-loan the
+    client gets a cookie that keeps its reads on the primary for
+    READ_YOUR_WRITES_SECONDS, so it always sees its own writes.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def url_name(request):
+        try:
+            return resolve(request.path_info).url_name
+        except Resolver404:
+            return None
+
+    @staticmethod
+    def wants_replica(request, name) -> bool:
+        return name in REPLICA_READ_VIEWS and STICKY_COOKIE not in request.COOKIES
+
+    @staticmethod
+    def finish(request, name, response):
+        if name in PRIMARY_STICKY_VIEWS and request.method == "POST" and response.status_code < 400:
+            response.set_cookie(STICKY_COOKIE, "1", max_age=settings.READ_YOUR_WRITES_SECONDS, httponly=True)
+        return response
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        name = self.url_name(request)
+        alias = choose_replica() if self.wants_replica(request, name) else None
+        with read_from(alias):
+            response = self.get_response(request)
+        return self.finish(request, name, response)
+
+    async def __acall__(self, request):
+        name = self.url_name(request)
+        alias = await sync_to_async(choose_replica)() if self.wants_replica(request, name) else None
+        with read_from(alias):
+            response = await self.get_response(request)
+        return self.finish(request, name, response)
+
+
+class MetricsMiddleware:
+    """
+    Record latency, status and SQL usage per endpoint (the resolved view name, so
+    label cardinality stays bounded) into loans.metrics. Goes first in MIDDLEWARE
+    so the timing covers the rest of the stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def record(request, response, started, usage):
+        match = getattr(request, "resolver_match", None)
+        endpoint = match.view_name if match is not None else "unmatched"
+        metrics.observe_request(endpoint, request.method, response.status_code, time.perf_counter() - started, usage)
+
+    def finish(self, request, response, started, usage):
+        if not response.streaming or response.is_async:
+            self.record(request, response, started, usage)
+            return response
+
+        # the body's queries run as it is sent; count them and record the request at the end
+        def body(content):
+            try:
+                yield from metrics.iter_tracked(content, usage)
+            finally:
+                self.record(request, response, started, usage)
+
+        response.streaming_content = body(response.streaming_content)
+        return response
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        usage, token = metrics.track_db_usage()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.stop_db_usage(token)
+        return self.finish(request, response, started, usage)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        usage, token = metrics.track_db_usage()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.stop_db_usage(token)
+        return self.finish(request, response, started, usage)
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, router, transaction
 
 class Customer(models.Model):
     # Django auto PK (id) stays
@@ -9,15 +9,51 @@ class Customer(models.Model):
     phone_number = models.CharField(max_length=15, unique=True)
     monthly_income = models.DecimalField(max_digits=12, decimal_places=2)
     approved_limit = models.DecimalField(max_digits=12, decimal_places=2)
+    source_hash = models.CharField(
+        max_length=32, blank=True, default="",
+        help_text="Digest of the spreadsheet row last ingested into this row; cleared by save()",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.customer_id})"
 
+    # view-loan responses embed customer details, and view-loans entries are keyed
+    # by either id, so any customer write drops both on commit. Income and limit
+    # place the customer in the portfolio rollups' bands (loans.portfolio).
+    def save(self, *args, **kwargs):
+        from .portfolio import restate_customers
+        adding = self._state.adding
+        # the next ingest rewrites this row even if its file row is unchanged (loans.tasks)
+        self.source_hash = ""
+        using = kwargs.get("using") or router.db_for_write(Customer, instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            if not adding:
+                restate_customers([self.pk], using=using)
+        self._invalidate_cached_responses(with_loans=not adding)
+
+    def delete(self, *args, **kwargs):
+        from .portfolio import forget_customers
+        using = kwargs.get("using") or router.db_for_write(Customer, instance=self)
+        self._invalidate_cached_responses()
+        with transaction.atomic(using=using):
+            forget_customers([self.pk], using=using)
+            return super().delete(*args, **kwargs)
+
+    def _invalidate_cached_responses(self, with_loans=True):
+        from .cache import invalidate
+        loan_ids = []
+        if with_loans:
+            loan_ids = list(self.loans.values_list("loan_id", flat=True))
+            loan_ids += self.archived_loans.values_list("loan_id", flat=True)
+        invalidate(loan_ids, [(self.pk, self.customer_id)])
+
 
 class Loan(models.Model):
-    # FK links to Django's internal ID
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="loans")
+    # FK links to Django's internal ID; loan_customer_start_idx leads with customer and
+    # serves every customer lookup, so the FK's own index would only slow writes
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="loans", db_index=False)
 
     loan_id = models.IntegerField(unique=True, db_index=True)  # Excel’s Loan ID
     loan_amount = models.DecimalField(max_digits=12, decimal_places=2)
@@ -28,6 +64,204 @@ class Loan(models.Model):
     start_date = models.DateField()
     end_date = models.DateField()
     is_active = models.BooleanField(default=True)
+    source_hash = models.CharField(
+        max_length=32, blank=True, default="",
+        help_text="Digest of the spreadsheet row last ingested into this row; cleared by save()",
+    )
+
+    class Meta:
+        indexes = [
+            # active loans of a customer (EMI / exposure sums, view-loans); on PostgreSQL
+            # INCLUDE makes those reads index-only
+            models.Index(
+                fields=["customer", "loan_id"], name="loan_customer_active_idx",
+                condition=models.Q(is_active=True),
+                include=["loan_amount", "monthly_repayment", "interest_rate", "end_date"],
+            ),
+            # loans started this year per customer (activity count)
+            models.Index(fields=["customer", "start_date"], name="loan_customer_start_idx"),
+            # active loans by end date: the maturity sweeper's work queue
+            models.Index(fields=["end_date"], name="loan_active_end_idx", condition=models.Q(is_active=True)),
+            # closed loans by end date: the archiver's work queue
+            models.Index(fields=["end_date"], name="loan_closed_end_idx", condition=models.Q(is_active=False)),
+        ]
 
     def __str__(self):
         return f"Loan {self.loan_id} for {self.customer.first_name}"
+
+    # Single-row writes keep the customer's credit snapshot in step inside the same
+    # transaction and drop the cached responses on commit. Bulk paths
+    # (QuerySet.update/bulk_create/delete) bypass these and must call
+    # utils.refresh_credit_snapshots and cache.invalidate for what they touched.
+    def save(self, *args, **kwargs):
+        from .cache import invalidate_loan_change
+        from .utils import apply_loan_change
+        using = kwargs.get("using") or router.db_for_write(Loan, instance=self)
+        with transaction.atomic(using=using):
+            previous = None
+            if not self._state.adding and self.pk is not None:
+                previous = Loan.objects.using(using).filter(pk=self.pk).first()
+            # not what the file said any more: the next ingest rewrites it (loans.tasks)
+            self.source_hash = ""
+            super().save(*args, **kwargs)
+            apply_loan_change(previous, self, using=using)
+            invalidate_loan_change(previous, self)
+
+    def delete(self, *args, **kwargs):
+        from .cache import invalidate_loan_change
+        from .utils import apply_loan_change
+        using = kwargs.get("using") or router.db_for_write(Loan, instance=self)
+        with transaction.atomic(using=using):
+            result = super().delete(*args, **kwargs)
+            apply_loan_change(self, None, using=using)
+            invalidate_loan_change(self, None)
+        return result
+
+
+class CustomerCreditSnapshot(models.Model):
+    """
+    Denormalized per-customer loan totals so scoring never rescans Loan history.
+    activity_count counts loans started on/after Jan 1 of activity_year.
+    """
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name="credit_snapshot")
+
+    current_loans_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    current_emis = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    emis_paid_on_time = models.PositiveIntegerField(default=0)
+    total_tenure = models.PositiveIntegerField(default=0)
+    loans_count = models.PositiveIntegerField(default=0)
+    activity_year = models.PositiveIntegerField(default=0)
+    activity_count = models.PositiveIntegerField(default=0)
+    # the PortfolioRollup buckets this customer's exposure is currently counted under
+    # ("" until first counted); see loans.portfolio
+    score_band = models.CharField(max_length=20, blank=True, default="")
+    income_band = models.CharField(max_length=20, blank=True, default="")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Credit snapshot for customer {self.customer_id}"
+
+
+class IngestCheckpoint(models.Model):
+    """
+    Progress of one ingest run over one file (or one shard of it). rows_done is the
+    next data row to process, so a restarted task resumes there instead of at
+    the start of its range.
+    """
+    kind = models.CharField(max_length=20)  # "customers" / "loans"
+    fingerprint = models.CharField(max_length=64, help_text="sha256 of the file contents")
+    shard = models.CharField(max_length=40, default="all", help_text='Row range "start-end", or "all"')
+    file_path = models.CharField(max_length=500)
+    rows_done = models.PositiveBigIntegerField(default=0)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "fingerprint", "shard"], name="unique_ingest_checkpoint"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} ingest of {self.file_path} [{self.shard}] at row {self.rows_done}"
+
+
+class IdBlock(models.Model):
+    """
+    Block-leasing state for IdAllocator on databases without sequences:
+    next_value is the first external id not yet handed to any process.
+    """
+    name = models.CharField(max_length=30, primary_key=True)
+    next_value = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.name} ids from {self.next_value}"
+
+
+class CreditScoreHistory(models.Model):
+    """
+    One customer's credit score as computed by a portfolio rescoring run
+    (loans.scoring). Re-running on the same day overwrites that day's row.
+    """
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="score_history")
+    scored_on = models.DateField()
+    credit_score = models.DecimalField(max_digits=5, decimal_places=2)
+    created_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["customer", "scored_on"], name="score_history_customer_day_uniq"),
+        ]
+        indexes = [models.Index(fields=["scored_on", "credit_score"], name="score_history_day_idx")]
+
+    def __str__(self):
+        return f"{self.customer_id} scored {self.credit_score} on {self.scored_on}"
+
+
+class LoanArchive(models.Model):
+    """
+    A closed loan moved out of Loan by loans.archive once it is old enough, so the
+    hot table only holds the recent book. Scoring never reads this table: the
+    loan's count, tenure and on-time EMIs are kept in CustomerArchiveRollup.
+    """
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="archived_loans")
+
+    loan_id = models.IntegerField(unique=True)
+    loan_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    tenure = models.PositiveIntegerField(help_text="Tenure in months")
+    interest_rate = models.DecimalField(max_digits=5, decimal_places=2, help_text="Annual %")
+    monthly_repayment = models.DecimalField(max_digits=12, decimal_places=2)
+    emis_paid_on_time = models.PositiveIntegerField(default=0)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    source_hash = models.CharField(max_length=32, blank=True, default="", help_text="Carried over from Loan")
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    is_active = False  # only closed loans are archived
+
+    def __str__(self):
+        return f"Archived loan {self.loan_id} for customer {self.customer_id}"
+
+
+class CustomerArchiveRollup(models.Model):
+    """
+    Lifetime totals of a customer's archived loans, added to the Loan aggregates
+    wherever credit profiles are built. Archived loans are closed and started
+    before the current year, so they never count towards current exposure, EMIs
+    or this year's activity.
+    """
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name="archive_rollup")
+
+    loans_count = models.PositiveIntegerField(default=0)
+    emis_paid_on_time = models.PositiveIntegerField(default=0)
+    total_tenure = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Archive rollup for customer {self.customer_id}"
+
+
+class PortfolioRollup(models.Model):
+    """
+    Counters of one bucket of the portfolio dashboards (loans.portfolio), kept up to
+    date by every loan and snapshot write so GET /api/portfolio/summary never scans
+    Loan. count is active loans for interest slabs, borrowers (customers with
+    current exposure) for the score and income bands, and loans started that day
+    for new_loans; exposure and monthly_emis are the matching loan amounts and EMIs.
+    A bucket is split over up to PORTFOLIO_ROLLUP_SLOTS rows, summed on read, so
+    concurrent writers don't queue on one row lock.
+    """
+    dimension = models.CharField(max_length=30)
+    bucket = models.CharField(max_length=20)
+    slot = models.PositiveSmallIntegerField(default=0)
+    count = models.BigIntegerField(default=0)
+    exposure = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    monthly_emis = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["dimension", "bucket", "slot"], name="portfolio_rollup_bucket_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.dimension} {self.bucket} [{self.slot}]: {self.count}"
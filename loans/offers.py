@@ -0,0 +1,74 @@
+# loans/offers.py
+"""
+Loan offer optimizer: for one customer and interest rate, the largest
+affordable loan amount per tenure, found with one vectorized pass over a
+tenure x amount grid.
+
+An offer must keep the customer's total EMIs within 50% of monthly income
+(existing EMIs + the new one) and their current exposure plus the new amount
+within the approved limit, and the rate must clear the credit-score slab.
+This is stricter than create-loan, which only checks the existing EMIs and the
+slab: every offer is approved by create-loan, but create-loan may also approve
+larger amounts.
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+
+from .emi import calculate_emis
+from .utils import apply_interest_slab, score_credit_profile
+
+DEFAULT_TENURES = (6, 12, 18, 24, 36, 48, 60, 84, 120)
+
+
+def amount_grid(headroom: float, step: float) -> np.ndarray:
+    """Candidate amounts step, 2*step, ... up to headroom; step grows to cap the grid size."""
+    if headroom < step:
+        return np.zeros(0)
+    step = max(step, math.ceil(headroom / settings.LOAN_OFFER_MAX_GRID_POINTS / step) * step)
+    return np.arange(1, int(headroom // step) + 1, dtype=np.float64) * step
+
+
+def best_offers(customer, profile, interest_rate: float, tenures=DEFAULT_TENURES, amount_step: float = None) -> dict:
+    """
+    Offer grid evaluation for a customer whose credit profile is already loaded
+    (no queries). Returns the response body of POST /api/loan-offers.
+    """
+    amount_step = float(amount_step or settings.LOAN_OFFER_AMOUNT_STEP)
+    tenures = sorted(set(int(tenure) for tenure in tenures))
+    credit_score = score_credit_profile(profile, customer.approved_limit)
+    approved_by_slab, corrected_rate, slab_min = apply_interest_slab(credit_score, interest_rate)
+
+    monthly_income = float(customer.monthly_income)
+    emi_budget = 0.5 * monthly_income - profile.current_emis
+    headroom = float(customer.approved_limit) - profile.current_loans_amount
+
+    out = {
+        "customer_id": customer.id,
+        "credit_score": credit_score,
+        "interest_rate": interest_rate,
+        "approval": bool(approved_by_slab),
+        "corrected_interest_rate": None if approved_by_slab else corrected_rate,
+        "max_monthly_installment": round(max(emi_budget, 0.0), 2),
+        "available_limit": round(max(headroom, 0.0), 2),
+        "offers": [],
+    }
+
+    amounts = amount_grid(headroom, amount_step) if approved_by_slab and emi_budget > 0 else np.zeros(0)
+    best_index = np.full(len(tenures), -1)
+    if len(amounts):
+        emis = calculate_emis(amounts[np.newaxis, :], interest_rate, np.asarray(tenures)[:, np.newaxis])
+        # EMI grows with the amount, so each row's approvable cells form a prefix
+        approvable = profile.current_emis + emis <= 0.5 * monthly_income
+        counts = approvable.sum(axis=1)
+        best_index = counts - 1
+
+    for row, tenure in enumerate(tenures):
+        index = best_index[row]
+        out["offers"].append({
+            "tenure": tenure,
+            "max_loan_amount": float(amounts[index]) if index >= 0 else None,
+            "monthly_installment": float(emis[row, index]) if index >= 0 else None,
+        })
+    return out
@@ -0,0 +1,392 @@
+# loans/portfolio.py
+"""
+Portfolio analytics rollups behind GET /api/portfolio/summary.
+
+PortfolioRollup keeps one row per (dimension, bucket):
+
+- interest_slab: active loans by interest rate, split at the approval slab minimums
+- credit_score_band / monthly_income_band: borrowers with current exposure by credit
+  score (split at the approval thresholds) and by monthly income
+- new_loans: loans started per day (ISO date buckets), archived loans included
+
+Nothing is aggregated on read. Every write adds its deltas in its own transaction:
+Loan.save/delete through utils.apply_loan_change, the bulk paths (ingestion, the
+maturity sweeper, unarchiving, benchmark seeding, admin deletes) through
+add_loan/apply_deltas. Score and income bands belong to the customer, so every
+snapshot write (utils.refresh_credit_snapshots, apply_loan_change) and customer edit
+(restate_customers) moves the customer's exposure from the bands stored on their
+snapshot to the ones their current values give.
+
+Every writer touches the same few buckets (today's new loans above all), so each
+bucket is split over PORTFOLIO_ROLLUP_SLOTS counter rows: a transaction adds to one
+slot picked at random and readers sum the slots. apply_deltas updates rows in key
+order, and batched() folds a whole transaction's deltas into one such pass, so
+writers can't deadlock on them and hold their locks only until commit.
+
+rebuild_portfolio_rollups() recomputes everything from Loan, LoanArchive and the
+snapshots, for repair and after set-based loads (loans.fastload). Writes committed
+while it runs can be overwritten; run it when the book is quiet.
+"""
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Case, CharField, Count, F, Q, Sum, Value, When
+from django.utils import timezone
+
+from .models import CustomerCreditSnapshot, Loan, LoanArchive, PortfolioRollup
+
+logger = logging.getLogger(__name__)
+
+INTEREST_SLAB = "interest_slab"
+CREDIT_SCORE_BAND = "credit_score_band"
+MONTHLY_INCOME_BAND = "monthly_income_band"
+NEW_LOANS = "new_loans"
+
+# (inclusive upper bound, label) in ascending order, the last band open-ended; the
+# interest and score bounds are the slabs of utils.apply_interest_slab
+INTEREST_SLABS = ((12, "0-12"), (16, "12-16"), (None, "16+"))
+CREDIT_SCORE_BANDS = ((10, "0-10"), (30, "10-30"), (50, "30-50"), (None, "50-100"))
+MONTHLY_INCOME_BANDS = (
+    (25000, "0-25000"), (50000, "25000-50000"), (100000, "50000-100000"),
+    (200000, "100000-200000"), (None, "200000+"),
+)
+BANDS = {
+    INTEREST_SLAB: INTEREST_SLABS,
+    CREDIT_SCORE_BAND: CREDIT_SCORE_BANDS,
+    MONTHLY_INCOME_BAND: MONTHLY_INCOME_BANDS,
+}
+
+# the fields add_loan reads, for .only() on bulk paths (LoanArchive.is_active is always False)
+LOAN_FIELDS = ("is_active", "interest_rate", "loan_amount", "monthly_repayment", "start_date")
+ARCHIVED_LOAN_FIELDS = LOAN_FIELDS[1:]
+
+# what assign_bands and add_snapshot read of a snapshot
+_SNAPSHOT_VALUES = (
+    "customer_id", "current_loans_amount", "current_emis", "emis_paid_on_time", "total_tenure",
+    "loans_count", "activity_year", "activity_count", "score_band", "income_band",
+)
+
+_batch = ContextVar("portfolio_batch", default=None)
+
+
+def band(value, bands) -> str:
+    """Label of the first band whose upper bound value does not exceed."""
+    for upper, label in bands:
+        if upper is None or value <= upper:
+            return label
+
+
+def _band_expression(field: str, bands):
+    return Case(
+        *[When(**{f"{field}__lte": upper}, then=Value(label)) for upper, label in bands if upper is not None],
+        default=Value(bands[-1][1]), output_field=CharField(),
+    )
+
+
+def _money(value) -> Decimal:
+    # the same rounding the DecimalField columns apply, so deltas of unsaved rows
+    # (bulk_create from spreadsheets) match what a rebuild reads back
+    return Decimal(str(value if value is not None else 0)).quantize(Decimal("0.01"), ROUND_HALF_UP)
+
+
+def _add(deltas: dict, dimension: str, bucket: str, count: int, exposure: Decimal, emis: Decimal) -> None:
+    delta = deltas.setdefault((dimension, bucket), [0, Decimal(0), Decimal(0)])
+    delta[0] += count
+    delta[1] += exposure
+    delta[2] += emis
+
+
+def add_loan(deltas: dict, loan, sign: int) -> None:
+    """Add (sign=1) or remove (sign=-1) one Loan or LoanArchive row's share of the rollups."""
+    amount, emi = _money(loan.loan_amount), _money(loan.monthly_repayment)
+    _add(deltas, NEW_LOANS, loan.start_date.isoformat(), sign, sign * amount, sign * emi)
+    if loan.is_active:
+        _add(deltas, INTEREST_SLAB, band(loan.interest_rate, INTEREST_SLABS), sign, sign * amount, sign * emi)
+
+
+def add_customer(deltas: dict, bands: tuple, exposure, emis, sign: int) -> None:
+    """Add or remove one customer's current exposure and EMIs under bands = (score band, income band)."""
+    exposure, emis = _money(exposure), _money(emis)
+    score_band, income_band = bands
+    # never counted yet, or nothing to count
+    if not score_band or not (exposure or emis):
+        return
+    _add(deltas, CREDIT_SCORE_BAND, score_band, sign, sign * exposure, sign * emis)
+    _add(deltas, MONTHLY_INCOME_BAND, income_band, sign, sign * exposure, sign * emis)
+
+
+def add_snapshot(deltas: dict, snapshot: CustomerCreditSnapshot, sign: int) -> None:
+    """add_customer for a snapshot under the bands stored on it."""
+    add_customer(deltas, (snapshot.score_band, snapshot.income_band),
+                 snapshot.current_loans_amount, snapshot.current_emis, sign)
+
+
+def assign_bands(snapshot: CustomerCreditSnapshot, monthly_income, approved_limit) -> None:
+    """Set the snapshot's score and income bands from its values and the customer's."""
+    from .utils import score_credit_profile, snapshot_to_profile
+    score = score_credit_profile(snapshot_to_profile(snapshot), approved_limit)
+    snapshot.score_band = band(score, CREDIT_SCORE_BANDS)
+    snapshot.income_band = band(monthly_income, MONTHLY_INCOME_BANDS)
+
+
+def _changes(delta, now) -> dict:
+    count, exposure, emis = delta
+    return {
+        "count": F("count") + count, "exposure": F("exposure") + exposure,
+        "monthly_emis": F("monthly_emis") + emis, "updated_at": now,
+    }
+
+
+def _upsert(connection, rows: list, now) -> None:
+    # one INSERT ... ON CONFLICT DO UPDATE that adds to existing counters, instead of a
+    # round trip per bucket; rows are in key order, which is the order they are locked in
+    ops = connection.ops
+    table = ops.quote_name(PortfolioRollup._meta.db_table)
+    columns = [ops.quote_name(PortfolioRollup._meta.get_field(name).column) for name in (
+        "dimension", "bucket", "slot", "count", "exposure", "monthly_emis", "updated_at",
+    )]
+    dimension, bucket, slot, count, exposure, emis, updated_at = columns
+    params = []
+    for row in rows:
+        params += row[:4] + [ops.adapt_decimalfield_value(value) for value in row[4:]] + [ops.adapt_datetimefield_value(now)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+            + ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(rows))
+            + f" ON CONFLICT ({dimension}, {bucket}, {slot}) DO UPDATE SET "
+            f"{count} = {table}.{count} + EXCLUDED.{count}, "
+            f"{exposure} = {table}.{exposure} + EXCLUDED.{exposure}, "
+            f"{emis} = {table}.{emis} + EXCLUDED.{emis}, "
+            f"{updated_at} = EXCLUDED.{updated_at}",
+            params,
+        )
+
+
+def apply_deltas(deltas: dict, using: str = None) -> None:
+    """
+    Add deltas to one slot of their buckets (rows created on first use), in key
+    order. Runs in the caller's transaction; inside batched() the deltas are only
+    collected.
+    """
+    pending = _batch.get()
+    if pending is not None:
+        for (dimension, bucket), (count, exposure, emis) in deltas.items():
+            _add(pending, dimension, bucket, count, exposure, emis)
+        return
+    using = using or router.db_for_write(PortfolioRollup)
+    slot = random.randrange(settings.PORTFOLIO_ROLLUP_SLOTS)
+    now = timezone.now()
+    changed = [(key, delta) for key, delta in sorted(deltas.items()) if any(delta)]
+    if not changed:
+        return
+    if connections[using].features.supports_update_conflicts_with_target:
+        rows = [[dimension, bucket, slot, *delta] for (dimension, bucket), delta in changed]
+        for start in range(0, len(rows), 1000):
+            _upsert(connections[using], rows[start:start + 1000], now)
+        return
+    rollups = PortfolioRollup.objects.using(using)
+    for (dimension, bucket), delta in changed:
+        row = rollups.filter(dimension=dimension, bucket=bucket, slot=slot)
+        if not row.update(**_changes(delta, now)):
+            rollups.bulk_create([PortfolioRollup(dimension=dimension, bucket=bucket, slot=slot)], ignore_conflicts=True)
+            row.update(**_changes(delta, now))
+
+
+@contextmanager
+def batched(using: str = None):
+    """
+    Collect every apply_deltas call in the block and apply them together when it
+    exits normally. Use inside the transaction, around writes that update the
+    rollups more than once. Nested blocks join the outer one.
+    """
+    if _batch.get() is not None:
+        yield
+        return
+    deltas = {}
+    token = _batch.set(deltas)
+    try:
+        yield
+    finally:
+        _batch.reset(token)
+    apply_deltas(deltas, using)
+
+
+def restate_customers(customer_ids, changes: dict = None, deltas: dict = None, using: str = None) -> None:
+    """
+    Recount customers under the bands their snapshot and customer row now give.
+    changes = {customer pk: (exposure, emis)} added to the snapshots since their bands
+    were stored (see utils.apply_loan_change); without it the amounts are unchanged,
+    as after customer edits. Locks the snapshots, so run it in the writing
+    transaction. The rollup deltas go to deltas when given, else are applied.
+    """
+    using = using or router.db_for_write(CustomerCreditSnapshot)
+    changes = changes or {}
+    collected = {} if deltas is None else deltas
+    moved = []
+    rows = CustomerCreditSnapshot.objects.using(using).select_for_update(of=("self",)).filter(
+        customer_id__in=list(customer_ids),
+    ).order_by("pk").values_list(*_SNAPSHOT_VALUES, "customer__monthly_income", "customer__approved_limit")
+    for *values, monthly_income, approved_limit in rows:
+        snapshot = CustomerCreditSnapshot(**dict(zip(_SNAPSHOT_VALUES, values)))
+        exposure, emis = changes.get(snapshot.customer_id, (0, 0))
+        add_customer(collected, (snapshot.score_band, snapshot.income_band),
+                     snapshot.current_loans_amount - exposure, snapshot.current_emis - emis, -1)
+        stored = (snapshot.score_band, snapshot.income_band)
+        assign_bands(snapshot, monthly_income, approved_limit)
+        add_snapshot(collected, snapshot, 1)
+        if (snapshot.score_band, snapshot.income_band) != stored:
+            moved.append(snapshot)
+    if moved:
+        CustomerCreditSnapshot.objects.using(using).bulk_update(moved, ["score_band", "income_band"])
+    if deltas is None:
+        apply_deltas(collected, using)
+
+
+def forget_customers(customer_ids, using: str = None) -> None:
+    """
+    Remove customers' loans, archived loans and exposure from the rollups before the
+    customers are deleted (the cascade bypasses Loan.delete). Run in that transaction.
+    """
+    using = using or router.db_for_write(PortfolioRollup)
+    customer_ids = list(customer_ids)
+    deltas = {}
+    for model, fields in ((Loan, LOAN_FIELDS), (LoanArchive, ARCHIVED_LOAN_FIELDS)):
+        for loan in model.objects.using(using).filter(customer_id__in=customer_ids).only(*fields).iterator():
+            add_loan(deltas, loan, -1)
+    for snapshot in CustomerCreditSnapshot.objects.using(using).filter(customer_id__in=customer_ids):
+        add_snapshot(deltas, snapshot, -1)
+    apply_deltas(deltas, using)
+
+
+def compute_rollups(using: str = None, chunk_size: int = 2000) -> tuple:
+    """
+    Rollups recomputed from scratch: ({(dimension, bucket): [count, exposure, emis]},
+    snapshots whose stored bands differ from their current ones, bands updated).
+    """
+    loans = Loan.objects.using(using)
+    deltas = {}
+    slabs = loans.filter(is_active=True).annotate(slab=_band_expression("interest_rate", INTEREST_SLABS))
+    for slab, count, exposure, emis in slabs.values("slab").annotate(
+        loans=Count("id"), exposure=Sum("loan_amount"), emis=Sum("monthly_repayment"),
+    ).values_list("slab", "loans", "exposure", "emis").order_by():
+        _add(deltas, INTEREST_SLAB, slab, count, _money(exposure), _money(emis))
+    for queryset in (loans, LoanArchive.objects.using(using)):
+        for day, count, amount, emis in queryset.values("start_date").annotate(
+            loans=Count("id"), amount=Sum("loan_amount"), emis=Sum("monthly_repayment"),
+        ).values_list("start_date", "loans", "amount", "emis").order_by():
+            _add(deltas, NEW_LOANS, day.isoformat(), count, _money(amount), _money(emis))
+
+    moved = []
+    snapshots = CustomerCreditSnapshot.objects.using(using).select_related("customer").only(
+        *_SNAPSHOT_VALUES, "customer__monthly_income", "customer__approved_limit",
+    )
+    for snapshot in snapshots.iterator(chunk_size=chunk_size):
+        stored = (snapshot.score_band, snapshot.income_band)
+        assign_bands(snapshot, snapshot.customer.monthly_income, snapshot.customer.approved_limit)
+        add_snapshot(deltas, snapshot, 1)
+        if (snapshot.score_band, snapshot.income_band) != stored:
+            moved.append(snapshot)
+    return {key: delta for key, delta in deltas.items() if any(delta)}, moved
+
+
+def stored_rollups(using: str = None) -> dict:
+    """The rollup table as {(dimension, bucket): [count, exposure, emis]}, slots summed, empty buckets left out."""
+    stored = {}
+    for dimension, bucket, count, exposure, emis in PortfolioRollup.objects.using(using).values_list(
+        "dimension", "bucket", "count", "exposure", "monthly_emis",
+    ):
+        _add(stored, dimension, bucket, count, exposure, emis)
+    return {key: delta for key, delta in stored.items() if any(delta)}
+
+
+def verify_portfolio_rollups(using: str = None) -> list:
+    """The (dimension, bucket) keys whose stored rollup differs from a fresh rebuild."""
+    expected, _ = compute_rollups(using)
+    stored = stored_rollups(using)
+    return sorted(key for key in expected.keys() | stored.keys() if expected.get(key) != stored.get(key))
+
+
+def rebuild_portfolio_rollups(using: str = None) -> dict:
+    """Recompute every rollup row (and the bands stored on snapshots) in one transaction."""
+    started = time.monotonic()
+    using = using or router.db_for_write(PortfolioRollup)
+    with transaction.atomic(using=using):
+        rollups, moved = compute_rollups(using)
+        CustomerCreditSnapshot.objects.using(using).bulk_update(moved, ["score_band", "income_band"], batch_size=1000)
+        rows = [
+            PortfolioRollup(dimension=dimension, bucket=bucket, count=count, exposure=exposure, monthly_emis=emis)
+            for (dimension, bucket), (count, exposure, emis) in sorted(rollups.items())
+        ]
+        table = PortfolioRollup.objects.using(using)
+        table.bulk_create(
+            rows, batch_size=1000, update_conflicts=True, unique_fields=["dimension", "bucket", "slot"],
+            update_fields=["count", "exposure", "monthly_emis", "updated_at"],
+        )
+        # the totals now live in slot 0
+        table.filter(pk__in=[
+            pk for pk, dimension, bucket, slot in table.values_list("pk", "dimension", "bucket", "slot")
+            if slot or (dimension, bucket) not in rollups
+        ]).delete()
+
+    report = {
+        "buckets": len(rows),
+        "snapshots_restated": len(moved),
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    logger.info("portfolio rollups rebuilt: %(buckets)s buckets, %(snapshots_restated)s customers "
+                "moved bands (%(seconds)ss)", report)
+    return report
+
+
+def portfolio_summary(days: int = 30, today: date = None) -> dict:
+    """
+    Body of GET /api/portfolio/summary, from one indexed read of at most
+    (len(bands) + days) * PORTFOLIO_ROLLUP_SLOTS rollup rows, whatever the size of
+    the book.
+    """
+    today = today or timezone.now().date()
+    since = today - timedelta(days=days - 1)
+    rows = PortfolioRollup.objects.filter(
+        Q(dimension__in=list(BANDS))
+        | Q(dimension=NEW_LOANS, bucket__gte=since.isoformat(), bucket__lte=today.isoformat())
+    ).values_list("dimension", "bucket", "count", "exposure", "monthly_emis", "updated_at")
+
+    buckets, as_of = {}, None
+    for dimension, bucket, count, exposure, emis, updated_at in rows:
+        _add(buckets, dimension, bucket, count, exposure, emis)
+        as_of = updated_at if as_of is None else max(as_of, updated_at)
+    empty = (0, Decimal(0), Decimal(0))
+
+    def bands(dimension: str, counted: str) -> list:
+        out = []
+        for _, label in BANDS[dimension]:
+            count, exposure, emis = buckets.get((dimension, label), empty)
+            out.append({"band": label, counted: count, "exposure": float(exposure), "monthly_emis": float(emis)})
+        return out
+
+    slabs = bands(INTEREST_SLAB, "loans")
+    new_loans = []
+    for offset in range(days):
+        day = (since + timedelta(days=offset)).isoformat()
+        count, amount, _ = buckets.get((NEW_LOANS, day), empty)
+        new_loans.append({"date": day, "loans": count, "amount": float(amount)})
+
+    return {
+        "as_of": as_of.isoformat() if as_of else None,
+        "active_loans": {
+            "count": sum(slab["loans"] for slab in slabs),
+            "exposure": float(sum(buckets.get((INTEREST_SLAB, label), empty)[1] for _, label in INTEREST_SLABS)),
+            "monthly_emis": float(sum(buckets.get((INTEREST_SLAB, label), empty)[2] for _, label in INTEREST_SLABS)),
+        },
+        "by_interest_slab": slabs,
+        "by_credit_score_band": bands(CREDIT_SCORE_BAND, "borrowers"),
+        "by_monthly_income_band": bands(MONTHLY_INCOME_BAND, "borrowers"),
+        "new_loans_per_day": new_loans,
+    }
@@ -0,0 +1,113 @@
+# loans/routers.py
+"""
+Read-replica routing.
+
+Reads only leave the primary when a request opts in: ReplicaRoutingMiddleware
+picks a healthy replica for the read-only endpoints and sets it for the rest of
+the request; everything else (writes, transactions, background tasks, admin)
+stays on "default". A replica whose replication lag exceeds
+REPLICA_MAX_LAG_SECONDS, or that can't be reached, is skipped until its next
+lag check.
+"""
+import contextvars
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+_read_alias = contextvars.ContextVar("loans_read_alias", default=None)
+
+_lag_lock = threading.Lock()
+_lag_checked = {}  # alias -> (monotonic time of the check, lag in seconds or None if unreachable)
+
+# on a replica, seconds behind the primary; 0 when it has replayed everything it received
+POSTGRES_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def replica_aliases() -> list:
+    return list(getattr(settings, "DATABASE_REPLICAS", []))
+
+
+@contextmanager
+def read_from(alias):
+    """Route ORM reads in this context to alias (None: the primary)."""
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def reading_from_replica() -> bool:
+    """Whether ORM reads in this context go to a replica (see read_from)."""
+    return _read_alias.get() not in (None, DEFAULT_DB_ALIAS)
+
+
+def measure_lag(alias: str):
+    """Replication lag of alias in seconds, or None if it can't be queried."""
+    connection = connections[alias]
+    if connection.vendor != "postgresql":
+        return 0.0  # local/test aliases mirror the primary
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(POSTGRES_LAG_SQL)
+            return float(cursor.fetchone()[0])
+    except DatabaseError:
+        logger.warning("replica %s is unreachable; reading from the primary", alias, exc_info=True)
+        return None
+
+
+def replica_lag(alias: str):
+    """measure_lag, re-measured at most every REPLICA_LAG_CHECK_INTERVAL seconds per process."""
+    now = time.monotonic()
+    with _lag_lock:
+        checked = _lag_checked.get(alias)
+    if checked is not None and now - checked[0] < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return checked[1]
+    lag = measure_lag(alias)
+    with _lag_lock:
+        _lag_checked[alias] = (now, lag)
+    return lag
+
+
+def choose_replica():
+    """A random replica within the lag limit, or None to read from the primary."""
+    healthy = []
+    for alias in replica_aliases():
+        lag = replica_lag(alias)
+        if lag is not None and lag <= settings.REPLICA_MAX_LAG_SECONDS:
+            healthy.append(alias)
+    return random.choice(healthy) if healthy else None
+
+
+class ReplicaRouter:
+    """Reads follow read_from(); writes, and reads that lock rows, always use the primary."""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # without this, saving an instance read from a replica would write to the replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replica_aliases():
+            return False
+        return None
@@ -25,6 +25,29 @@ class CheckEligibilityRequestSerializer(serializers.Serializer):
     interest_rate = serializers.DecimalField(max_digits=5, decimal_places=2)
     tenure = serializers.IntegerField(min_value=1)
 
+class LoanOfferRequestSerializer(serializers.Serializer):
+    customer_id = serializers.IntegerField()
+    interest_rate = serializers.DecimalField(max_digits=5, decimal_places=2)
+    tenures = serializers.ListField(
+        child=serializers.IntegerField(min_value=1, max_value=600), required=False, allow_empty=False, max_length=48,
+    )
+    amount_step = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=1, required=False)
+
+class LoanExportQuerySerializer(serializers.Serializer):
+    format = serializers.ChoiceField(choices=["csv", "ndjson"], default="csv")
+    active = serializers.BooleanField(required=False, allow_null=True, default=None)
+    start_date_from = serializers.DateField(required=False, default=None)
+    start_date_to = serializers.DateField(required=False, default=None)
+    include_archived = serializers.BooleanField(required=False, default=True)
+
+    def validate(self, attrs):
+        if attrs["start_date_from"] and attrs["start_date_to"] and attrs["start_date_from"] > attrs["start_date_to"]:
+            raise serializers.ValidationError("start_date_from must not be after start_date_to")
+        return attrs
+
+class PortfolioSummaryQuerySerializer(serializers.Serializer):
+    days = serializers.IntegerField(min_value=1, max_value=366, default=30)
+
 class CheckEligibilityResponseSerializer(serializers.Serializer):
     customer_id = serializers.IntegerField()
     approval = serializers.BooleanField()
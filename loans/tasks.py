@@ -1,48 +1,388 @@
+import logging
+import os
+import time
+from datetime import date
+
 import pandas as pd
-from celery import shared_task
-from .models import Customer, Loan
-
-@shared_task
-def ingest_customers(file_path: str):
-    df = pd.read_excel(file_path)
-
-    for _, row in df.iterrows():
-        Customer.objects.update_or_create(
-            customer_id=row["Customer ID"],
-            defaults={
-                "first_name": row["First Name"],
-                "last_name": row["Last Name"],
-                "age": row["Age"],
-                "phone_number": str(row["Phone Number"]),
-                "monthly_income": row["Monthly Salary"],
-                "approved_limit": row["Approved Limit"],
-            },
+from celery import chord, group, shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Customer, Loan, IngestCheckpoint
+from .archive import archived_rows, unarchive
+from .cache import invalidate
+from .ids import sync_id_allocator
+from .metrics import record_ingest
+from .portfolio import LOAN_FIELDS, add_loan, apply_deltas, batched, restate_customers
+from .readers import count_data_rows, file_fingerprint, iter_row_chunks, row_digests
+from .utils import refresh_credit_snapshots
+
+logger = logging.getLogger(__name__)
+
+# spreadsheet header -> model field
+CUSTOMER_COLUMNS = {
+    "Customer ID": "customer_id",
+    "First Name": "first_name",
+    "Last Name": "last_name",
+    "Age": "age",
+    "Phone Number": "phone_number",
+    "Monthly Salary": "monthly_income",
+    "Approved Limit": "approved_limit",
+}
+
+ID_KINDS = {"customers": "customer", "loans": "loan"}
+
+LOAN_COLUMNS = {
+    "Customer ID": "customer_id",
+    "Loan ID": "loan_id",
+    "Loan Amount": "loan_amount",
+    "Tenure": "tenure",
+    "Interest Rate": "interest_rate",
+    "Monthly payment": "monthly_repayment",
+    "EMIs paid on Time": "emis_paid_on_time",
+    "Date of Approval": "start_date",
+    "End Date": "end_date",
+}
+
+
+def _customer_frame(df: pd.DataFrame) -> pd.DataFrame:
+    frame = df.rename(columns=CUSTOMER_COLUMNS)[list(CUSTOMER_COLUMNS.values())]
+    frame = frame.dropna().astype({"customer_id": "int64", "age": "int64"})
+    phones = frame["phone_number"]
+    if pd.api.types.is_numeric_dtype(phones):
+        phones = phones.astype("int64")
+    frame["phone_number"] = phones.astype(str)
+    return frame
+
+
+def _loan_frame(df: pd.DataFrame) -> pd.DataFrame:
+    frame = df.rename(columns=LOAN_COLUMNS)[list(LOAN_COLUMNS.values())]
+    frame = frame.dropna().astype({"customer_id": "int64", "loan_id": "int64", "tenure": "int64", "emis_paid_on_time": "int64"})
+    frame["start_date"] = pd.to_datetime(frame["start_date"]).dt.date
+    frame["end_date"] = pd.to_datetime(frame["end_date"]).dt.date
+    # a loan whose end date has passed is closed (see loans.maturity)
+    frame["is_active"] = frame["end_date"] >= timezone.now().date()
+    return frame
+
+
+def _dedupe(frame: pd.DataFrame, key: str) -> pd.DataFrame:
+    # one statement can't upsert the same key twice; the last row wins, as it did
+    # with the old row-by-row update_or_create
+    return frame.drop_duplicates(subset=[key], keep="last")
+
+
+def _drop_unchanged(frame: pd.DataFrame, key: str, stored: dict) -> tuple:
+    """
+    Rows of frame (with a source_hash column) whose stored copy, stored[key], has a
+    different digest or is missing, and how many rows were dropped as unchanged.
+    """
+    unchanged = frame["source_hash"].eq(frame[key].map(stored))
+    return frame[~unchanged], int(unchanged.sum())
+
+
+def _write_rejects(frame: pd.DataFrame, reject_file: str):
+    """Append loans whose customer is unknown, with the spreadsheet header, to reject_file."""
+    headers = {field: header for header, field in LOAN_COLUMNS.items()}
+    write_header = not os.path.exists(reject_file) or os.path.getsize(reject_file) == 0
+    frame[list(headers)].rename(columns=headers).to_csv(reject_file, mode="a", header=write_header, index=False)
+
+
+def _report(kind: str, total: int, stats: dict, started: float) -> dict:
+    elapsed = time.monotonic() - started
+    report = {
+        "kind": kind,
+        "rows": total,
+        **stats,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(total / elapsed, 1) if elapsed > 0 else None,
+    }
+    logger.info("ingest %(kind)s: %(rows)s rows (%(inserted)s inserted, %(updated)s updated, "
+                "%(unchanged)s unchanged, %(skipped)s skipped) at %(rows_per_second)s rows/s", report)
+    record_ingest(report)
+    return report
+
+
+def _start_checkpoint(kind: str, file_path: str, start_row: int = 0, end_row: int = None,
+                      force: bool = False) -> IngestCheckpoint:
+    """
+    Checkpoint for this exact file content and row range. A finished one is returned
+    as is (the run has nothing left to do) unless force, or unless another file of
+    this kind finished since (its rows may have overwritten these); then it starts over.
+    """
+    shard = "all" if start_row == 0 and end_row is None else f"{start_row}-{end_row if end_row is not None else ''}"
+    checkpoint, _ = IngestCheckpoint.objects.get_or_create(
+        kind=kind, fingerprint=file_fingerprint(file_path), shard=shard,
+        defaults={"file_path": file_path, "rows_done": start_row},
+    )
+    if checkpoint.completed_at is not None and not force and not IngestCheckpoint.objects.filter(
+        kind=kind, completed_at__gt=checkpoint.completed_at,
+    ).exclude(fingerprint=checkpoint.fingerprint).exists():
+        return checkpoint
+    if checkpoint.completed_at is not None or checkpoint.rows_done < start_row:
+        checkpoint.rows_done = start_row
+        checkpoint.completed_at = None
+    checkpoint.file_path = file_path
+    checkpoint.save()
+    return checkpoint
+
+
+def _run_ingest(kind: str, file_path: str, batch_size: int, upsert_chunk, on_start=None,
+                start_row: int = 0, end_row: int = None, force: bool = False) -> dict:
+    """
+    Stream data rows [start_row, end_row) of file_path in batch_size chunks through
+    upsert_chunk(chunk) -> stats. Each chunk commits together with its checkpoint,
+    so a restarted task skips every row that was already written, and a file (or
+    shard) ingested to the end before is skipped whole unless force.
+    """
+    started = time.monotonic()
+    batch_size = batch_size or settings.INGEST_BATCH_SIZE
+    checkpoint = _start_checkpoint(kind, file_path, start_row, end_row, force)
+    resumed_from = checkpoint.rows_done
+    if checkpoint.completed_at is not None:
+        # same content, same range: every row is unchanged (counted by file rows, blank ones included)
+        rows = checkpoint.rows_done - start_row
+        report = _report(kind, rows, {
+            "inserted": 0, "updated": 0, "unchanged": rows, "skipped": 0,
+            "resumed_from": resumed_from, "file_unchanged": True,
+        }, started)
+        report.update(start_row=start_row, end_row=end_row)
+        return report
+    if on_start is not None:
+        on_start(resumed_from > start_row)
+
+    stats = {"inserted": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+    rows = 0
+    for first_row, chunk in iter_row_chunks(file_path, batch_size, start_row=resumed_from, end_row=end_row):
+        rows_read = len(chunk)
+        # blank spreadsheet rows (often trailing) are neither data nor skips
+        chunk = chunk.dropna(how="all")
+        with transaction.atomic():
+            for key, value in upsert_chunk(chunk).items():
+                stats[key] = stats.get(key, 0) + value
+            checkpoint.rows_done = first_row + rows_read
+            checkpoint.save(update_fields=["rows_done", "updated_at"])
+        rows += len(chunk)
+
+    checkpoint.completed_at = timezone.now()
+    checkpoint.save(update_fields=["completed_at", "updated_at"])
+    # ids came from the file; keep the allocator ahead of them
+    sync_id_allocator(ID_KINDS[kind])
+    report = _report(kind, rows, {**stats, "resumed_from": resumed_from, "file_unchanged": False}, started)
+    report.update(start_row=start_row, end_row=end_row)
+    return report
+
+
+def _upsert_customers(chunk: pd.DataFrame) -> dict:
+    frame = _dedupe(_customer_frame(chunk), "customer_id")
+    skipped = len(chunk) - len(frame)
+    frame = frame.assign(source_hash=row_digests(frame, CUSTOMER_COLUMNS.values()))
+    stored = list(
+        Customer.objects.filter(customer_id__in=frame["customer_id"].tolist()).values_list("customer_id", "id", "source_hash")
+    )
+    # rows identical to what the last ingest wrote are not touched at all
+    frame, unchanged = _drop_unchanged(frame, "customer_id", {customer_id: digest for customer_id, _, digest in stored})
+    changed = set(frame["customer_id"].tolist())
+    existing = {customer_id: pk for customer_id, pk, _ in stored if customer_id in changed}
+    customers = [Customer(**record) for record in frame.to_dict("records")]
+    Customer.objects.bulk_create(
+        customers, update_conflicts=True, unique_fields=["customer_id"],
+        update_fields=[f for f in CUSTOMER_COLUMNS.values() if f != "customer_id"] + ["source_hash"],
+    )
+    # new customers have nothing cached (misses aren't stored); updated ones may, and
+    # may have moved between the portfolio rollups' income and score bands
+    if existing:
+        restate_customers(existing.values())
+        invalidate(
+            Loan.objects.filter(customer_id__in=existing.values()).values_list("loan_id", flat=True),
+            [(pk, external_id) for external_id, pk in existing.items()],
         )
-    return f"Loaded {len(df)} customers"
-
-
-@shared_task
-def ingest_loans(file_path: str):
-    df = pd.read_excel(file_path)
-
-    for _, row in df.iterrows():
-        try:
-            customer = Customer.objects.get(customer_id=row["Customer ID"])
-        except Customer.DoesNotExist:
-            continue  # skip loan if customer not found
-
-        Loan.objects.update_or_create(
-            loan_id=row["Loan ID"],
-            defaults={
-                "customer": customer,
-                "loan_amount": row["Loan Amount"],
-                "tenure": row["Tenure"],
-                "interest_rate": row["Interest Rate"],
-                "monthly_repayment": row["Monthly payment"],
-                "emis_paid_on_time": row["EMIs paid on Time"],
-                "start_date": row["Date of Approval"],
-                "end_date": row["End Date"],
-                "is_active": True,
-            },
+    return {
+        "inserted": len(customers) - len(existing), "updated": len(existing),
+        "unchanged": unchanged, "skipped": skipped,
+    }
+
+
+def _upsert_loans(chunk: pd.DataFrame, customer_pks: dict, reject_file: str = None) -> dict:
+    frame = _dedupe(_loan_frame(chunk), "loan_id")
+    # incomplete and duplicate rows; rejected ones are counted apart
+    skipped = len(chunk) - len(frame)
+    known = frame["customer_id"].isin(customer_pks.keys())
+    if reject_file and not known.all():
+        _write_rejects(frame[~known], reject_file)
+    rejected = int((~known).sum())
+    frame = frame[known]
+    # the digest covers the file's columns (the spreadsheet customer id; is_active follows end_date)
+    frame = frame.assign(source_hash=row_digests(frame, LOAN_COLUMNS.values()))
+    stored = {
+        loan_id: (customer_id, source_hash)
+        for loan_id, customer_id, source_hash in Loan.objects.filter(loan_id__in=frame["loan_id"].tolist())
+        .values_list("loan_id", "customer_id", "source_hash")
+    }
+    archived = archived_rows(frame["loan_id"].tolist())
+    # rows identical to what the last ingest wrote are not touched, archived ones included
+    frame, unchanged = _drop_unchanged(
+        frame, "loan_id", {loan_id: digest for loan_id, (_, digest) in {**stored, **archived}.items()},
+    )
+    stats = {"rejected": rejected, "unchanged": unchanged, "skipped": skipped}
+    if frame.empty:
+        return {"inserted": 0, "updated": 0, **stats}
+    frame = frame.assign(customer_id=frame["customer_id"].map(customer_pks).astype("int64"))
+
+    loans = [Loan(**record) for record in frame.to_dict("records")]
+    changed = set(frame["loan_id"].tolist())
+    # previous owners matter too if a loan moved between customers
+    existing = {loan_id: owner for loan_id, (owner, _) in stored.items() if loan_id in changed}
+    # archived loans in the file move back into Loan (loans.archive)
+    archived = {loan_id: owner for loan_id, (owner, _) in archived.items() if loan_id in changed}
+    existing.update(archived)
+    customer_ids = set(frame["customer_id"].tolist()) | set(existing.values())
+    # parallel shards may touch the same customers; locking them (in pk order, so shards
+    # can't deadlock) makes each shard's snapshot refresh see the others' committed loans
+    customers = list(
+        Customer.objects.select_for_update().filter(pk__in=customer_ids).order_by("pk").values_list("pk", "customer_id")
+    )
+    # one ordered pass over the shared rollup rows per chunk (see loans.portfolio)
+    with batched():
+        # the rows being replaced, read under the locks
+        rollup = {}
+        for loan in Loan.objects.filter(loan_id__in=list(existing)).only(*LOAN_FIELDS):
+            add_loan(rollup, loan, -1)
+        unarchive(archived)
+        Loan.objects.bulk_create(
+            loans, update_conflicts=True, unique_fields=["loan_id"],
+            update_fields=[f for f in LOAN_COLUMNS.values() if f != "loan_id"] + ["is_active", "source_hash"],
         )
-    return f"Loaded {len(df)} loans"
+        for loan in loans:
+            add_loan(rollup, loan, 1)
+        apply_deltas(rollup)
+        # bulk_create bypasses Loan.save, so refresh the snapshots in this transaction
+        refresh_credit_snapshots(customer_ids)
+    invalidate(frame["loan_id"].tolist(), customers)
+    return {"inserted": len(loans) - len(existing), "updated": len(existing), **stats}
+
+
+@shared_task
+def ingest_customers(file_path: str, batch_size: int = None, start_row: int = 0, end_row: int = None,
+                     force: bool = False):
+    return _run_ingest(
+        "customers", file_path, batch_size, _upsert_customers, start_row=start_row, end_row=end_row, force=force,
+    )
+
+
+@shared_task
+def ingest_loans(file_path: str, batch_size: int = None, reject_file: str = None,
+                 start_row: int = 0, end_row: int = None, force: bool = False):
+    # resolve Excel customer ids to FKs from one preloaded map; unknown customers are skipped
+    customer_pks = dict(Customer.objects.values_list("customer_id", "id"))
+
+    def start_rejects(resuming):
+        if reject_file and not resuming and os.path.exists(reject_file):
+            os.remove(reject_file)
+
+    return _run_ingest(
+        "loans", file_path, batch_size,
+        lambda chunk: _upsert_loans(chunk, customer_pks, reject_file),
+        on_start=start_rejects, start_row=start_row, end_row=end_row, force=force,
+    )
+
+
+def shard_ranges(total_rows: int, shards: int) -> list:
+    """Split [0, total_rows) into at most `shards` contiguous (start, end) ranges."""
+    shards = max(1, min(shards, total_rows)) if total_rows else 1
+    size, extra = divmod(total_rows, shards)
+    ranges, start = [], 0
+    for index in range(shards):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+@shared_task
+def ingest_files(customers_file: str, loans_file: str, shards: int = None,
+                 batch_size: int = None, reject_file: str = None, force: bool = False):
+    """
+    Plan a sharded ingest as a Celery canvas:
+    customer shards -> chord barrier -> loan shards -> ingest_summary.
+    Loans only start once every customer shard has committed. Files (shards)
+    already ingested to the end are skipped, and within the others only new or
+    changed rows are written; force re-reads every file.
+    """
+    shards = shards or settings.INGEST_SHARDS
+    header = group(
+        ingest_customers.si(customers_file, batch_size, start, end, force)
+        for start, end in shard_ranges(count_data_rows(customers_file), shards)
+    )
+    chord(header)(ingest_loan_shards.s(loans_file, shards, batch_size, reject_file, force))
+    return {"customers_file": customers_file, "loans_file": loans_file, "shards": shards}
+
+
+@shared_task
+def ingest_loan_shards(customer_reports: list, loans_file: str, shards: int = None,
+                       batch_size: int = None, reject_file: str = None, force: bool = False):
+    """Chord callback after the customer shards: fan the loans file out the same way."""
+    shards = shards or settings.INGEST_SHARDS
+    reject_file = reject_file or f"{loans_file}.rejects.csv"
+    ranges = shard_ranges(count_data_rows(loans_file), shards)
+    header = group(
+        # one reject file per shard so parallel workers never interleave writes
+        ingest_loans.si(
+            loans_file, batch_size, f"{reject_file}.{index}" if len(ranges) > 1 else reject_file, start, end, force,
+        )
+        for index, (start, end) in enumerate(ranges)
+    )
+    chord(header)(ingest_summary.s(customer_reports))
+    return {"loans_file": loans_file, "shards": len(ranges)}
+
+
+@shared_task
+def ingest_summary(loan_reports: list, customer_reports: list):
+    """Final step of ingest_files: totals across all shards."""
+    def totals(reports):
+        summary = {"shards": len(reports)}
+        for report in reports:
+            for key in ("rows", "inserted", "updated", "unchanged", "skipped", "rejected"):
+                if key in report:
+                    summary[key] = summary.get(key, 0) + report[key]
+        summary["seconds"] = max((report["seconds"] for report in reports), default=0)
+        return summary
+
+    summary = {"customers": totals(customer_reports), "loans": totals(loan_reports)}
+    logger.info("ingest finished: %s", summary)
+    return summary
+
+
+@shared_task
+def fast_ingest_files(customers_file: str, loans_file: str, reject_file: str = None, batch_size: int = None):
+    """Customers then loans in one task, via COPY on PostgreSQL (see loans.fastload)."""
+    from .fastload import fast_ingest
+    return fast_ingest(customers_file, loans_file, reject_file=reject_file, batch_size=batch_size)
+
+
+@shared_task
+def sweep_matured_loans_task(batch_size: int = None, max_batches: int = None, today: str = None):
+    """
+    Nightly (see CELERY_BEAT_SCHEDULE): deactivate loans whose end date has passed.
+    today is an ISO date (task arguments are serialized); default: the worker's today.
+    """
+    from .maturity import sweep_matured_loans
+    return sweep_matured_loans(
+        today=date.fromisoformat(today) if today else None, batch_size=batch_size, max_batches=max_batches,
+    )
+
+
+@shared_task
+def archive_closed_loans_task(older_than_days: int = None, batch_size: int = None, max_batches: int = None):
+    """Nightly (see CELERY_BEAT_SCHEDULE): move old closed loans into LoanArchive."""
+    from .archive import archive_closed_loans
+    return archive_closed_loans(older_than_days=older_than_days, batch_size=batch_size, max_batches=max_batches)
+
+
+@shared_task
+def rescore_portfolio_task(chunk_size: int = None, today: str = None):
+    """
+    Nightly (see CELERY_BEAT_SCHEDULE): score every customer into CreditScoreHistory.
+    today is an ISO date, as for sweep_matured_loans_task.
+    """
+    from .scoring import rescore_portfolio
+    return rescore_portfolio(today=date.fromisoformat(today) if today else None, chunk_size=chunk_size)
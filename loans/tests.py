@@ -1,3 +1,1712 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import random
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import pandas as pd
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import Q, Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .archive import archivable_loans, archive_closed_loans
+from .benchmark import (
+    InProcessTransport, generate_traffic, loan_url_names, percentile, run_load, seed_database, time_active_set,
+)
+from .cache import _customer_loans_entry, customer_loans_key, loan_key
+from .emi import amortization_schedule, calculate_emis
+from .export import iter_loan_rows
+from .ids import allocate_id, sync_id_allocator
+from .maturity import _sweep_batch, sweep_matured_loans
+from .models import (
+    CreditScoreHistory, Customer, CustomerArchiveRollup, CustomerCreditSnapshot, IngestCheckpoint, Loan, LoanArchive,
+    PortfolioRollup,
+)
+from .portfolio import (
+    CREDIT_SCORE_BAND, MONTHLY_INCOME_BAND, add_snapshot, apply_deltas, compute_rollups, portfolio_summary,
+    rebuild_portfolio_rollups, stored_rollups, verify_portfolio_rollups,
+)
+from .readers import file_fingerprint
+from .routers import replica_lag
+from .scoring import portfolio_profiles, rescore_portfolio, score_profiles
+from .tasks import (
+    CUSTOMER_COLUMNS, LOAN_COLUMNS, _loan_frame, _upsert_loans, ingest_customers, ingest_files, ingest_loan_shards,
+    ingest_loans, shard_ranges,
+)
+from .utils import (
+    SNAPSHOT_FIELDS, aggregate_credit_profile, aget_credit_profile, calculate_emi, compute_credit_score,
+    credit_profile_aggregates, get_credit_profile, months_between, refresh_credit_snapshots,
+    repayments_left_expression, score_credit_profile, verify_credit_snapshots,
+)
+from .views import get_customer_by_identifier
+
+
+class CalculateEmisTests(SimpleTestCase):
+    def test_matches_scalar_emi_to_the_paisa(self):
+        rng = random.Random(42)
+        principals = [rng.choice([rng.randint(1, 10**7), round(rng.uniform(1, 1e7), 2)]) for _ in range(20000)]
+        rates = [rng.choice([0, round(rng.uniform(0, 30), 2)]) for _ in range(20000)]
+        tenures = [rng.randint(0, 360) for _ in range(20000)]
+
+        batch = calculate_emis(principals, rates, tenures)
+
+        expected = [calculate_emi(p, r, t) for p, r, t in zip(principals, rates, tenures)]
+        self.assertEqual(batch.tolist(), expected)
+
+    def test_schedule_pays_off_principal(self):
+        schedule = amortization_schedule(100000, 12, 12)
+
+        self.assertEqual(len(schedule["month"]), 12)
+        self.assertEqual(schedule["payment"][0], calculate_emi(100000, 12, 12))
+        self.assertEqual(schedule["balance"][-1], 0.0)
+        self.assertAlmostEqual(schedule["principal"].sum(), 100000, places=1)
+
+
+class LoanScheduleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(
+            customer_id=7091, first_name="Noor", last_name="Das", age=29,
+            phone_number="9000000091", monthly_income=80000, approved_limit=2900000,
+        )
+
+    def schedule(self, monthly_repayment) -> list:
+        loan = Loan.objects.create(
+            customer=self.customer, loan_id=allocate_id("loan"), loan_amount=100000, tenure=12, interest_rate=12,
+            monthly_repayment=monthly_repayment, emis_paid_on_time=0, start_date=date(2024, 1, 1),
+            end_date=date(2025, 1, 1), is_active=True,
+        )
+        schedule = self.client.get(f"/api/view-loan/{loan.loan_id}/schedule").json()["schedule"]
+        self.assertEqual(schedule[-1]["balance"], 0.0)
+        self.assertAlmostEqual(sum(row["principal"] for row in schedule), 100000, places=1)
+        return schedule
+
+    def test_schedule_uses_the_stored_installment(self):
+        # ingested with a rounded installment, not the calculated 8884.88
+        schedule = self.schedule(8885)
+
+        self.assertEqual(len(schedule), 12)
+        self.assertEqual({row["payment"] for row in schedule[:-1]}, {8885.0})
+        self.assertLess(schedule[-1]["payment"], 8885)
+
+    def test_a_larger_installment_ends_the_schedule_early(self):
+        # 15000 against a formula EMI of 8884.88: paid off in the 7th month
+        schedule = self.schedule(15000)
+
+        self.assertEqual([row["month"] for row in schedule], list(range(1, 8)))
+        self.assertEqual({row["payment"] for row in schedule[:-1]}, {15000.0})
+        self.assertEqual(schedule[-1]["payment"], 14010.51)  # only what was still owed
+        for row in schedule:
+            with self.subTest(month=row["month"]):
+                self.assertGreaterEqual(row["interest"], 0)
+                self.assertGreater(row["principal"], 0)
+                self.assertGreaterEqual(row["balance"], 0)
+
+
+def per_query_credit_score(customer: Customer) -> float:
+    """compute_credit_score as it was before the profile: one query per input, scored inline."""
+    loans = Loan.objects.filter(customer=customer)
+    current_sum = float(loans.filter(is_active=True).aggregate(total=Sum("loan_amount"))["total"] or 0.0)
+    approved_limit = float(customer.approved_limit)
+    if approved_limit > 0 and current_sum > approved_limit:
+        return 0.0
+    loans_count = loans.count()
+    total_on_time = loans.aggregate(total=Sum("emis_paid_on_time"))["total"] or 0
+    total_tenures = loans.aggregate(total=Sum("tenure"))["total"] or 0
+    on_time_ratio = 1.0 if total_tenures == 0 else min(1.0, max(0.0, total_on_time / total_tenures))
+    activity_count = loans.filter(start_date__gte=date(timezone.now().year, 1, 1)).count()
+    vol_score = (1.0 - min(1.0, max(0.0, current_sum / approved_limit))) * 100.0 if approved_limit > 0 else 0.0
+    score = (
+        0.40 * on_time_ratio * 100
+        + 0.15 * max(0.0, 100.0 * (1.0 - min(loans_count, 20) / 20))
+        + 0.20 * max(0.0, 100.0 * (1.0 - min(activity_count, 5) / 5))
+        + 0.25 * vol_score
+    )
+    return round(max(0.0, min(100.0, score)), 2)
+
+
+class CreditProfileTests(TestCase):
+    """The one-query credit profile scores exactly like the per-query computation it replaced."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_database(40, loans_per_customer=4, seed=23)
+        today = timezone.now().date()
+        customers = list(Customer.objects.order_by("pk")[:4])
+        # loans started this year (active and closed), no loans at all, and exposure over the limit
+        for n, customer in enumerate(customers[:2]):
+            for k in range(3):
+                Loan.objects.create(
+                    customer=customer, loan_id=allocate_id("loan"), loan_amount=50000 + 1000 * k, tenure=12,
+                    interest_rate=12, monthly_repayment=4442, emis_paid_on_time=k, start_date=date(today.year, 1, 1),
+                    end_date=date(today.year + 1, 1, 1), is_active=k != 1,
+                )
+        for loan in customers[2].loans.all():
+            loan.delete()
+        Customer.objects.filter(pk=customers[3].pk).update(approved_limit=1000)
+
+    def test_profile_scores_match_the_per_query_scores(self):
+        mismatched = {}
+        for customer in Customer.objects.select_related("credit_snapshot").order_by("pk"):
+            expected = per_query_credit_score(customer)
+            # straight from the aggregate, and through the snapshot it maintains
+            scores = (score_credit_profile(aggregate_credit_profile(customer), customer.approved_limit),
+                      compute_credit_score(customer))
+            if scores != (expected, expected):
+                mismatched[customer.pk] = (*scores, expected)
+
+        self.assertEqual(mismatched, {})
+        self.assertTrue(Loan.objects.filter(is_active=False).exists())
+        self.assertTrue(Loan.objects.filter(start_date__year=timezone.now().year).exists())
+
+    def test_profile_is_one_query(self):
+        customer = Customer.objects.order_by("pk").first()
+        CustomerCreditSnapshot.objects.filter(customer=customer).delete()
+        customer = Customer.objects.get(pk=customer.pk)
+
+        # every input from one conditional aggregate
+        with self.assertNumQueries(1):
+            Loan.objects.filter(customer=customer).aggregate(**credit_profile_aggregates())
+        get_credit_profile(customer)  # rebuilds the missing snapshot
+        customer = Customer.objects.get(pk=customer.pk)
+        with self.assertNumQueries(1):
+            compute_credit_score(customer)
+        with self.assertNumQueries(1):
+            response = self.client.post("/api/check-eligibility", {
+                "customer_id": customer.pk, "loan_amount": 50000, "interest_rate": 14, "tenure": 12,
+            }, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+
+class CreditSnapshotTests(TestCase):
+    """Every single-row Loan write leaves the snapshots exactly as a full rebuild would."""
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().date()
+        cls.last_year = date(today.year - 1, 6, 1)
+        cls.customers = [
+            Customer.objects.create(
+                customer_id=7121 + n, first_name="Snap", last_name=f"Shot{n}", age=30 + n,
+                phone_number=f"900000012{n}", monthly_income=90000, approved_limit=3200000,
+            )
+            for n in range(2)
+        ]
+        for n, (start, active) in enumerate([(cls.last_year, True), (date(today.year, 1, 1), True), (cls.last_year, False)]):
+            Loan.objects.create(
+                customer=cls.customers[n % 2], loan_id=9801 + n, loan_amount=100000 + 10000 * n, tenure=24,
+                interest_rate=12, monthly_repayment=4707 + n, emis_paid_on_time=5 + n, start_date=start,
+                end_date=start + timedelta(days=730), is_active=active,
+            )
+
+    def snapshots(self) -> dict:
+        return {
+            row.pop("customer"): row
+            for row in CustomerCreditSnapshot.objects.filter(customer__in=self.customers).values("customer", *SNAPSHOT_FIELDS)
+        }
+
+    def assertMatchesRebuild(self):
+        incremental = self.snapshots()
+        self.assertEqual(verify_credit_snapshots(), [])
+        refresh_credit_snapshots()
+        self.assertEqual(incremental, self.snapshots())
+        self.assertEqual(verify_portfolio_rollups(), [])
+
+    def edit(self, loan_id: int, **changes):
+        loan = Loan.objects.get(loan_id=loan_id)
+        for field, value in changes.items():
+            setattr(loan, field, value)
+        loan.save()
+
+    def test_insert(self):
+        Loan.objects.create(
+            customer=self.customers[1], loan_id=9811, loan_amount=30000, tenure=6, interest_rate=14,
+            monthly_repayment=5206, emis_paid_on_time=0, start_date=timezone.now().date(),
+            end_date=timezone.now().date() + timedelta(days=180), is_active=True,
+        )
+        self.assertMatchesRebuild()
+
+    def test_update(self):
+        self.edit(9801, loan_amount=125000, monthly_repayment=5884, emis_paid_on_time=9, tenure=30)
+        self.edit(9802, is_active=False)
+        self.assertMatchesRebuild()
+
+    def test_delete(self):
+        Loan.objects.get(loan_id=9802).delete()
+        self.assertMatchesRebuild()
+
+    def test_a_loan_moved_to_another_customer(self):
+        self.edit(9802, customer=self.customers[0])
+        self.assertMatchesRebuild()
+        self.assertEqual(self.snapshots()[self.customers[1].pk]["loans_count"], 0)
+
+    def test_a_start_date_crossing_into_and_out_of_this_year(self):
+        self.edit(9801, start_date=date(timezone.now().year, 2, 1))
+        self.assertMatchesRebuild()
+        self.assertEqual(self.snapshots()[self.customers[0].pk]["activity_count"], 1)
+
+        self.edit(9801, start_date=self.last_year)
+        self.assertMatchesRebuild()
+        self.assertEqual(self.snapshots()[self.customers[0].pk]["activity_count"], 0)
+
+    def test_verify_reports_drift(self):
+        drifted = self.customers[1]
+        CustomerCreditSnapshot.objects.filter(customer=drifted).update(current_emis=1)  # bypasses Loan.save
+
+        with self.assertRaisesMessage(CommandError, f"1 snapshot(s) missing or out of date: {drifted.pk}"):
+            call_command("rebuild_credit_snapshots", "--verify", stdout=io.StringIO())
+        call_command("rebuild_credit_snapshots", stdout=io.StringIO())
+        out = io.StringIO()
+        call_command("rebuild_credit_snapshots", "--verify", stdout=out)
+        self.assertIn("All credit snapshots match", out.getvalue())
+
+
+class HotQueryPlanTests(TestCase):
+    """
+    EXPLAIN every hot-path query against a seeded table and fail on full table
+    scans, so the Loan/Customer indexes keep covering them as the data grows.
+    """
+    customers = 200
+    loans_per_customer = 15
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().date()
+        Customer.objects.bulk_create([
+            Customer(
+                customer_id=1000 + i, first_name=f"First{i}", last_name=f"Last{i}", age=30,
+                phone_number=f"90000{i:05d}", monthly_income=50000, approved_limit=1800000,
+            )
+            for i in range(cls.customers)
+        ])
+        pks = list(Customer.objects.values_list("pk", flat=True))
+        Loan.objects.bulk_create([
+            Loan(
+                customer_id=pk, loan_id=pk * 100 + n, loan_amount=100000, tenure=12,
+                interest_rate=12, monthly_repayment=8885, emis_paid_on_time=n % 12,
+                start_date=today - timedelta(days=90 * n), end_date=today + timedelta(days=365 - 90 * n),
+                is_active=n % 3 != 0,
+            )
+            for pk in pks for n in range(cls.loans_per_customer)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        cls.customer = Customer.objects.order_by("pk")[cls.customers // 2]
+        cls.loan = Loan.objects.filter(customer=cls.customer).first()
+
+    def hot_queries(self):
+        customer = self.customer
+        year_start = date(timezone.now().year, 1, 1)
+        return {
+            "credit profile aggregate": Loan.objects.filter(customer=customer).values("customer")
+                .annotate(**credit_profile_aggregates()).order_by(),
+            "active loans": Loan.objects.filter(customer=customer, is_active=True).order_by("loan_id"),
+            "active sums": Loan.objects.filter(customer=customer, is_active=True)
+                .values("customer").annotate(total=Sum("monthly_repayment")).order_by(),
+            "activity this year": Loan.objects.filter(customer=customer, start_date__gte=year_start),
+            "loan detail": Loan.objects.select_related("customer").filter(loan_id=self.loan.loan_id),
+            "customer by identifier": Customer.objects.filter(
+                Q(id=customer.customer_id) | Q(customer_id=customer.customer_id)
+            ),
+            "credit snapshot": CustomerCreditSnapshot.objects.filter(customer=customer),
+        }
+
+    def explain(self, queryset) -> str:
+        if connection.vendor == "postgresql":
+            # with seq scans priced out, a Seq Scan in the plan means no index applies
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                return queryset.explain()
+        return queryset.explain()
+
+    def assertIndexed(self, name, plan):
+        if connection.vendor == "postgresql":
+            self.assertNotIn("Seq Scan", plan, f"{name} scans a whole table:\n{plan}")
+        else:
+            for line in plan.splitlines():
+                if " SCAN " in f" {line.split(None, 3)[-1]} ":
+                    self.assertIn("INDEX", line, f"{name} scans a whole table:\n{plan}")
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(query=name):
+                self.assertIndexed(name, self.explain(queryset))
+
+    def test_activity_query_uses_start_date_index(self):
+        plan = self.explain(self.hot_queries()["activity this year"])
+        self.assertIn("loan_customer_start_idx", plan)
+
+    def test_customer_identifier_resolution_is_one_query(self):
+        with self.assertNumQueries(1):
+            found = get_customer_by_identifier(self.customer.customer_id)
+        self.assertEqual(found.pk, self.customer.pk)
+
+
+class AsyncViewParityTests(TestCase):
+    """The /api/async/ views must answer exactly like their sync counterparts."""
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().date()
+        cls.customer = Customer.objects.create(
+            customer_id=5001, first_name="Asha", last_name="Rao", age=34,
+            phone_number="9000000001", monthly_income=120000, approved_limit=4300000,
+        )
+        for n in range(4):
+            Loan.objects.create(
+                customer=cls.customer, loan_id=7001 + n, loan_amount=200000 + n * 50000, tenure=24,
+                interest_rate=11.5, monthly_repayment=9400 + n * 2350, emis_paid_on_time=20,
+                start_date=today - timedelta(days=200 * n), end_date=today + timedelta(days=400 - 150 * n),
+                is_active=True,
+            )
+        # a missing snapshot exercises the async rebuild path
+        CustomerCreditSnapshot.objects.filter(customer=cls.customer).delete()
+
+    def setUp(self):
+        caches["loans"].clear()
+
+    def both(self, method, path, body=None):
+        sync = getattr(self.client, method)(f"/api/{path}", body, content_type="application/json")
+        caches["loans"].clear()
+        asynchronous = async_to_sync(getattr(self.async_client, method))(
+            f"/api/async/{path}", body, content_type="application/json"
+        )
+        self.assertEqual(sync.status_code, asynchronous.status_code, path)
+        return sync.json(), asynchronous.json()
+
+    def test_check_eligibility(self):
+        for customer_id in (self.customer.id, self.customer.customer_id, 999999):
+            for rate in (8, 14, 20):
+                body = {"customer_id": customer_id, "loan_amount": 500000, "interest_rate": rate, "tenure": 36}
+                sync, asynchronous = self.both("post", "check-eligibility", body)
+                self.assertEqual(sync, asynchronous)
+
+    def test_view_loan_and_view_loans(self):
+        for path in ("view-loan/7002", "view-loan/1", f"view-loans/{self.customer.id}", "view-loans/999999"):
+            sync, asynchronous = self.both("get", path)
+            self.assertEqual(sync, asynchronous)
+
+    def test_create_loan(self):
+        body = {"customer_id": self.customer.id, "loan_amount": 20000, "interest_rate": 16, "tenure": 12}
+        sync, asynchronous = self.both("post", "create-loan", body)
+        self.assertNotEqual(sync["loan_id"], asynchronous["loan_id"])
+        self.assertTrue(sync["loan_approved"])
+        sync.pop("loan_id"), asynchronous.pop("loan_id")
+        self.assertEqual(sync, asynchronous)
+        self.assertEqual(CustomerCreditSnapshot.objects.get(customer=self.customer).loans_count, 6)
+
+    def test_rejects_invalid_payload(self):
+        sync, asynchronous = self.both("post", "check-eligibility", {"customer_id": "x", "tenure": 0})
+        self.assertEqual(sync, asynchronous)
+
+
+class ConnectionStatsTests(TestCase):
+    def test_reports_every_alias(self):
+        response = self.client.get("/api/db/stats")
+
+        self.assertEqual(response.status_code, 200)
+        stats = response.json()["default"]
+        self.assertGreaterEqual(stats["connections_opened"], 1)
+        self.assertEqual(stats["pooled"], "pool" in stats)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Routing between "default" and the "replica" test alias (a mirror of it). The
+    mirror is a separate connection, so test data has to be committed for it to
+    see it; hence TransactionTestCase.
+    """
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        caches["loans"].clear()
+        today = timezone.now().date()
+        self.customer = Customer.objects.create(
+            customer_id=6001, first_name="Ravi", last_name="Iyer", age=40,
+            phone_number="9000000002", monthly_income=90000, approved_limit=3200000,
+        )
+        Loan.objects.create(
+            customer=self.customer, loan_id=8001, loan_amount=300000, tenure=36, interest_rate=12,
+            monthly_repayment=9964, emis_paid_on_time=10, start_date=today - timedelta(days=300),
+            end_date=today + timedelta(days=780), is_active=True,
+        )
+
+    def queries_by_alias(self, request):
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections["replica"]) as replica:
+            response = request()
+        self.assertLess(response.status_code, 400)
+        return len(primary), len(replica)
+
+    def test_read_only_endpoints_use_the_replica(self):
+        primary, replica = self.queries_by_alias(lambda: self.client.get(f"/api/view-loans/{self.customer.id}"))
+
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        response = self.client.post("/api/register", {
+            "first_name": "Meera", "last_name": "Das", "age": 29, "monthly_income": 60000, "phone_number": "9000000003",
+        }, content_type="application/json")
+        self.assertIn("read_primary", response.cookies)
+
+        primary, replica = self.queries_by_alias(lambda: self.client.get("/api/view-loan/8001"))
+
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    @override_settings(REPLICA_MAX_LAG_SECONDS=-1)
+    def test_lagging_replica_falls_back_to_the_primary(self):
+        replica_lag("replica")  # the lag probe itself runs on the replica; keep it out of the count
+        primary, replica = self.queries_by_alias(lambda: self.client.get(f"/api/view-loans/{self.customer.id}"))
+
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_replica_reads_are_not_cached(self):
+        # a lagging replica could re-cache what an on_commit eviction just dropped
+        for url in ("/api/view-loan/8001", f"/api/view-loans/{self.customer.id}"):
+            with self.subTest(url=url):
+                primary, replica = self.queries_by_alias(lambda: self.client.get(url))
+                self.assertEqual(primary, 0)
+                self.assertGreater(replica, 0)
+        self.assertIsNone(caches["loans"].get(loan_key(8001)))
+        self.assertIsNone(caches["loans"].get(customer_loans_key(self.customer.id, timezone.now().date())))
+
+        self.client.cookies["read_primary"] = "1"
+        self.client.get("/api/view-loan/8001")
+        self.client.cookies.pop("read_primary")
+        self.assertIsNotNone(caches["loans"].get(loan_key(8001)))
+        primary, replica = self.queries_by_alias(lambda: self.client.get("/api/view-loan/8001"))
+        self.assertEqual((primary, replica), (0, 0))  # primary-filled entries still serve replica reads
+
+    def test_streamed_loans_are_read_from_the_replica(self):
+        def stream():
+            response = self.client.get(f"/api/view-loans/{self.customer.id}", {"stream": 1})
+            self.assertEqual([row["loan_id"] for row in json.loads(b"".join(response.streaming_content))], [8001])
+            return response
+
+        primary, replica = self.queries_by_alias(stream)
+
+        self.assertEqual(primary, 0)
+        self.assertGreaterEqual(replica, 2)  # the customer, then the streamed loans
+
+    def test_instances_read_from_a_replica_are_written_to_the_primary(self):
+        customer = Customer.objects.using("replica").get(pk=self.customer.pk)
+        customer.age = 41
+        with CaptureQueriesContext(connections["default"]) as primary:
+            customer.save()
+        self.assertTrue(any("UPDATE" in query["sql"] for query in primary.captured_queries))
+
+
+@skipUnless(connection.vendor == "postgresql", "row locks need PostgreSQL (SQLite serializes all writers)")
+class CreateLoanConcurrencyTests(TransactionTestCase):
+    """
+    Concurrent create-loan requests through the full stack: the EMI check and the
+    insert must hold per customer, while different customers book in parallel.
+    """
+    concurrency = 8
+
+    def setUp(self):
+        caches["loans"].clear()
+
+    def customer_with_emis(self, number: int, monthly_income: int, existing_emi: int) -> Customer:
+        today = timezone.now().date()
+        customer = Customer.objects.create(
+            customer_id=7000 + number, first_name="Load", last_name=f"Test{number}", age=35,
+            phone_number=f"70000{number:05d}", monthly_income=monthly_income, approved_limit=monthly_income * 36,
+        )
+        Loan.objects.create(
+            customer=customer, loan_id=allocate_id("loan"), loan_amount=existing_emi * 12, tenure=600, interest_rate=10,
+            monthly_repayment=existing_emi, emis_paid_on_time=600, start_date=date(today.year - 2, 1, 1),
+            end_date=today + timedelta(days=200), is_active=True,
+        )
+        return customer
+
+    def create_loans(self, customers: list, per_customer: int, loan_amount: int) -> dict:
+        traffic = [
+            ("create-loan", "POST", "/api/create-loan",
+             {"customer_id": customer.id, "loan_amount": loan_amount, "interest_rate": 16, "tenure": 12})
+            for _ in range(per_customer) for customer in customers
+        ]
+        return run_load(traffic, InProcessTransport(), self.concurrency)
+
+    def test_emi_cap_holds_for_concurrent_requests_of_one_customer(self):
+        # existing EMIs at 45% of income: one more loan (EMI ~9% of income) fits, a second must not
+        customer = self.customer_with_emis(1, monthly_income=100000, existing_emi=45000)
+
+        report = self.create_loans([customer], per_customer=4 * self.concurrency, loan_amount=100000)
+
+        self.assertEqual(report["statuses"], {"201": 1, "200": 4 * self.concurrency - 1})
+        self.assertEqual(customer.loans.count(), 2)
+        snapshot = CustomerCreditSnapshot.objects.get(customer=customer)
+        self.assertEqual(snapshot.current_emis, customer.loans.aggregate(total=Sum("monthly_repayment"))["total"])
+
+    def test_throughput_with_many_customers_and_with_one(self):
+        # small loans on a long on-time history, so every request is approved (the credit
+        # score stays above the slab) and both runs do the same work
+        customers = [self.customer_with_emis(n, monthly_income=1000000, existing_emi=1000) for n in range(40)]
+        many = self.create_loans(customers, per_customer=2, loan_amount=1000)
+        one = self.create_loans(customers[:1], per_customer=80, loan_amount=1000)
+
+        for report in (many, one):
+            self.assertEqual(report["statuses"], {"201": 80})
+        self.assertEqual(Loan.objects.count(), 40 + 160)
+        self.assertEqual(customers[0].loans.count(), 1 + 2 + 80)
+        sys.stderr.write(
+            f"\ncreate-loan x{self.concurrency} threads: {many['requests_per_second']} req/s over 40 customers, "
+            f"{one['requests_per_second']} req/s on one customer "
+            f"(p95 {many['p95_ms']} ms vs {one['p95_ms']} ms) "
+        )
+
+
+class IdAllocatorTests(TestCase):
+    """External ids are unique across leased blocks and stay ahead of ids written by ingestion."""
+
+    def setUp(self):
+        # no block or sequence left from an earlier test: the "committed" callbacks
+        # below run although each test's transaction is rolled back
+        for patcher in (mock.patch.dict("loans.ids._blocks", clear=True),
+                        mock.patch("loans.ids._ensured_sequences", set())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def allocate(self, kind: str) -> int:
+        # a leased block is only kept once the allocating transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return allocate_id(kind)
+
+    @override_settings(ID_BLOCK_SIZE=3)
+    def test_ids_are_unique_across_blocks(self):
+        ids = [self.allocate("loan") for _ in range(10)]
+
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ids, sorted(ids))
+
+    @override_settings(ID_BLOCK_SIZE=50)
+    def test_ids_after_an_ingest_are_past_the_ingested_ones(self):
+        Customer.objects.create(
+            customer_id=7081, first_name="Ira", last_name="Sen", age=41,
+            phone_number="9000000081", monthly_income=90000, approved_limit=3200000,
+        )
+        first = self.allocate("loan")
+        # the file takes ids from the middle of the block this process already holds
+        ingested = [first + 5, first + 9]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "loans.csv")
+        rows = [
+            [7081, loan_id, 100000, 12, 12, 8885, 3, date(2024, 1, 1), date(2025, 1, 1)] for loan_id in ingested
+        ]
+        pd.DataFrame(rows, columns=list(LOAN_COLUMNS)).to_csv(path, index=False)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(ingest_loans(path)["inserted"], 2)
+        ids = [self.allocate("loan") for _ in range(5)]
+
+        self.assertGreater(min(ids), max(ingested))
+        self.assertEqual(len(set(ids)), len(ids))
+
+        # a direct write followed by an explicit sync behaves the same
+        Loan.objects.filter(loan_id=ingested[1]).update(loan_id=max(ids) + 3)
+        sync_id_allocator("loan")
+        self.assertGreater(self.allocate("loan"), max(ids) + 3)
+
+    @override_settings(ID_BLOCK_SIZE=50)
+    def test_a_block_leased_before_another_process_synced_skips_the_written_ids(self):
+        customer = Customer.objects.create(
+            customer_id=7082, first_name="Ravi", last_name="Iyer", age=39,
+            phone_number="9000000082", monthly_income=90000, approved_limit=3200000,
+        )
+        first = self.allocate("loan")  # this process now holds the rest of a block
+        written = [first + 1, first + 2, first + 4]
+        for loan_id in written:
+            Loan.objects.create(
+                customer=customer, loan_id=loan_id, loan_amount=100000, tenure=12, interest_rate=12,
+                monthly_repayment=8885, emis_paid_on_time=0, start_date=date(2024, 1, 1),
+                end_date=date(2025, 1, 1), is_active=False,
+            )
+        # the ingesting process syncs its own memory and the IdBlock row, not this process's block
+        with mock.patch.dict("loans.ids._blocks", clear=True):
+            sync_id_allocator("loan")
+
+        ids = [self.allocate("loan") for _ in range(3)]
+
+        self.assertGreater(min(ids), max(written))
+        self.assertFalse(Loan.objects.filter(loan_id__in=ids).exists())
+
+
+class BenchmarkHarnessTests(TestCase):
+    """
+    A small in-process run of the benchmark harness (see the benchmark command):
+    every route answers without server errors and stays within its SQL budget.
+    """
+    # most SQL statements one request of each endpoint may issue on average
+    query_budgets = {
+        "check-eligibility": 2, "async-check-eligibility": 2, "check-eligibility-batch": 2, "loan-offers": 2,
+        "view-loan": 1, "async-view-loan": 1, "view-loan-schedule": 1,
+        "view-loans": 2, "async-view-loans": 2,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seeded = seed_database(40, loans_per_customer=4, seed=7)
+
+    def test_every_route_has_traffic_and_stays_within_budget(self):
+        names = loan_url_names()
+        customer_ids = list(Customer.objects.values_list("id", flat=True))
+        loan_ids = list(Loan.objects.values_list("loan_id", flat=True))
+        traffic = [request for name in names for request in generate_traffic(15, customer_ids, loan_ids, [name])]
+
+        report = run_load(traffic, InProcessTransport())
+
+        self.assertEqual(sorted(report["endpoints"]), sorted(names))
+        self.assertEqual(report["requests"], len(traffic))
+        for name, stats in report["endpoints"].items():
+            with self.subTest(endpoint=name):
+                self.assertFalse([code for code in stats["statuses"] if code >= "500"], stats["statuses"])
+                if name in self.query_budgets:
+                    self.assertLessEqual(stats["queries_per_request"], self.query_budgets[name])
+
+    def test_seeding_builds_snapshots(self):
+        self.assertEqual(self.seeded["customers"], 40)
+        self.assertEqual(CustomerCreditSnapshot.objects.count(), 40)
+
+    def test_percentile_is_nearest_rank(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile([5], 95), 5)
+        self.assertIsNone(percentile([], 50))
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_database(5, loans_per_customer=3, seed=3)
+        cls.loan = Loan.objects.first()
+
+    def sample(self, body: str, name: str, **labels) -> float:
+        wanted = ",".join(f'{key}="{value}"' for key, value in labels.items())
+        for line in body.splitlines():
+            if line.startswith(f"{name}{{{wanted}}} " if labels else f"{name} "):
+                return float(line.rsplit(" ", 1)[1])
+        return 0.0
+
+    def test_requests_and_sql_are_recorded_per_endpoint(self):
+        before = self.client.get("/metrics").content.decode()
+        self.client.get(f"/api/view-loan/{self.loan.loan_id}")
+        self.client.post("/api/check-eligibility", {
+            "customer_id": self.loan.customer_id, "loan_amount": 50000, "interest_rate": 12, "tenure": 12,
+        }, content_type="application/json")
+
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        after = response.content.decode()
+        count = "loans_http_request_duration_seconds_count"
+        self.assertEqual(
+            self.sample(after, count, endpoint="view-loan", method="GET")
+            - self.sample(before, count, endpoint="view-loan", method="GET"), 1,
+        )
+        self.assertGreater(
+            self.sample(after, "loans_db_queries_per_request_sum", endpoint="check-eligibility")
+            - self.sample(before, "loans_db_queries_per_request_sum", endpoint="check-eligibility"), 0,
+        )
+        for function in ("calculate_emi", "score_credit_profile"):
+            self.assertGreater(
+                self.sample(after, "loans_function_duration_seconds_count", function=function)
+                - self.sample(before, "loans_function_duration_seconds_count", function=function), 0,
+            )
+
+    def test_streamed_responses_are_recorded_once_sent(self):
+        count, queries = "loans_http_request_duration_seconds_count", "loans_db_queries_per_request_sum"
+        before = self.client.get("/metrics").content.decode()
+
+        response = self.client.get(f"/api/view-loans/{self.loan.customer_id}", {"stream": 1})
+        sent = self.client.get("/metrics").content.decode()
+        b"".join(response.streaming_content)
+        after = self.client.get("/metrics").content.decode()
+
+        self.assertEqual(self.sample(sent, count, endpoint="view-loans", method="GET"),
+                         self.sample(before, count, endpoint="view-loans", method="GET"))
+        self.assertEqual(self.sample(after, count, endpoint="view-loans", method="GET")
+                         - self.sample(before, count, endpoint="view-loans", method="GET"), 1)
+        # the customer lookup, and the loans read while streaming
+        self.assertEqual(self.sample(after, queries, endpoint="view-loans")
+                         - self.sample(before, queries, endpoint="view-loans"), 2)
+
+    def test_ingest_reports_count_rows(self):
+        from .tasks import _report
+        name = "loans_ingest_rows_total"
+        before = self.client.get("/metrics").content.decode()
+
+        _report("loans", 10, {"inserted": 7, "updated": 2, "skipped": 1}, time.monotonic())
+
+        after = self.client.get("/metrics").content.decode()
+        self.assertEqual(self.sample(after, name, kind="loans", outcome="processed")
+                         - self.sample(before, name, kind="loans", outcome="processed"), 10)
+        self.assertEqual(self.sample(after, name, kind="loans", outcome="inserted")
+                         - self.sample(before, name, kind="loans", outcome="inserted"), 7)
+
+
+class PortfolioRescoringTests(TestCase):
+    """The vectorized nightly rescoring must agree exactly with compute_credit_score."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_database(300, loans_per_customer=4, seed=11)
+        today = timezone.now().date()
+        rng = random.Random(5)
+        # edge cases: over the approved limit, no limit, a zero-tenure loan, paisa amounts, loans this year
+        edge = list(Customer.objects.order_by("pk")[:6])
+        Customer.objects.filter(pk=edge[0].pk).update(approved_limit=100000)
+        Customer.objects.filter(pk=edge[1].pk).update(approved_limit=0)
+        for n, customer in enumerate(edge[2:]):
+            Loan.objects.create(
+                customer=customer, loan_id=900000 + n, loan_amount=f"{rng.uniform(1000, 90000):.2f}",
+                tenure=0 if n == 0 else 12, interest_rate=13.37, monthly_repayment="1234.56",
+                emis_paid_on_time=n, start_date=today, end_date=today + timedelta(days=365), is_active=n % 2 == 0,
+            )
+
+    def test_batch_scores_match_scalar_scores(self):
+        profiles = portfolio_profiles(chunk_size=97)  # several chunks, folded and combined
+        batch = dict(zip(profiles.index.tolist(), score_profiles(profiles).tolist()))
+
+        customers = Customer.objects.select_related("credit_snapshot")
+        self.assertEqual(len(batch), customers.count())
+        mismatched = {
+            customer.pk: (batch[customer.pk], compute_credit_score(customer))
+            for customer in customers if batch[customer.pk] != compute_credit_score(customer)
+        }
+        self.assertEqual(mismatched, {})
+
+    def test_rescore_writes_one_row_per_customer_per_day(self):
+        rescore_portfolio()
+        report = rescore_portfolio()  # same day again: upserted, not duplicated
+
+        self.assertEqual(report["customers"], Customer.objects.count())
+        self.assertEqual(CreditScoreHistory.objects.count(), Customer.objects.count())
+        customer = Customer.objects.order_by("pk").last()
+        stored = CreditScoreHistory.objects.get(customer=customer).credit_score
+        self.assertEqual(float(stored), compute_credit_score(customer))
+
+    def test_an_enqueued_rescore_keeps_its_date(self):
+        from credit_system.celery import app
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, "task_always_eager", False)
+        day = timezone.now().date() - timedelta(days=3)
+
+        call_command("rescore_portfolio", "--enqueue", "--date", day.isoformat(), stdout=io.StringIO())
+
+        self.assertEqual(set(CreditScoreHistory.objects.values_list("scored_on", flat=True)), {day})
+
+
+class LoanCacheTests(TestCase):
+    """Cached view-loan(s) responses are dropped when a write commits, and never outlive their day."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(
+            customer_id=7061, first_name="Tara", last_name="Bose", age=36,
+            phone_number="9000000061", monthly_income=120000, approved_limit=4300000,
+        )
+        cls.loan = Loan.objects.create(
+            customer=cls.customer, loan_id=9601, loan_amount=200000, tenure=24, interest_rate=13,
+            monthly_repayment=9508, emis_paid_on_time=3, start_date=date(2024, 1, 14),
+            end_date=date(2040, 6, 14), is_active=True,
+        )
+
+    def setUp(self):
+        caches["loans"].clear()
+
+    def cached_keys(self) -> set:
+        self.client.get(f"/api/view-loan/{self.loan.loan_id}")
+        today = timezone.now().date()
+        keys = {loan_key(self.loan.loan_id)}
+        for identifier in (self.customer.pk, self.customer.customer_id):
+            self.client.get(f"/api/view-loans/{identifier}")
+            keys.add(customer_loans_key(identifier, today))
+        self.assertEqual(set(caches["loans"].get_many(keys)), keys)
+        return keys
+
+    def test_loan_writes_evict_on_commit(self):
+        for write in ("save", "delete"):
+            with self.subTest(write=write):
+                keys = self.cached_keys()
+                with self.captureOnCommitCallbacks(execute=True):
+                    with transaction.atomic():
+                        loan = Loan.objects.get(pk=self.loan.pk)
+                        if write == "save":
+                            loan.emis_paid_on_time += 1
+                        getattr(loan, write)()
+                        self.assertEqual(set(caches["loans"].get_many(keys)), keys)  # not yet committed
+                self.assertEqual(caches["loans"].get_many(keys), {})
+
+    def at(self, moment: datetime):
+        return mock.patch("django.utils.timezone.now", return_value=timezone.make_aware(moment))
+
+    def test_customer_loans_entries_roll_over_at_midnight(self):
+        with self.at(datetime(2040, 2, 14, 23, 59, 30)):
+            key, timeout = _customer_loans_entry(self.customer.pk)
+            before = self.client.get(f"/api/view-loans/{self.customer.pk}").json()
+        self.assertEqual((key, timeout), (customer_loans_key(self.customer.pk, date(2040, 2, 14)), 30))
+
+        with self.at(datetime(2040, 2, 15, 0, 0, 10)):
+            key, timeout = _customer_loans_entry(self.customer.pk)
+            after = self.client.get(f"/api/view-loans/{self.customer.pk}").json()
+        self.assertEqual(key, customer_loans_key(self.customer.pk, date(2040, 2, 15)))
+        self.assertEqual(timeout, settings.LOAN_CACHE_TIMEOUT)
+
+        # the end date's day (14th) has passed on the 15th: one repayment fewer
+        self.assertEqual(before[0]["repayments_left"], 4)
+        self.assertEqual(after[0]["repayments_left"], 3)
+
+
+class CheckEligibilityBatchTests(TestCase):
+    """The batch endpoint answers like check-eligibility item by item, in a fixed number of queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_database(20, loans_per_customer=3, seed=17)
+        cls.customers = list(Customer.objects.order_by("pk"))
+
+    def batch(self, items, status_code=200):
+        response = self.client.post("/api/check-eligibility/batch", items, content_type="application/json")
+        self.assertEqual(response.status_code, status_code, response.content)
+        return response.json()
+
+    def item(self, customer_id, amount=50000, rate=14, tenure=24) -> dict:
+        return {"customer_id": customer_id, "loan_amount": amount, "interest_rate": rate, "tenure": tenure}
+
+    def test_results_follow_the_input_order(self):
+        items = [
+            self.item(customer.pk, amount=10000 * (n + 1), rate=8 + n % 10, tenure=6 * (n % 5 + 1))
+            for n, customer in enumerate(reversed(self.customers))
+        ]
+
+        results = self.batch({"requests": items})
+
+        self.assertEqual(len(results), len(items))
+        for item, result in zip(items, results):
+            single = self.client.post("/api/check-eligibility", item, content_type="application/json").json()
+            self.assertEqual(result, single)
+
+    def test_bad_items_fail_alone(self):
+        items = [
+            self.item(self.customers[0].pk),
+            {"customer_id": self.customers[1].pk, "loan_amount": "lots"},
+            self.item(999999),
+            self.item(self.customers[2].customer_id),  # external ids resolve too
+        ]
+
+        results = self.batch(items)
+
+        self.assertEqual([result.get("status") for result in results], [None, 400, 404, None])
+        self.assertIn("loan_amount", results[1]["error"])
+        self.assertEqual(results[2]["error"], "customer not found")
+        self.assertEqual(results[3]["customer_id"], self.customers[2].pk)
+
+    @override_settings(ELIGIBILITY_BATCH_MAX_ITEMS=3)
+    def test_batches_over_the_cap_are_rejected(self):
+        self.assertEqual(len(self.batch([self.item(self.customers[0].pk)] * 3)), 3)
+        self.assertIn("error", self.batch([self.item(self.customers[0].pk)] * 4, status_code=400))
+        self.assertIn("error", self.batch({"requests": "nope"}, status_code=400))
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        for size in (1, 5, 20):
+            with self.subTest(size=size), self.assertNumQueries(1):
+                self.batch([self.item(customer.pk) for customer in self.customers[:size]])
+
+
+class LoanOffersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().date()
+        cls.customer = Customer.objects.create(
+            customer_id=7001, first_name="Kiran", last_name="Shah", age=38,
+            phone_number="9000000004", monthly_income=80000, approved_limit=2900000,
+        )
+        Loan.objects.create(
+            customer=cls.customer, loan_id=9101, loan_amount=400000, tenure=48, interest_rate=11,
+            monthly_repayment=10338, emis_paid_on_time=30, start_date=today - timedelta(days=900),
+            end_date=today + timedelta(days=540), is_active=True,
+        )
+
+    def offers(self, **body):
+        response = self.client.post(
+            "/api/loan-offers", {"customer_id": self.customer.id, **body}, content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_each_offer_is_the_largest_approvable_amount(self):
+        out = self.offers(interest_rate=14, tenures=[12, 36, 60, 120], amount_step=5000)
+
+        self.assertTrue(out["approval"])
+        budget = 0.5 * 80000 - 10338
+        headroom = 2900000 - 400000
+        for offer in out["offers"]:
+            with self.subTest(tenure=offer["tenure"]):
+                amount, emi = offer["max_loan_amount"], offer["monthly_installment"]
+                self.assertEqual(emi, calculate_emi(amount, 14, offer["tenure"]))
+                self.assertLessEqual(emi, budget)
+                self.assertLessEqual(amount, headroom)
+                bigger = amount + 5000
+                self.assertTrue(bigger > headroom or calculate_emi(bigger, 14, offer["tenure"]) > budget)
+
+    def test_long_tenures_are_capped_by_the_approved_limit(self):
+        Customer.objects.filter(pk=self.customer.pk).update(approved_limit=1000000)
+
+        out = self.offers(interest_rate=14, tenures=[6, 120])
+
+        short, long = out["offers"]
+        self.assertLess(short["max_loan_amount"], 600000)  # EMI budget binds
+        self.assertEqual(long["max_loan_amount"], 600000)  # approved limit binds
+
+    def test_offers_are_accepted_by_create_loan(self):
+        offers = self.offers(interest_rate=14, tenures=[6, 24, 60, 120])["offers"]
+
+        for offer in offers:
+            with self.subTest(tenure=offer["tenure"]), transaction.atomic():
+                response = self.client.post("/api/create-loan", {
+                    "customer_id": self.customer.id, "loan_amount": offer["max_loan_amount"], "interest_rate": 14,
+                    "tenure": offer["tenure"],
+                }, content_type="application/json")
+
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(response.json()["monthly_installment"], offer["monthly_installment"])
+                transaction.set_rollback(True)  # each offer against the same existing loans
+
+    def test_rate_below_the_slab_gets_no_offers(self):
+        CustomerCreditSnapshot.objects.filter(customer=self.customer).update(loans_count=20, activity_count=5)
+
+        out = self.offers(interest_rate=10)
+
+        self.assertFalse(out["approval"])
+        self.assertIsNotNone(out["corrected_interest_rate"])
+        self.assertTrue(all(offer["max_loan_amount"] is None for offer in out["offers"]))
+
+    def test_profile_is_read_once(self):
+        with self.assertNumQueries(1):
+            self.offers(interest_rate=16)
+
+
+class ViewLoansPagingTests(TestCase):
+    """view-loans in its paged and streamed forms returns exactly the full list."""
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().date()
+        cls.customer = Customer.objects.create(
+            customer_id=7051, first_name="Nila", last_name="Menon", age=33,
+            phone_number="9000000051", monthly_income=150000, approved_limit=5400000,
+        )
+        for n, loan_id in enumerate([9411, 9402, 9405, 9420, 9417, 9408, 9433]):
+            Loan.objects.create(
+                customer=cls.customer, loan_id=loan_id, loan_amount=50000 + n, tenure=24, interest_rate=12,
+                monthly_repayment=2354, emis_paid_on_time=n, start_date=today - timedelta(days=100),
+                end_date=today + timedelta(days=30 * n + 5), is_active=loan_id != 9417,
+            )
+
+    def setUp(self):
+        caches["loans"].clear()
+
+    def url(self) -> str:
+        return f"/api/view-loans/{self.customer.id}"
+
+    def test_pages_cover_every_loan_once_in_loan_id_order(self):
+        full = self.client.get(self.url()).json()
+        seen, cursor, pages = [], None, 0
+        while True:
+            params = {"limit": 2, **({"cursor": cursor} if cursor is not None else {})}
+            response = self.client.get(self.url(), params)
+            self.assertEqual(response.status_code, 200)
+            seen += response.json()
+            pages += 1
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                self.assertNotIn("Link", response.headers)
+                break
+            self.assertEqual(int(cursor), seen[-1]["loan_id"])
+            self.assertIn(f"cursor={cursor}", response.headers["Link"])
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, full)
+        self.assertEqual([row["loan_id"] for row in seen], [9402, 9405, 9408, 9411, 9420, 9433])
+
+    def test_a_full_last_page_has_no_next_cursor(self):
+        response = self.client.get(self.url(), {"limit": 3, "cursor": 9408})
+
+        self.assertEqual([row["loan_id"] for row in response.json()], [9411, 9420, 9433])
+        self.assertNotIn("X-Next-Cursor", response.headers)
+
+    def test_bad_paging_parameters(self):
+        self.assertEqual(self.client.get(self.url(), {"limit": "x"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/view-loans/999999", {"limit": 2}).status_code, 404)
+        capped = self.client.get(self.url(), {"limit": 0})
+        self.assertEqual(len(capped.json()), 1)
+
+    def test_stream_matches_the_full_list(self):
+        full = self.client.get(self.url()).json()
+
+        response = self.client.get(self.url(), {"stream": 1})
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), full)
+        self.assertEqual(self.client.get("/api/view-loans/999999", {"stream": 1}).status_code, 404)
+
+    def test_repayments_left_expression_matches_months_between(self):
+        ends = [
+            date(2023, 12, 31), date(2024, 1, 30), date(2024, 1, 31), date(2024, 2, 28), date(2024, 2, 29),
+            date(2024, 3, 1), date(2024, 3, 28), date(2024, 3, 29), date(2024, 3, 31), date(2024, 4, 30),
+            date(2024, 12, 31), date(2025, 2, 28), date(2026, 1, 15),
+        ]
+        Loan.objects.bulk_create([
+            Loan(customer=self.customer, loan_id=9500 + n, loan_amount=1000, tenure=12, interest_rate=12,
+                 monthly_repayment=89, start_date=date(2023, 1, 1), end_date=end, is_active=False)
+            for n, end in enumerate(ends)
+        ])
+        loans = Loan.objects.filter(loan_id__gte=9500)
+        for today in (date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 1), date(2024, 3, 31), date(2024, 12, 31)):
+            with self.subTest(today=today):
+                computed = dict(loans.annotate(left=repayments_left_expression(today)).values_list("end_date", "left"))
+                self.assertEqual(computed, {end: months_between(today, end) for end in ends})
+
+
+class MaturitySweepTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().date()
+        cls.customer = Customer.objects.create(
+            customer_id=7101, first_name="Asha", last_name="Rao", age=45,
+            phone_number="9000000005", monthly_income=50000, approved_limit=1800000,
+        )
+        for n, days_left in enumerate([-2000, -400, -1, 0, 300]):
+            Loan.objects.create(
+                customer=cls.customer, loan_id=9201 + n, loan_amount=100000, tenure=24, interest_rate=12,
+                monthly_repayment=4707, emis_paid_on_time=24, start_date=today + timedelta(days=days_left - 720),
+                end_date=today + timedelta(days=days_left), is_active=True,
+            )
+
+    def setUp(self):
+        caches["loans"].clear()
+
+    def test_matured_loans_are_deactivated_in_batches(self):
+        self.client.get(f"/api/view-loans/{self.customer.id}")  # cached before the sweep
+
+        with self.captureOnCommitCallbacks(execute=True):
+            report = sweep_matured_loans(batch_size=2)
+
+        self.assertEqual((report["deactivated"], report["batches"], report["remaining"]), (3, 2, False))
+        active = list(self.customer.loans.filter(is_active=True).values_list("loan_id", flat=True))
+        self.assertEqual(sorted(active), [9204, 9205])  # ending today or later
+        self.assertEqual(CustomerCreditSnapshot.objects.get(customer=self.customer).current_emis, 2 * 4707)
+        listed = [row["loan_id"] for row in self.client.get(f"/api/view-loans/{self.customer.id}").json()]
+        self.assertEqual(sorted(listed), [9204, 9205])
+
+    def test_a_bounded_run_resumes_where_it_stopped(self):
+        first = sweep_matured_loans(batch_size=1, max_batches=2)
+        second = sweep_matured_loans(batch_size=1)
+
+        self.assertEqual((first["deactivated"], first["remaining"]), (2, True))
+        self.assertEqual((second["deactivated"], second["remaining"]), (1, False))
+        self.assertEqual(sweep_matured_loans()["deactivated"], 0)
+
+    def test_an_enqueued_sweep_keeps_its_date_and_batch_size(self):
+        from credit_system.celery import app
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, "task_always_eager", False)
+        day = (timezone.now().date() - timedelta(days=500)).isoformat()
+
+        with mock.patch("loans.maturity._sweep_batch", wraps=_sweep_batch) as sweep_batch:
+            call_command("sweep_matured_loans", "--enqueue", "--date", day, "--batch-size", "7", stdout=io.StringIO())
+
+        sweep_batch.assert_called_with(date.fromisoformat(day), 7)
+        # only the loan that had already ended by that day
+        self.assertEqual(list(self.customer.loans.filter(is_active=False).values_list("loan_id", flat=True)), [9201])
+        with self.assertRaises(CommandError):
+            call_command("sweep_matured_loans", "--enqueue", "--benchmark", "1", stdout=io.StringIO())
+
+    def test_ingestion_sets_is_active_from_the_end_date(self):
+        today = timezone.now().date()
+        rows = pd.DataFrame([
+            [7101, 9301, 50000, 12, 12, 4442, 12, today - timedelta(days=800), today - timedelta(days=435)],
+            [7101, 9302, 50000, 12, 12, 4442, 3, today - timedelta(days=90), today + timedelta(days=275)],
+        ], columns=list(LOAN_COLUMNS))
+
+        self.assertEqual(_loan_frame(rows)["is_active"].tolist(), [False, True])
+
+    def test_active_set_benchmark_reports_every_query(self):
+        timings = time_active_set([self.customer.pk], repeat=2)
+
+        self.assertEqual(timings["active_loans"], 5)
+        for name, stats in timings["queries"].items():
+            with self.subTest(query=name):
+                self.assertEqual(stats["runs"], 2)
+
+
+class LoanArchiveTests(TestCase):
+    """Archiving old closed loans must leave every credit score unchanged."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_database(150, loans_per_customer=5, seed=13)
+        sweep_matured_loans()
+
+    def scores(self) -> dict:
+        return {
+            customer.pk: compute_credit_score(customer)
+            for customer in Customer.objects.select_related("credit_snapshot")
+        }
+
+    def test_scores_are_identical_after_archiving(self):
+        before = self.scores()
+        hot_loans = Loan.objects.count()
+
+        report = archive_closed_loans(older_than_days=0, batch_size=100)
+
+        self.assertGreater(report["archived"], 100)
+        self.assertEqual(LoanArchive.objects.count(), report["archived"])
+        self.assertEqual(Loan.objects.count(), hot_loans - report["archived"])
+        self.assertFalse(report["remaining"])
+        self.assertEqual(verify_credit_snapshots(), [])
+        refresh_credit_snapshots()  # rebuilt from Loan + rollups
+        self.assertEqual(self.scores(), before)
+        profiles = portfolio_profiles(chunk_size=97)
+        self.assertEqual(dict(zip(profiles.index.tolist(), score_profiles(profiles).tolist())), before)
+
+    def test_only_old_closed_loans_from_earlier_years_are_archived(self):
+        today = timezone.now().date()
+        archive_closed_loans(older_than_days=90)
+
+        self.assertFalse(LoanArchive.objects.filter(end_date__gte=today - timedelta(days=90)).exists())
+        self.assertFalse(LoanArchive.objects.filter(start_date__gte=date(today.year, 1, 1)).exists())
+        self.assertFalse(archivable_loans(today, 90).exists())
+        self.assertEqual(Loan.objects.filter(end_date__gte=today).exclude(is_active=True).count(), 0)
+
+    def test_view_loan_falls_back_to_the_archive(self):
+        loan = archivable_loans(timezone.now().date(), 0).first()
+        caches["loans"].clear()
+        before = self.client.get(f"/api/view-loan/{loan.loan_id}").json()
+        caches["loans"].clear()
+
+        archive_closed_loans(older_than_days=0)
+
+        self.assertFalse(Loan.objects.filter(loan_id=loan.loan_id).exists())
+        self.assertEqual(self.client.get(f"/api/view-loan/{loan.loan_id}").json(), before)
+        self.assertEqual(self.client.get(f"/api/view-loan/{loan.loan_id}/schedule").status_code, 200)
+
+    def test_ingesting_an_archived_loan_moves_it_back(self):
+        archive_closed_loans(older_than_days=0)
+        archived = LoanArchive.objects.select_related("customer").order_by("pk").first()
+        rollup = CustomerArchiveRollup.objects.get(customer=archived.customer)
+        row = {
+            "Customer ID": archived.customer.customer_id, "Loan ID": archived.loan_id,
+            "Loan Amount": archived.loan_amount, "Tenure": archived.tenure, "Interest Rate": archived.interest_rate,
+            "Monthly payment": archived.monthly_repayment, "EMIs paid on Time": archived.emis_paid_on_time + 1,
+            "Date of Approval": archived.start_date, "End Date": archived.end_date,
+        }
+
+        stats = _upsert_loans(pd.DataFrame([row]), {archived.customer.customer_id: archived.customer.pk})
+
+        self.assertEqual((stats["inserted"], stats["updated"]), (0, 1))
+        self.assertFalse(LoanArchive.objects.filter(loan_id=archived.loan_id).exists())
+        self.assertEqual(Loan.objects.get(loan_id=archived.loan_id).emis_paid_on_time, archived.emis_paid_on_time + 1)
+        self.assertEqual(
+            CustomerArchiveRollup.objects.filter(customer=archived.customer).values_list("loans_count", flat=True).first() or 0,
+            rollup.loans_count - 1,
+        )
+        self.assertEqual(verify_credit_snapshots([archived.customer.pk]), [])
+
+
+class LoanExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_database(30, loans_per_customer=4, seed=21)
+        sweep_matured_loans()
+        archive_closed_loans(older_than_days=365 * 3)
+
+    def export(self, **params):
+        response = self.client.get("/api/export/loans", params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_csv_export_covers_hot_and_archived_loans(self):
+        response, body = self.export()
+
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertGreater(LoanArchive.objects.count(), 0)
+        self.assertEqual(len(rows), Loan.objects.count() + LoanArchive.objects.count())
+        self.assertEqual(
+            sorted(int(row["loan_id"]) for row in rows if row["archived"] == "True"),
+            sorted(LoanArchive.objects.values_list("loan_id", flat=True)),
+        )
+        loan = Loan.objects.select_related("customer").first()
+        row = next(row for row in rows if int(row["loan_id"]) == loan.loan_id)
+        self.assertEqual(int(row["customer_id"]), loan.customer.customer_id)
+        self.assertEqual(row["start_date"], loan.start_date.isoformat())
+
+    def test_ndjson_export_applies_filters(self):
+        start, end = date(2022, 1, 1), date(2024, 12, 31)
+        _, body = self.export(format="ndjson", active="true", start_date_from=start, start_date_to=end)
+
+        rows = [json.loads(line) for line in body.splitlines()]
+        expected = Loan.objects.filter(is_active=True, start_date__range=(start, end))
+        self.assertTrue(rows)
+        self.assertEqual([row["loan_id"] for row in rows], list(expected.order_by("loan_id").values_list("loan_id", flat=True)))
+        self.assertTrue(all(row["is_active"] and not row["archived"] for row in rows))
+
+    def test_keyset_pages_add_up_to_the_whole_export(self):
+        self.assertEqual(list(iter_loan_rows(page_size=7, chunk_size=3)), list(iter_loan_rows(page_size=100000)))
+
+    def test_bad_parameters_are_rejected(self):
+        self.assertEqual(self.client.get("/api/export/loans", {"format": "xml"}).status_code, 400)
+        response = self.client.get("/api/export/loans", {"start_date_from": "2024-02-01", "start_date_to": "2024-01-01"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_command_writes_ndjson(self):
+        out = io.StringIO()
+        call_command("export_loans", "--format", "ndjson", "--active", "false", "--exclude-archived", stdout=out)
+
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(rows), Loan.objects.filter(is_active=False).count())
+
+
+class PortfolioRollupTests(TestCase):
+    """Every write path must leave the portfolio rollups equal to a rebuild from scratch."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_database(60, loans_per_customer=4, seed=31)
+
+    def setUp(self):
+        caches["loans"].clear()
+
+    def assertRollupsExact(self):
+        self.assertEqual(verify_portfolio_rollups(), [])
+
+    def test_seeded_rollups_match_a_rebuild(self):
+        self.assertRollupsExact()
+        before = stored_rollups()
+
+        report = rebuild_portfolio_rollups()
+
+        self.assertEqual(report["snapshots_restated"], 0)
+        self.assertEqual(stored_rollups(), before)
+        self.assertFalse(PortfolioRollup.objects.exclude(slot=0).exists())
+
+    def test_write_paths_update_the_rollups_incrementally(self):
+        today = timezone.now().date()
+        customer = Customer.objects.create(
+            customer_id=7301, first_name="Ravi", last_name="Iyer", age=39,
+            phone_number="9000000301", monthly_income=200000, approved_limit=7200000,
+        )
+        response = self.client.post("/api/create-loan", {
+            "customer_id": customer.pk, "loan_amount": 100000, "interest_rate": 14, "tenure": 12,
+        }, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertRollupsExact()
+        self.assertEqual(stored_rollups()[("new_loans", today.isoformat())][0], 1)
+
+        sweep_matured_loans()
+        self.assertRollupsExact()
+
+        archive_closed_loans(older_than_days=0)
+        self.assertRollupsExact()
+
+        loan = Loan.objects.select_related("customer").filter(is_active=True).exclude(customer=customer).first()
+        rows = pd.DataFrame([
+            [loan.customer.customer_id, loan.loan_id, 250000, 24, 18, 12481, 3, loan.start_date, today + timedelta(days=400)],
+            [loan.customer.customer_id, 99001, 50000, 12, 10.5, 4407.5, 0, today, today + timedelta(days=365)],
+        ], columns=list(LOAN_COLUMNS))
+        _upsert_loans(rows, {loan.customer.customer_id: loan.customer.pk})
+        self.assertRollupsExact()
+
+        loan.customer.monthly_income = 300000
+        loan.customer.save()
+        self.assertEqual(CustomerCreditSnapshot.objects.get(customer=loan.customer).income_band, "200000+")
+        self.assertRollupsExact()
+
+        Loan.objects.get(loan_id=99001).delete()
+        self.assertRollupsExact()
+
+        loan.customer.delete()
+        self.assertRollupsExact()
+
+    def test_summary_is_read_from_the_rollups(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/portfolio/summary", {"days": 7})
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        active = Loan.objects.filter(is_active=True)
+        self.assertEqual(body["active_loans"]["count"], active.count())
+        self.assertAlmostEqual(body["active_loans"]["exposure"], float(active.aggregate(total=Sum("loan_amount"))["total"]), places=2)
+        self.assertEqual(sum(band["loans"] for band in body["by_interest_slab"]), active.count())
+        self.assertEqual(
+            sum(band["borrowers"] for band in body["by_credit_score_band"]),
+            CustomerCreditSnapshot.objects.filter(current_loans_amount__gt=0).count(),
+        )
+        self.assertEqual(len(body["new_loans_per_day"]), 7)
+        since = timezone.now().date() - timedelta(days=6)
+        self.assertEqual(
+            sum(day["loans"] for day in body["new_loans_per_day"]), Loan.objects.filter(start_date__gte=since).count(),
+        )
+        self.assertEqual(self.client.get("/api/portfolio/summary", {"days": 0}).status_code, 400)
+
+    def test_command_verifies_and_rebuilds(self):
+        PortfolioRollup.objects.filter(dimension="interest_slab").update(count=0)
+        with self.assertRaises(CommandError):
+            call_command("rebuild_portfolio_rollups", "--verify", stdout=io.StringIO())
+
+        call_command("rebuild_portfolio_rollups", stdout=io.StringIO())
+
+        self.assertRollupsExact()
+
+
+@skipUnless(connection.vendor == "postgresql", "row locks need PostgreSQL (SQLite serializes all writers)")
+class PortfolioRollupConcurrencyTests(TransactionTestCase):
+    """Concurrent snapshot rebuilds of one customer must move its rollup contribution once."""
+
+    def test_overlapping_async_rebuilds_count_the_customer_once(self):
+        seed_database(3, loans_per_customer=3, seed=41)
+        customer = Customer.objects.order_by("pk").first()
+        # a stale snapshot whose amounts are off, counted as such in the rollups
+        snapshot = CustomerCreditSnapshot.objects.get(customer=customer)
+        deltas = {}
+        add_snapshot(deltas, snapshot, -1)
+        snapshot.current_loans_amount += 1000
+        snapshot.activity_year = 2000
+        add_snapshot(deltas, snapshot, 1)
+        snapshot.save()
+        apply_deltas(deltas)
+        barrier = threading.Barrier(2)
+        errors = []
+
+        def rebuild():
+            try:
+                stale = Customer.objects.select_related("credit_snapshot").get(pk=customer.pk)
+                barrier.wait()
+                async_to_sync(aget_credit_profile)(stale)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=rebuild) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(verify_credit_snapshots([customer.pk]), [])
+        expected, _ = compute_rollups()
+        summary = portfolio_summary()
+        for dimension, bands in ((CREDIT_SCORE_BAND, "by_credit_score_band"), (MONTHLY_INCOME_BAND, "by_monthly_income_band")):
+            for band in summary[bands]:
+                count, exposure, emis = expected.get((dimension, band["band"]), (0, 0, 0))
+                self.assertEqual(
+                    (band["borrowers"], band["exposure"], band["monthly_emis"]), (count, float(exposure), float(emis)),
+                )
+        self.assertEqual(verify_portfolio_rollups(), [])
+
+
+class DeltaIngestTests(TestCase):
+    """
+    Re-ingesting a file only writes what it has not written yet: the chunks after
+    an interrupted run's checkpoint, and the rows that changed since the last run.
+    """
+
+    def setUp(self):
+        caches["loans"].clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        today = timezone.now().date()
+        self.customers = [
+            [8001 + n, f"First{n}", f"Last{n}", 30 + n, 9100000000 + n, 40000 + 10000 * n, 1500000 + 100000 * n]
+            for n in range(4)
+        ]
+        self.loans = [
+            [8001 + n % 4, 8101 + n, 100000 + 5000 * n, 24, 12 + n, 4707, 10 + n,
+             today - timedelta(days=300 + 100 * n), today + timedelta(days=400 - 100 * n)]
+            for n in range(5)
+        ]
+        # closed and old enough to be archived
+        self.loans.append([8001, 8106, 90000, 12, 11, 7999, 12, date(2015, 3, 1), date(2016, 3, 1)])
+        # an unknown customer (rejected), and an incomplete row (skipped)
+        self.loans.append([8999, 8198, 10000, 12, 11, 889, 0, date(2024, 1, 1), date(2025, 1, 1)])
+        self.loans.append([8001, 8199, None, 12, 11, 889, 0, date(2024, 1, 1), date(2025, 1, 1)])
+
+    def write(self, name: str, columns: dict, rows: list) -> str:
+        path = os.path.join(self.directory, name)
+        pd.DataFrame(rows, columns=list(columns)).to_csv(path, index=False)
+        return path
+
+    def ingest(self, version: int, **kwargs) -> tuple:
+        customers = self.write(f"customers-{version}.csv", CUSTOMER_COLUMNS, self.customers)
+        loans = self.write(f"loans-{version}.csv", LOAN_COLUMNS, self.loans)
+        return ingest_customers(customers, **kwargs), ingest_loans(loans, **kwargs)
+
+    def counts(self, report: dict) -> tuple:
+        self.assertEqual(
+            report["rows"],
+            report["inserted"] + report["updated"] + report["unchanged"] + report["skipped"] + report.get("rejected", 0),
+        )
+        return report["inserted"], report["updated"], report["unchanged"]
+
+    def test_only_new_and_changed_rows_are_written(self):
+        customers, loans = self.ingest(1)
+        self.assertEqual((self.counts(customers), self.counts(loans)), ((4, 0, 0), (6, 0, 0)))
+        self.assertEqual((loans["rejected"], loans["skipped"]), (1, 1))
+        archive_closed_loans(older_than_days=0)
+
+        customers, loans = self.ingest(1)  # the same files again
+        self.assertTrue(customers["file_unchanged"] and loans["file_unchanged"])
+        for report in (customers, loans):
+            self.counts(report)  # checks the totals
+        self.assertEqual((customers["inserted"] + customers["updated"], loans["inserted"] + loans["updated"]), (0, 0))
+
+        with CaptureQueriesContext(connection) as queries:
+            customers, loans = self.ingest(1, force=True)
+        self.assertEqual((self.counts(customers), self.counts(loans)), ((0, 0, 4), (0, 0, 6)))
+        written = [query["sql"] for query in queries if query["sql"].startswith(("INSERT", "UPDATE", "DELETE"))]
+        self.assertFalse([sql for sql in written if "loans_ingestcheckpoint" not in sql and "loans_idblock" not in sql])
+        self.assertTrue(LoanArchive.objects.filter(loan_id=8106).exists())  # unchanged, so left archived
+
+        first = [list(row) for row in self.customers], [list(row) for row in self.loans]
+        self.customers[1][5] = 250000  # income moves the customer to another band
+        self.loans[2][6] += 1
+        self.loans.append([8004, 8107, 70000, 12, 15, 6318, 0, timezone.now().date(), timezone.now().date() + timedelta(days=365)])
+        customers, loans = self.ingest(2)
+
+        self.assertEqual((self.counts(customers), self.counts(loans)), ((0, 1, 3), (1, 1, 5)))
+        self.assertEqual(Customer.objects.get(customer_id=8002).monthly_income, 250000)
+        self.assertEqual(Loan.objects.get(loan_id=8103).emis_paid_on_time, 13)
+        self.assertEqual(verify_credit_snapshots(), [])
+        self.assertEqual(verify_portfolio_rollups(), [])
+
+        self.customers, self.loans = first
+        customers, _ = self.ingest(1)  # back to the first file: not skipped, it is no longer current
+        self.assertFalse(customers["file_unchanged"])
+        self.assertEqual(Customer.objects.get(customer_id=8002).monthly_income, 50000)
+
+    def test_fast_ingest_reports_like_ingest_files(self):
+        from credit_system.celery import app
+        from .tasks import fast_ingest_files
+        # a duplicate in the same shard: skipped by both paths (across shards it would read as unchanged)
+        self.customers.insert(1, list(self.customers[0]))
+        customers = self.write("customers.csv", CUSTOMER_COLUMNS, self.customers)
+        loans = self.write("loans.csv", LOAN_COLUMNS, self.loans)
+        keys = ("rows", "inserted", "updated", "unchanged", "skipped", "rejected")
+
+        with transaction.atomic():
+            fast = fast_ingest_files(customers, loans, reject_file=os.path.join(self.directory, "fast.rejects.csv"))
+            transaction.set_rollback(True)
+
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, "task_always_eager", False)
+        with self.assertLogs("loans.tasks", "INFO") as logs:
+            ingest_files(customers, loans, shards=2)
+        summary = next(record.args for record in logs.records if record.msg.startswith("ingest finished"))
+
+        for kind in ("customers", "loans"):
+            with self.subTest(kind=kind):
+                self.assertEqual(
+                    {key: fast[kind].get(key, 0) for key in keys}, {key: summary[kind].get(key, 0) for key in keys},
+                )
+        self.assertEqual((summary["loans"]["inserted"], summary["loans"]["rejected"]), (6, 1))
+
+    @skipUnless(connection.vendor == "postgresql", "the COPY merge only runs on PostgreSQL")
+    def test_fast_ingest_only_writes_new_and_changed_rows(self):
+        from .tasks import fast_ingest_files
+
+        def fast_ingest():
+            customers = self.write("customers.csv", CUSTOMER_COLUMNS, self.customers)
+            loans = self.write("loans.csv", LOAN_COLUMNS, self.loans)
+            with self.assertLogs("loans.tasks", "INFO") as logs:
+                report = fast_ingest_files(customers, loans, reject_file=os.path.join(self.directory, "rejects.csv"))
+            for record in logs.records:
+                record.getMessage()  # every summary line formats
+            return report["customers"], report["loans"]
+
+        customers, loans = fast_ingest()
+        self.assertEqual((self.counts(customers), self.counts(loans)), ((4, 0, 0), (6, 0, 0)))
+        self.assertEqual((loans["rejected"], loans["skipped"]), (1, 1))
+        archive_closed_loans(older_than_days=0)
+        # edited behind the ingest's back (the digest stays): an unchanged file row must not overwrite it
+        Loan.objects.filter(loan_id=8101).update(emis_paid_on_time=0)
+
+        customers, loans = fast_ingest()
+        self.assertEqual((self.counts(customers), self.counts(loans)), ((0, 0, 4), (0, 0, 6)))
+        self.assertEqual(Loan.objects.get(loan_id=8101).emis_paid_on_time, 0)
+        self.assertTrue(LoanArchive.objects.filter(loan_id=8106).exists())  # unchanged, so left archived
+        self.assertFalse(Loan.objects.filter(loan_id=8106).exists())
+
+        self.loans[2][6] += 1
+        self.loans[5][6] += 1  # the archived loan changed: it moves back
+        customers, loans = fast_ingest()
+        self.assertEqual((self.counts(customers), self.counts(loans)), ((0, 0, 4), (0, 2, 4)))
+        self.assertEqual(Loan.objects.get(loan_id=8103).emis_paid_on_time, 13)
+        self.assertFalse(LoanArchive.objects.filter(loan_id=8106).exists())
+
+    def interrupted_customer_ingest(self):
+        """Six customers in chunks of two, failing on the third chunk (a phone number already taken)."""
+        self.customers += [
+            [8001 + n, f"First{n}", f"Last{n}", 30 + n, 9100000000 + n, 40000, 1500000] for n in range(4, 6)
+        ]
+        blocker = Customer.objects.create(
+            customer_id=8999, first_name="Taken", last_name="Phone", age=50,
+            phone_number="9100000004", monthly_income=10000, approved_limit=300000,
+        )
+        path = self.write("customers-1.csv", CUSTOMER_COLUMNS, self.customers)
+        with self.assertRaises(IntegrityError):
+            ingest_customers(path, batch_size=2)
+        return path, blocker
+
+    def test_an_interrupted_ingest_resumes_after_its_last_committed_chunk(self):
+        path, blocker = self.interrupted_customer_ingest()
+        checkpoint = IngestCheckpoint.objects.get(kind="customers", fingerprint=file_fingerprint(path))
+        self.assertEqual((checkpoint.rows_done, checkpoint.completed_at), (4, None))
+        self.assertEqual(Customer.objects.filter(customer_id__range=(8001, 8006)).count(), 4)
+        # would be overwritten if the committed chunks were applied again
+        Customer.objects.filter(customer_id=8001).update(first_name="Edited", source_hash="")
+        blocker.delete()
+
+        report = ingest_customers(path, batch_size=2)
+
+        self.assertEqual((report["resumed_from"], report["rows"], report["inserted"]), (4, 2, 2))
+        self.assertEqual(Customer.objects.get(customer_id=8001).first_name, "Edited")
+        self.assertEqual(Customer.objects.filter(customer_id__range=(8001, 8006)).count(), 6)
+        checkpoint.refresh_from_db()
+        self.assertEqual(checkpoint.rows_done, 6)
+        self.assertIsNotNone(checkpoint.completed_at)
+
+    def test_a_changed_file_starts_from_the_first_row(self):
+        _, blocker = self.interrupted_customer_ingest()
+        blocker.delete()
+        self.customers[0][1] = "Renamed"
+
+        report = ingest_customers(self.write("customers-2.csv", CUSTOMER_COLUMNS, self.customers), batch_size=2)
+
+        self.assertEqual((report["resumed_from"], report["rows"]), (0, 6))
+        self.assertEqual(self.counts(report), (2, 1, 3))
+        self.assertEqual(Customer.objects.get(customer_id=8001).first_name, "Renamed")
+
+    def test_a_row_saved_since_is_rewritten(self):
+        self.ingest(1)
+        customer = Customer.objects.get(customer_id=8003)
+        customer.monthly_income = 1
+        customer.save()
+
+        customers, _ = self.ingest(1, force=True)
+
+        self.assertEqual(self.counts(customers), (0, 1, 3))
+        self.assertEqual(Customer.objects.get(customer_id=8003).monthly_income, 60000)
+        self.assertEqual(verify_portfolio_rollups(), [])
+
+
+class ShardedIngestTests(TestCase):
+    """ingest_files splits each file into contiguous shards and only starts loans after every customer shard."""
+
+    def setUp(self):
+        caches["loans"].clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.customers = os.path.join(self.directory, "customers.csv")
+        self.loans = os.path.join(self.directory, "loans.csv")
+        pd.DataFrame(
+            [[8301 + n, f"First{n}", f"Last{n}", 30 + n, 9200000000 + n, 50000, 1800000] for n in range(4)],
+            columns=list(CUSTOMER_COLUMNS),
+        ).to_csv(self.customers, index=False)
+        pd.DataFrame(
+            [[8301 + n % 4, 8401 + n, 100000, 24, 12, 4707, 10, date(2024, 1, 1), date(2026, 1, 1)] for n in range(7)],
+            columns=list(LOAN_COLUMNS),
+        ).to_csv(self.loans, index=False)
+
+    def test_shards_cover_every_row_once(self):
+        for total, shards in [(0, 4), (1, 4), (3, 8), (10, 4), (12, 4), (97, 7), (5, 1)]:
+            with self.subTest(total=total, shards=shards):
+                ranges = shard_ranges(total, shards)
+                rows = [row for start, end in ranges for row in range(start, end)]
+                self.assertEqual(rows, list(range(total)))
+                self.assertLessEqual(len(ranges), max(shards, 1))
+                sizes = [end - start for start, end in ranges]
+                self.assertLessEqual(max(sizes) - min(sizes), 1)
+
+        self.assertEqual(shard_ranges(10, 4), [(0, 3), (3, 6), (6, 8), (8, 10)])  # uneven: the last ones are short
+        self.assertEqual(shard_ranges(3, 8), [(0, 1), (1, 2), (2, 3)])  # fewer rows than shards
+        self.assertEqual(shard_ranges(0, 4), [(0, 0)])
+
+    def test_customer_shards_are_the_header_of_the_loan_chord(self):
+        with mock.patch("loans.tasks.chord") as chord:
+            ingest_files(self.customers, self.loans, shards=3, batch_size=50, reject_file="rejects.csv")
+        header, = chord.call_args.args
+        body, = chord.return_value.call_args.args
+
+        self.assertEqual(
+            [(task.task, task.args, task.immutable) for task in header.tasks],
+            [("loans.tasks.ingest_customers", (self.customers, 50, start, end, False), True)
+             for start, end in [(0, 2), (2, 3), (3, 4)]],
+        )
+        self.assertEqual(body.task, "loans.tasks.ingest_loan_shards")
+        self.assertEqual(body.args, (self.loans, 3, 50, "rejects.csv", False))
+
+        with mock.patch("loans.tasks.chord") as chord:
+            ingest_loan_shards([{"rows": 4}], self.loans, 3, 50, "rejects.csv", False)
+        header, = chord.call_args.args
+        body, = chord.return_value.call_args.args
+
+        self.assertEqual(
+            [(task.task, task.args, task.immutable) for task in header.tasks],
+            [("loans.tasks.ingest_loans", (self.loans, 50, f"rejects.csv.{index}", start, end, False), True)
+             for index, (start, end) in enumerate([(0, 3), (3, 5), (5, 7)])],
+        )
+        self.assertEqual((body.task, body.args), ("loans.tasks.ingest_summary", ([{"rows": 4}],)))
+
+    def test_fast_ingest_rejects_shard_options(self):
+        for extra in (["--shards", "4"], ["--force"]):
+            with self.subTest(extra=extra), mock.patch("loans.tasks.fast_ingest_files.delay") as delay:
+                with self.assertRaises(CommandError):
+                    call_command("enqueue_initial_ingest", self.customers, self.loans, "--fast", *extra)
+                delay.assert_not_called()
+        with mock.patch("loans.tasks.fast_ingest_files.delay") as delay:
+            call_command("enqueue_initial_ingest", self.customers, self.loans, "--fast", stdout=io.StringIO())
+        delay.assert_called_once_with(self.customers, self.loans, reject_file=None)
+
+    def test_sharded_ingest_writes_every_row(self):
+        from credit_system.celery import app
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, "task_always_eager", False)
+
+        with self.assertLogs("loans.tasks", "INFO") as logs:
+            ingest_files(self.customers, self.loans, shards=5)  # more shards than customers, uneven loan shards
+        summary = next(record.args for record in logs.records if record.msg.startswith("ingest finished"))
+
+        self.assertEqual(
+            [(summary[kind]["shards"], summary[kind]["rows"], summary[kind]["inserted"]) for kind in ("customers", "loans")],
+            [(4, 4, 4), (5, 7, 7)],
+        )
+        self.assertEqual(
+            sorted(Loan.objects.values_list("loan_id", flat=True)), list(range(8401, 8408)),
+        )
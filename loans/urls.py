@@ -1,14 +1,30 @@
 # loans/urls.py
 from django.urls import path
 from .views import (
-    RegisterView, CheckEligibilityView, CreateLoanView,
-    ViewLoanAPIView, ViewLoansByCustomerAPIView
+    RegisterView, CheckEligibilityView, CheckEligibilityBatchView, LoanOffersView, CreateLoanView,
+    ViewLoanAPIView, LoanScheduleAPIView, ViewLoansByCustomerAPIView, CacheStatsView,
+    ConnectionStatsView, ExportLoansView, PortfolioSummaryView
+)
+from .async_views import (
+    AsyncCheckEligibilityView, AsyncCreateLoanView, AsyncViewLoanView, AsyncViewLoansByCustomerView
 )
 
 urlpatterns = [
     path("register", RegisterView.as_view(), name="register"),
     path("check-eligibility", CheckEligibilityView.as_view(), name="check-eligibility"),
+    path("check-eligibility/batch", CheckEligibilityBatchView.as_view(), name="check-eligibility-batch"),
+    path("loan-offers", LoanOffersView.as_view(), name="loan-offers"),
     path("create-loan", CreateLoanView.as_view(), name="create-loan"),
     path("view-loan/<int:loan_id>", ViewLoanAPIView.as_view(), name="view-loan"),
+    path("view-loan/<int:loan_id>/schedule", LoanScheduleAPIView.as_view(), name="view-loan-schedule"),
     path("view-loans/<int:customer_id>", ViewLoansByCustomerAPIView.as_view(), name="view-loans"),
+    path("cache/stats", CacheStatsView.as_view(), name="cache-stats"),
+    path("db/stats", ConnectionStatsView.as_view(), name="db-stats"),
+    path("export/loans", ExportLoansView.as_view(), name="export-loans"),
+    path("portfolio/summary", PortfolioSummaryView.as_view(), name="portfolio-summary"),
+    # async variants; run under ASGI (see credit_system/asgi.py)
+    path("async/check-eligibility", AsyncCheckEligibilityView.as_view(), name="async-check-eligibility"),
+    path("async/create-loan", AsyncCreateLoanView.as_view(), name="async-create-loan"),
+    path("async/view-loan/<int:loan_id>", AsyncViewLoanView.as_view(), name="async-view-loan"),
+    path("async/view-loans/<int:customer_id>", AsyncViewLoansByCustomerView.as_view(), name="async-view-loans"),
 ]
@@ -1,10 +1,15 @@
 # loans/utils.py
+import calendar
 from datetime import date
 from decimal import Decimal, ROUND_HALF_UP
+from asgiref.sync import sync_to_async
 from django.utils import timezone
-from .models import Loan, Customer
-from django.db import models
+from .models import Loan, Customer, CustomerArchiveRollup, CustomerCreditSnapshot
+from django.db import models, router, transaction
+from django.db.models.functions import ExtractMonth, ExtractYear, Greatest
+from .metrics import timed
 
+@timed("calculate_emi")
 def calculate_emi(principal: float, annual_rate_percent: float, tenure_months: int) -> float:
     """
     Compound-interest based EMI formula.
@@ -20,6 +25,12 @@ def calculate_emi(principal: float, annual_rate_percent: float, tenure_months: i
         emi = P * r * (1 + r) ** tenure_months / ((1 + r) ** tenure_months - 1)
     return round(emi, 2)
 
+def add_months(start: date, months: int) -> date:
+    """start shifted by whole months, clamping the day to the target month's length."""
+    month_index = start.month - 1 + months
+    year, month = start.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
 def months_between(today: date, end: date) -> int:
     """Rough but accurate month difference (whole months left)."""
     if end < today:
@@ -30,15 +41,324 @@ def months_between(today: date, end: date) -> int:
         months -= 1
     return max(0, months)
 
+class CustomerCreditProfile:
+    """
+    All loan-derived inputs needed for scoring and the EMI cap, gathered in one
+    conditional-aggregation query (see get_credit_profile).
+    """
+
+    __slots__ = (
+        "current_loans_amount", "current_emis", "emis_paid_on_time",
+        "total_tenure", "loans_count", "current_year_count",
+    )
+
+    def __init__(self, current_loans_amount=0.0, current_emis=0.0, emis_paid_on_time=0,
+                 total_tenure=0, loans_count=0, current_year_count=0):
+        self.current_loans_amount = float(current_loans_amount or 0.0)
+        self.current_emis = float(current_emis or 0.0)
+        self.emis_paid_on_time = int(emis_paid_on_time or 0)
+        self.total_tenure = int(total_tenure or 0)
+        self.loans_count = int(loans_count or 0)
+        self.current_year_count = int(current_year_count or 0)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"CustomerCreditProfile({fields})"
+
+
+def credit_profile_aggregates(today: date = None) -> dict:
+    """
+    Aggregate expressions backing CustomerCreditProfile. Usable with .aggregate()
+    for one customer or with .values("customer").annotate() for many.
+    """
+    today = today or timezone.now().date()
+    year_start = date(today.year, 1, 1)
+    active = models.Q(is_active=True)
+    return {
+        "current_loans_amount": models.Sum("loan_amount", filter=active),
+        "current_emis": models.Sum("monthly_repayment", filter=active),
+        "emis_paid_on_time": models.Sum("emis_paid_on_time"),
+        "total_tenure": models.Sum("tenure"),
+        "loans_count": models.Count("id"),
+        "current_year_count": models.Count("id", filter=models.Q(start_date__gte=year_start)),
+    }
+
+ROLLUP_FIELDS = ("loans_count", "emis_paid_on_time", "total_tenure")
+
+def archive_rollups(customer_ids=None, using: str = None) -> dict:
+    """{customer pk: {field: total}} from CustomerArchiveRollup (customers with archived loans only)."""
+    rollups = CustomerArchiveRollup.objects.using(using)
+    if customer_ids is not None:
+        rollups = rollups.filter(customer_id__in=list(customer_ids))
+    return {row.pop("customer"): row for row in rollups.values("customer", *ROLLUP_FIELDS)}
+
+def with_archive(row: dict, rollup: dict = None) -> dict:
+    """A credit_profile_aggregates() row plus the customer's archived loans (see loans.archive)."""
+    for field, value in (rollup or {}).items():
+        row[field] = (row.get(field) or 0) + value
+    return row
+
+def get_credit_profile(customer: Customer) -> CustomerCreditProfile:
+    """
+    Read the customer's credit inputs from their snapshot (O(1), and free when the
+    customer was loaded with select_related("credit_snapshot")). A missing snapshot,
+    or one whose activity year has rolled over, is rebuilt from Loan first.
+    """
+    today = timezone.now().date()
+    try:
+        snapshot = customer.credit_snapshot
+    except CustomerCreditSnapshot.DoesNotExist:
+        snapshot = None
+    if snapshot is None or snapshot.activity_year != today.year:
+        snapshot = refresh_credit_snapshots([customer.pk], today=today)[customer.pk]
+        customer.credit_snapshot = snapshot
+    return snapshot_to_profile(snapshot)
+
+def ensure_credit_snapshots(customers) -> None:
+    """
+    Make sure every customer in the iterable carries a current snapshot, rebuilding
+    all missing/stale ones with a single grouped query (see get_credit_profile).
+    """
+    today = timezone.now().date()
+    stale = {}
+    for customer in customers:
+        try:
+            snapshot = customer.credit_snapshot
+        except CustomerCreditSnapshot.DoesNotExist:
+            snapshot = None
+        if snapshot is None or snapshot.activity_year != today.year:
+            stale[customer.pk] = customer
+    if stale:
+        for pk, snapshot in refresh_credit_snapshots(stale, today=today).items():
+            stale[pk].credit_snapshot = snapshot
+
+def aggregate_credit_profile(customer: Customer) -> CustomerCreditProfile:
+    """Recompute the profile straight from Loan and the archive rollup (bypasses the snapshot)."""
+    row = Loan.objects.filter(customer=customer).aggregate(**credit_profile_aggregates())
+    return CustomerCreditProfile(**with_archive(row, archive_rollups([customer.pk]).get(customer.pk)))
+
+def snapshot_to_profile(snapshot: CustomerCreditSnapshot) -> CustomerCreditProfile:
+    return CustomerCreditProfile(
+        current_loans_amount=snapshot.current_loans_amount,
+        current_emis=snapshot.current_emis,
+        emis_paid_on_time=snapshot.emis_paid_on_time,
+        total_tenure=snapshot.total_tenure,
+        loans_count=snapshot.loans_count,
+        current_year_count=snapshot.activity_count,
+    )
+
+SNAPSHOT_FIELDS = (
+    "current_loans_amount", "current_emis", "emis_paid_on_time",
+    "total_tenure", "loans_count", "activity_year", "activity_count",
+)
+
+def _decimal(value) -> Decimal:
+    return Decimal(str(value if value is not None else 0))
+
+# bulk_create kwargs that turn a snapshot insert into an upsert
+SNAPSHOT_UPSERT = {
+    "update_conflicts": True,
+    "unique_fields": ["customer"],
+    "update_fields": list(SNAPSHOT_FIELDS) + ["score_band", "income_band", "updated_at"],
+}
+
+def profile_to_snapshot(customer_pk: int, profile: CustomerCreditProfile, today: date) -> CustomerCreditSnapshot:
+    return CustomerCreditSnapshot(
+        customer_id=customer_pk,
+        current_loans_amount=_decimal(profile.current_loans_amount),
+        current_emis=_decimal(profile.current_emis),
+        emis_paid_on_time=profile.emis_paid_on_time,
+        total_tenure=profile.total_tenure,
+        loans_count=profile.loans_count,
+        activity_year=today.year,
+        activity_count=profile.current_year_count,
+    )
+
+def refresh_credit_snapshots(customer_ids=None, today: date = None, using: str = None) -> dict:
+    """
+    Rebuild snapshots from Loan with one grouped aggregate and one bulk upsert, and
+    recount the customers in the portfolio rollups (loans.portfolio).
+    customer_ids=None rebuilds every customer. Returns {customer pk: snapshot}.
+    """
+    from .portfolio import add_snapshot, apply_deltas, assign_bands
+    today = today or timezone.now().date()
+    using = using or router.db_for_write(CustomerCreditSnapshot)
+    loans = Loan.objects.using(using)
+    customers = Customer.objects.using(using)
+    stored = CustomerCreditSnapshot.objects.using(using)
+    if customer_ids is not None:
+        customer_ids = list(customer_ids)
+        loans = loans.filter(customer_id__in=customer_ids)
+        customers = customers.filter(pk__in=customer_ids)
+        stored = stored.filter(customer_id__in=customer_ids)
+
+    with transaction.atomic(using=using):
+        # the rollups count each customer as of their stored snapshot. Lock the customers
+        # first (pk order, like every other writer) so a missing snapshot can't be counted
+        # twice by concurrent rebuilds, then the snapshots until replaced
+        customers = list(customers.select_for_update().order_by("pk").values_list("pk", "monthly_income", "approved_limit"))
+        stored = {
+            snapshot.customer_id: snapshot
+            for snapshot in stored.select_for_update().only("score_band", "income_band", "current_loans_amount", "current_emis")
+        }
+        rows = {
+            row.pop("customer"): row
+            for row in loans.values("customer").annotate(**credit_profile_aggregates(today)).order_by()
+        }
+        rollups = archive_rollups(customer_ids, using=using)
+        snapshots, deltas = [], {}
+        for pk, monthly_income, approved_limit in customers:
+            snapshot = profile_to_snapshot(pk, CustomerCreditProfile(**with_archive(rows.get(pk, {}), rollups.get(pk))), today)
+            assign_bands(snapshot, monthly_income, approved_limit)
+            if pk in stored:
+                add_snapshot(deltas, stored[pk], -1)
+            add_snapshot(deltas, snapshot, 1)
+            snapshots.append(snapshot)
+        CustomerCreditSnapshot.objects.using(using).bulk_create(snapshots, batch_size=1000, **SNAPSHOT_UPSERT)
+        apply_deltas(deltas, using)
+    return {snapshot.customer_id: snapshot for snapshot in snapshots}
+
+async def aget_credit_profile(customer: Customer) -> CustomerCreditProfile:
+    """
+    get_credit_profile for async views. customer must have been loaded with
+    select_related("credit_snapshot"); a missing or stale snapshot is rebuilt by
+    refresh_credit_snapshots in the thread pool, under the same locks as every
+    other snapshot write (the portfolio rollups are diffed against the stored row).
+    """
+    today = timezone.now().date()
+    try:
+        snapshot = customer.credit_snapshot
+    except CustomerCreditSnapshot.DoesNotExist:
+        snapshot = None
+    if snapshot is None or snapshot.activity_year != today.year:
+        snapshots = await sync_to_async(refresh_credit_snapshots)([customer.pk], today=today)
+        snapshot = snapshots[customer.pk]
+        customer.credit_snapshot = snapshot
+    return snapshot_to_profile(snapshot)
+
+def verify_credit_snapshots(customer_ids=None, today: date = None) -> list:
+    """Return the customer pks whose stored snapshot differs from a fresh rebuild."""
+    today = today or timezone.now().date()
+    stored = CustomerCreditSnapshot.objects.all()
+    loans = Loan.objects.all()
+    customers = Customer.objects.all()
+    if customer_ids is not None:
+        stored = stored.filter(customer_id__in=customer_ids)
+        loans = loans.filter(customer_id__in=customer_ids)
+        customers = customers.filter(pk__in=customer_ids)
+    stored = {row["customer"]: row for row in stored.values("customer", *SNAPSHOT_FIELDS)}
+    rows = {
+        row.pop("customer"): row
+        for row in loans.values("customer").annotate(**credit_profile_aggregates(today)).order_by()
+    }
+    rollups = archive_rollups(customer_ids)
+    expected = {
+        pk: CustomerCreditProfile(**with_archive(rows.get(pk, {}), rollups.get(pk)))
+        for pk in rows.keys() | rollups.keys()
+    }
+
+    mismatched = []
+    for pk in customers.values_list("pk", flat=True):
+        row = stored.get(pk)
+        profile = expected.get(pk, CustomerCreditProfile())
+        if row is None:
+            # customers without loans get their (empty) snapshot lazily on first read
+            if pk in expected:
+                mismatched.append(pk)
+            continue
+        if row["activity_year"] != today.year or (
+            _decimal(row["current_loans_amount"]) != _decimal(profile.current_loans_amount)
+            or _decimal(row["current_emis"]) != _decimal(profile.current_emis)
+            or row["emis_paid_on_time"] != profile.emis_paid_on_time
+            or row["total_tenure"] != profile.total_tenure
+            or row["loans_count"] != profile.loans_count
+            or row["activity_count"] != profile.current_year_count
+        ):
+            mismatched.append(pk)
+    return mismatched
+
+def apply_loan_change(previous, current, using: str = None):
+    """
+    Fold one Loan write into the affected snapshots with a single UPDATE per customer,
+    and into the portfolio rollups (loans.portfolio). previous is the row as stored
+    before the write (None on insert), current the row after it (None on delete).
+    Must run inside the transaction performing the write.
+    """
+    from .portfolio import add_loan, apply_deltas, restate_customers
+    using = using or router.db_for_write(CustomerCreditSnapshot)
+    deltas = {}
+    for loan, sign in ((previous, -1), (current, 1)):
+        if loan is None:
+            continue
+        delta = deltas.setdefault(loan.customer_id, {
+            "current_loans_amount": Decimal(0), "current_emis": Decimal(0),
+            "emis_paid_on_time": 0, "total_tenure": 0, "loans_count": 0, "activity": [],
+        })
+        if loan.is_active:
+            delta["current_loans_amount"] += sign * _decimal(loan.loan_amount)
+            delta["current_emis"] += sign * _decimal(loan.monthly_repayment)
+        delta["emis_paid_on_time"] += sign * int(loan.emis_paid_on_time or 0)
+        delta["total_tenure"] += sign * int(loan.tenure)
+        delta["loans_count"] += sign
+        delta["activity"].append((loan.start_date.year, sign))
+
+    restated = {}
+    for customer_id, delta in deltas.items():
+        # a loan counts towards activity_count when it started in or after activity_year
+        activity = models.F("activity_count")
+        for year, sign in delta.pop("activity"):
+            activity = activity + models.Case(
+                models.When(activity_year__lte=year, then=models.Value(sign)),
+                default=models.Value(0),
+            )
+        updated = CustomerCreditSnapshot.objects.using(using).filter(customer_id=customer_id).update(
+            activity_count=activity,
+            updated_at=timezone.now(),
+            **{field: models.F(field) + value for field, value in delta.items()},
+        )
+        if updated:
+            restated[customer_id] = (delta["current_loans_amount"], delta["current_emis"])
+        elif current is not None:
+            refresh_credit_snapshots([customer_id], using=using)
+
+    # the loan's own buckets, and the customers' moves between score/income bands
+    rollup = {}
+    for loan, sign in ((previous, -1), (current, 1)):
+        if loan is not None:
+            add_loan(rollup, loan, sign)
+    restate_customers(restated, changes=restated, deltas=rollup, using=using)
+    apply_deltas(rollup, using)
+
+def repayments_left_expression(today: date = None):
+    """
+    months_between(today, end_date) as a database expression, so loan lists can
+    annotate repayments_left instead of computing it row by row in Python.
+    """
+    today = today or timezone.now().date()
+    months = (
+        (ExtractYear("end_date") - today.year) * 12
+        + (ExtractMonth("end_date") - today.month)
+        - models.Case(models.When(end_date__day__lt=today.day, then=models.Value(1)), default=models.Value(0))
+    )
+    return Greatest(months, models.Value(0), output_field=models.IntegerField())
+
 def sum_current_loans_amount(customer: Customer) -> float:
-    qs = Loan.objects.filter(customer=customer, is_active=True)
-    return float(qs.aggregate(total=models.Sum('loan_amount'))['total'] or 0.0)
+    return get_credit_profile(customer).current_loans_amount
 
 def sum_current_emis(customer: Customer) -> float:
-    qs = Loan.objects.filter(customer=customer, is_active=True)
-    return float(qs.aggregate(total=models.Sum('monthly_repayment'))['total'] or 0.0)
+    return get_credit_profile(customer).current_emis
 
+@timed("compute_credit_score")
 def compute_credit_score(customer: Customer) -> float:
+    """
+    Deterministic credit score in [0,100]; see score_credit_profile for the rules.
+    Callers that also need the EMI total should fetch the profile once and call
+    score_credit_profile directly.
+    """
+    return score_credit_profile(get_credit_profile(customer), customer.approved_limit)
+
+@timed("score_credit_profile")
+def score_credit_profile(profile: CustomerCreditProfile, approved_limit) -> float:
     """
     Deterministic credit score in [0,100] based on:
     - on-time payment ratio (40%)
@@ -50,24 +370,20 @@ def compute_credit_score(customer: Customer) -> float:
     - uses ALL loans (past + existing) for on-time ratio / counts
     - if sum_current_loans_amount > approved_limit -> returns 0 (as per assignment)
     """
-    from django.db.models import Sum
-    today = timezone.now().date()
-
     # quick override: too-much-current-loans
-    current_sum = sum_current_loans_amount(customer)
+    current_sum = profile.current_loans_amount
     try:
-        approved_limit = float(customer.approved_limit)
+        approved_limit = float(approved_limit)
     except Exception:
         approved_limit = 0.0
     if approved_limit > 0 and current_sum > approved_limit:
         return 0.0
 
-    loans = Loan.objects.filter(customer=customer)
-    loans_count = loans.count()
+    loans_count = profile.loans_count
 
     # on-time ratio:
-    total_on_time = loans.aggregate(total_on=Sum('emis_paid_on_time'))['total_on'] or 0
-    total_tenures = loans.aggregate(total_ten=Sum('tenure'))['total_ten'] or 0
+    total_on_time = profile.emis_paid_on_time
+    total_tenures = profile.total_tenure
     if total_tenures == 0:
         on_time_ratio = 1.0
     else:
@@ -81,8 +397,7 @@ def compute_credit_score(customer: Customer) -> float:
     loans_count_score = max(0.0, 100.0 * (1.0 - min(loans_count, cap) / cap))
 
     # loan activity in current year: more activity reduces score
-    year_start = date(today.year, 1, 1)
-    activity_count = loans.filter(start_date__gte=year_start).count()
+    activity_count = profile.current_year_count
     # map 0 -> 100, 5+ -> 0
     activity_cap = 5
     activity_score = max(0.0, 100.0 * (1.0 - min(activity_count, activity_cap) / activity_cap))
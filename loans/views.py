@@ -1,5 +1,7 @@
+import json
+
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 
 def healthz(request):
     return JsonResponse({"status": "ok"})
@@ -8,30 +10,63 @@ def healthz(request):
 from decimal import Decimal
 from datetime import date, timedelta
 from django.utils import timezone
-from django.db import transaction
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Q
+from django.views import View
 from rest_framework.views import APIView
 from rest_framework import generics, status
 from rest_framework.response import Response
-from .models import Customer, Loan
+from .models import Customer, Loan, LoanArchive
 from .serializers import (
     RegisterSerializer, CustomerResponseSerializer,
-    CheckEligibilityRequestSerializer, CheckEligibilityResponseSerializer
+    CheckEligibilityRequestSerializer, CheckEligibilityResponseSerializer, LoanOfferRequestSerializer,
+    LoanExportQuerySerializer, PortfolioSummaryQuerySerializer
 )
 from .utils import (
-    calculate_emi, compute_credit_score, apply_interest_slab,
-    sum_current_emis, months_between
+    calculate_emi, get_credit_profile, score_credit_profile, apply_interest_slab,
+    ensure_credit_snapshots, add_months, repayments_left_expression
 )
+from .emi import amortization_schedule
+from .offers import DEFAULT_TENURES, best_offers
+from .ids import allocate_id
+from . import cache, export, metrics, portfolio
+from .connections import connection_stats
 
 # helper: accept either DB id (id) or external customer_id (if present)
 def get_customer_by_identifier(identifier: int):
-    try:
-        return Customer.objects.get(id=identifier)
-    except Customer.DoesNotExist:
-        # try external field if you used it (customer_id)
-        try:
-            return Customer.objects.get(customer_id=identifier)
-        except Exception:
-            raise
+    # one OR query (pk index + customer_id index) instead of a fallback second lookup
+    customer = get_customers_by_identifiers([identifier]).get(identifier)
+    if customer is None:
+        raise Customer.DoesNotExist(f"no customer with id or customer_id {identifier}")
+    return customer
+
+def get_customers_by_identifiers(identifiers) -> dict:
+    """
+    Batch form of get_customer_by_identifier: one IN query, same precedence
+    (internal id first, then external customer_id). Returns {identifier: customer}.
+    """
+    identifiers = set(identifiers)
+    if not identifiers:
+        return {}
+    return match_identifiers(identifiers, customers_by_identifiers(identifiers))
+
+def customers_by_identifiers(identifiers):
+    return Customer.objects.select_related("credit_snapshot").filter(
+        Q(id__in=identifiers) | Q(customer_id__in=identifiers)
+    )
+
+def match_identifiers(identifiers, customers) -> dict:
+    by_id, by_external = {}, {}
+    for customer in customers:
+        by_id[customer.id] = customer
+        by_external[customer.customer_id] = customer
+    resolved = {}
+    for identifier in identifiers:
+        customer = by_id.get(identifier) or by_external.get(identifier)
+        if customer is not None:
+            resolved[identifier] = customer
+    return resolved
 
 from decimal import ROUND_HALF_UP
 from decimal import Decimal, ROUND_HALF_UP
@@ -67,11 +102,8 @@ class RegisterView(APIView):
         #     monthly_income=monthly_income,
         #     approved_limit=approved
         # )
-        last_customer = Customer.objects.order_by("-customer_id").first()
-        next_customer_id = (last_customer.customer_id + 1) if last_customer else 1
-
         customer = Customer.objects.create(
-            customer_id=next_customer_id,
+            customer_id=allocate_id("customer"),
             first_name=data["first_name"],
             last_name=data["last_name"],
             age=data["age"],
@@ -91,6 +123,52 @@ class RegisterView(APIView):
         }
         return Response(out, status=status.HTTP_201_CREATED)
 
+def evaluate_eligibility(customer: Customer, payload: dict) -> dict:
+    """
+    Eligibility decision for one validated CheckEligibilityRequestSerializer payload.
+    Shared by the single and batch endpoints so both answer identically.
+    """
+    return eligibility_decision(customer, get_credit_profile(customer), payload)
+
+def eligibility_decision(customer: Customer, profile, payload: dict) -> dict:
+    """evaluate_eligibility on an already loaded credit profile (no queries; used by the async views)."""
+    credit_score = score_credit_profile(profile, customer.approved_limit)
+
+    # if sum of all current EMIs > 50% monthly_income -> don't approve
+    total_emis = profile.current_emis
+    monthly_income = float(customer.monthly_income)
+    if total_emis > 0.5 * monthly_income:
+        # compute installment for completeness using provided rate
+        monthly_installment = calculate_emi(float(payload["loan_amount"]), float(payload["interest_rate"]), int(payload["tenure"]))
+        return {
+            "customer_id": customer.id,
+            "approval": False,
+            "interest_rate": float(payload["interest_rate"]),
+            "corrected_interest_rate": None,
+            "tenure": payload["tenure"],
+            "monthly_installment": monthly_installment,
+            "reason": "existing EMIs exceed 50% of monthly income"
+        }
+
+    # apply slab
+    provided_rate = float(payload["interest_rate"])
+    approved_by_slab, corrected_rate, slab_min = apply_interest_slab(credit_score, provided_rate)
+
+    # If apply_interest_slab returned corrected_rate as suggestion, we use corrected_rate for installment calculation only if approved_by_slab is True.
+    used_rate_for_emi = provided_rate if approved_by_slab else (corrected_rate if corrected_rate else provided_rate)
+
+    monthly_installment = calculate_emi(float(payload["loan_amount"]), used_rate_for_emi, int(payload["tenure"]))
+
+    return {
+        "customer_id": customer.id,
+        "approval": bool(approved_by_slab),
+        "interest_rate": float(provided_rate),
+        "corrected_interest_rate": float(corrected_rate) if corrected_rate is not None else None,
+        "tenure": payload["tenure"],
+        "monthly_installment": monthly_installment,
+        "credit_score": credit_score
+    }
+
 class CheckEligibilityView(APIView):
     """
     POST /api/check-eligibility
@@ -106,45 +184,66 @@ class CheckEligibilityView(APIView):
         except Customer.DoesNotExist:
             return Response({"error": "customer not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        # compute credit score
-        credit_score = compute_credit_score(customer)
-
-        # if sum of all current EMIs > 50% monthly_income -> don't approve
-        total_emis = sum_current_emis(customer)
-        monthly_income = float(customer.monthly_income)
-        if total_emis > 0.5 * monthly_income:
-            # compute installment for completeness using provided rate
-            monthly_installment = calculate_emi(float(payload["loan_amount"]), float(payload["interest_rate"]), int(payload["tenure"]))
-            resp = {
-                "customer_id": customer.id,
-                "approval": False,
-                "interest_rate": float(payload["interest_rate"]),
-                "corrected_interest_rate": None,
-                "tenure": payload["tenure"],
-                "monthly_installment": monthly_installment,
-                "reason": "existing EMIs exceed 50% of monthly income"
-            }
-            return Response(resp, status=status.HTTP_200_OK)
-
-        # apply slab
-        provided_rate = float(payload["interest_rate"])
-        approved_by_slab, corrected_rate, slab_min = apply_interest_slab(credit_score, provided_rate)
-
-        # If apply_interest_slab returned corrected_rate as suggestion, we use corrected_rate for installment calculation only if approved_by_slab is True.
-        used_rate_for_emi = provided_rate if approved_by_slab else (corrected_rate if corrected_rate else provided_rate)
-
-        monthly_installment = calculate_emi(float(payload["loan_amount"]), used_rate_for_emi, int(payload["tenure"]))
+        return Response(evaluate_eligibility(customer, payload), status=status.HTTP_200_OK)
 
-        resp = {
-            "customer_id": customer.id,
-            "approval": bool(approved_by_slab),
-            "interest_rate": float(provided_rate),
-            "corrected_interest_rate": float(corrected_rate) if corrected_rate is not None else None,
-            "tenure": payload["tenure"],
-            "monthly_installment": monthly_installment,
-            "credit_score": credit_score
-        }
-        return Response(resp, status=status.HTTP_200_OK)
+class CheckEligibilityBatchView(APIView):
+    """
+    POST /api/check-eligibility/batch
+    Body: a list of check-eligibility requests (or {"requests": [...]}).
+    Returns one result per item, in input order. Items that fail validation or
+    reference an unknown customer get {"error": ..., "status": <code>} in place.
+    """
+    def post(self, request):
+        items = request.data.get("requests") if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list):
+            return Response({"error": "expected a list of requests"}, status=status.HTTP_400_BAD_REQUEST)
+        max_items = getattr(settings, "ELIGIBILITY_BATCH_MAX_ITEMS", 5000)
+        if len(items) > max_items:
+            return Response({"error": f"batch exceeds {max_items} items"}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = [None] * len(items)
+        payloads = {}
+        for index, item in enumerate(items):
+            ser = CheckEligibilityRequestSerializer(data=item)
+            if ser.is_valid():
+                payloads[index] = ser.validated_data
+            else:
+                results[index] = {"error": ser.errors, "status": status.HTTP_400_BAD_REQUEST}
+
+        customers = get_customers_by_identifiers({p["customer_id"] for p in payloads.values()})
+        ensure_credit_snapshots(set(customers.values()))
+
+        for index, payload in payloads.items():
+            customer = customers.get(payload["customer_id"])
+            if customer is None:
+                results[index] = {"error": "customer not found", "status": status.HTTP_404_NOT_FOUND}
+            else:
+                results[index] = evaluate_eligibility(customer, payload)
+        return Response(results, status=status.HTTP_200_OK)
+
+class LoanOffersView(APIView):
+    """
+    POST /api/loan-offers
+    Body: customer_id, interest_rate, optional tenures (months) and amount_step.
+    For each tenure, the largest amount (a multiple of amount_step) that keeps
+    total EMIs within 50% of income and exposure within the approved limit,
+    with its EMI; see loans.offers.
+    """
+    def post(self, request):
+        ser = LoanOfferRequestSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        payload = ser.validated_data
+
+        try:
+            customer = get_customer_by_identifier(payload["customer_id"])
+        except Customer.DoesNotExist:
+            return Response({"error": "customer not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        out = best_offers(
+            customer, get_credit_profile(customer), float(payload["interest_rate"]),
+            tenures=payload.get("tenures") or DEFAULT_TENURES, amount_step=payload.get("amount_step"),
+        )
+        return Response(out, status=status.HTTP_200_OK)
 
 class CreateLoanView(APIView):
     """
@@ -162,73 +261,112 @@ class CreateLoanView(APIView):
         except Customer.DoesNotExist:
             return Response({"error": "customer not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        # Reuse eligibility logic (compute score + slab)
-        credit_score = compute_credit_score(customer)
-        total_emis = sum_current_emis(customer)
-        monthly_income = float(customer.monthly_income)
-        if total_emis > 0.5 * monthly_income:
-            return Response({
-                "loan_id": None,
-                "customer_id": customer.id,
-                "loan_approved": False,
-                "message": "Existing EMIs exceed 50% of monthly income",
-                "monthly_installment": None
-            }, status=status.HTTP_200_OK)
-
-        provided_rate = float(payload["interest_rate"])
-        approved_by_slab, corrected_rate, slab_min = apply_interest_slab(credit_score, provided_rate)
-
-        if not approved_by_slab:
-            return Response({
-                "loan_id": None,
-                "customer_id": customer.id,
-                "loan_approved": False,
-                "message": f"Not approved by credit slab (credit_score={credit_score})",
-                "monthly_installment": None
-            }, status=status.HTTP_200_OK)
-
-        # approved -> create Loan
-        # determine loan monthly installment using provided_rate (or corrected_rate if that is what's used)
-        used_rate = provided_rate if approved_by_slab else (corrected_rate or provided_rate)
-        monthly_installment = calculate_emi(float(payload["loan_amount"]), used_rate, int(payload["tenure"]))
-
-        # create loan object (we will generate loan_id as unique external id)
-        with transaction.atomic():
-            max_external = Loan.objects.aggregate(max_id=models.Max('loan_id'))['max_id'] or 0
-            new_external_loan_id = int(max_external) + 1
-            loan = Loan.objects.create(
-                customer=customer,
-                loan_id=new_external_loan_id,
-                loan_amount=payload["loan_amount"],
-                tenure=payload["tenure"],
-                interest_rate=used_rate,
-                monthly_repayment=Decimal(monthly_installment),
-                emis_paid_on_time=0,
-                start_date=timezone.now().date(),
-                # approximate end_date by adding months:
-                end_date=(timezone.now().date().replace(day=1) + timedelta(days=payload["tenure"] * 30)),
-                is_active=True
-            )
+        decision, loan = create_loan_for(customer, payload)
+        if not decision["approved"]:
+            return Response(loan_rejected(customer, decision["message"]), status=status.HTTP_200_OK)
+        return Response(loan_booked(loan, decision), status=status.HTTP_201_CREATED)
 
-        return Response({
-            "loan_id": loan.loan_id,
-            "customer_id": customer.id,
-            "loan_approved": True,
-            "message": "Loan approved",
-            "monthly_installment": float(monthly_installment)
-        }, status=status.HTTP_201_CREATED)
+def create_loan_for(customer: Customer, payload: dict) -> tuple:
+    """
+    Decide and book one create-loan request while holding the customer's row lock,
+    so concurrent requests for the same customer run one after another and each
+    sees the EMIs the previous one added; other customers are not blocked.
+    Returns (decision, loan or None). Shared by the sync and async views.
+    """
+    with transaction.atomic():
+        # lock first, then read the snapshot in its own statement: rows joined into a
+        # FOR UPDATE query are not re-read after waiting for the lock
+        locked = Customer.objects.select_for_update().get(pk=customer.pk)
+        # the shared portfolio rollup rows are updated last, in one pass, so they stay
+        # locked only for the commit
+        with portfolio.batched():
+            decision = loan_decision(locked, get_credit_profile(locked), payload)
+            loan = book_loan(locked, payload, decision) if decision["approved"] else None
+    return decision, loan
+
+def loan_decision(customer: Customer, profile, payload: dict) -> dict:
+    """
+    Create-loan checks (EMI cap + credit slab) on an already loaded profile.
+    Returns {"approved": False, "message": ...} or {"approved": True, "interest_rate": ...,
+    "monthly_installment": ...}. Shared by the sync and async create-loan views.
+    """
+    credit_score = score_credit_profile(profile, customer.approved_limit)
+    total_emis = profile.current_emis
+    monthly_income = float(customer.monthly_income)
+    if total_emis > 0.5 * monthly_income:
+        return {"approved": False, "message": "Existing EMIs exceed 50% of monthly income"}
+
+    provided_rate = float(payload["interest_rate"])
+    approved_by_slab, corrected_rate, slab_min = apply_interest_slab(credit_score, provided_rate)
+
+    if not approved_by_slab:
+        return {"approved": False, "message": f"Not approved by credit slab (credit_score={credit_score})"}
+
+    # approved -> create Loan
+    # determine loan monthly installment using provided_rate (or corrected_rate if that is what's used)
+    used_rate = provided_rate if approved_by_slab else (corrected_rate or provided_rate)
+    monthly_installment = calculate_emi(float(payload["loan_amount"]), used_rate, int(payload["tenure"]))
+    return {"approved": True, "interest_rate": used_rate, "monthly_installment": monthly_installment}
+
+def book_loan(customer: Customer, payload: dict, decision: dict) -> Loan:
+    # create loan object (we will generate loan_id as unique external id)
+    with transaction.atomic():
+        return Loan.objects.create(
+            customer=customer,
+            loan_id=allocate_id("loan"),
+            loan_amount=payload["loan_amount"],
+            tenure=payload["tenure"],
+            interest_rate=decision["interest_rate"],
+            monthly_repayment=Decimal(decision["monthly_installment"]),
+            emis_paid_on_time=0,
+            start_date=timezone.now().date(),
+            # approximate end_date by adding months:
+            end_date=(timezone.now().date().replace(day=1) + timedelta(days=payload["tenure"] * 30)),
+            is_active=True
+        )
+
+def loan_rejected(customer: Customer, message: str) -> dict:
+    return {
+        "loan_id": None,
+        "customer_id": customer.id,
+        "loan_approved": False,
+        "message": message,
+        "monthly_installment": None
+    }
+
+def loan_booked(loan: Loan, decision: dict) -> dict:
+    return {
+        "loan_id": loan.loan_id,
+        "customer_id": loan.customer_id,
+        "loan_approved": True,
+        "message": "Loan approved",
+        "monthly_installment": float(decision["monthly_installment"])
+    }
 
 # Details views
 class ViewLoanAPIView(APIView):
     def get(self, request, loan_id):
+        resp = cache.get_loan_detail(loan_id, lambda: self.build(loan_id))
+        if resp is None:
+            return Response({"error": "loan not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(resp, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def build(loan_id):
         try:
             loan = Loan.objects.select_related('customer').get(loan_id=loan_id)
         except Loan.DoesNotExist:
-            return Response({"error": "loan not found"}, status=status.HTTP_404_NOT_FOUND)
-
+            # old closed loans live in the archive tier (loans.archive)
+            loan = LoanArchive.objects.select_related('customer').filter(loan_id=loan_id).first()
+            if loan is None:
+                return None
+        return ViewLoanAPIView.detail(loan)
+
+    @staticmethod
+    def detail(loan):
         cust = loan.customer
         monthly_installment = float(loan.monthly_repayment)
-        resp = {
+        return {
             "loan_id": loan.loan_id,
             "customer": {
                 "id": cust.id,
@@ -242,26 +380,190 @@ class ViewLoanAPIView(APIView):
             "monthly_installment": monthly_installment,
             "tenure": loan.tenure
         }
+
+class LoanScheduleAPIView(APIView):
+    """
+    GET /api/view-loan/<loan_id>/schedule
+    Month-by-month amortization (interest, principal, closing balance).
+    """
+    def get(self, request, loan_id):
+        loan = (Loan.objects.filter(loan_id=loan_id).first()
+                or LoanArchive.objects.filter(loan_id=loan_id).first())
+        if loan is None:
+            return Response({"error": "loan not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        # the installment the loan was booked (or ingested) with; the last row absorbs the rounding
+        schedule = amortization_schedule(
+            loan.loan_amount, loan.interest_rate, loan.tenure, emi=float(loan.monthly_repayment),
+        )
+        rows = zip(*(schedule[key].tolist() for key in ("month", "payment", "interest", "principal", "balance")))
+        resp = {
+            "loan_id": loan.loan_id,
+            "loan_amount": float(loan.loan_amount),
+            "interest_rate": float(loan.interest_rate),
+            "tenure": loan.tenure,
+            "monthly_installment": float(loan.monthly_repayment),
+            "schedule": [
+                {
+                    "month": month,
+                    "due_date": add_months(loan.start_date, month),
+                    "payment": payment,
+                    "interest": interest,
+                    "principal": principal,
+                    "balance": balance,
+                }
+                for month, payment, interest, principal, balance in rows
+            ],
+        }
         return Response(resp, status=status.HTTP_200_OK)
 
 class ViewLoansByCustomerAPIView(APIView):
+    """
+    GET /api/view-loans/<customer_id>
+    Optional query params:
+    - limit / cursor: keyset pagination on loan_id; the next page's cursor is sent
+      in the X-Next-Cursor header (and a rel="next" Link header)
+    - stream=1: write the JSON array incrementally from a server-side cursor
+    Without them the full list is returned (and cached), as before.
+    """
+    fields = ("loan_id", "loan_amount", "interest_rate", "monthly_repayment", "repayments_left")
+
     def get(self, request, customer_id):
+        params = request.query_params
+        if params.get("stream") in ("1", "true"):
+            return self.stream(customer_id)
+        if "limit" in params or "cursor" in params:
+            return self.page(request, customer_id)
+
+        out = cache.get_customer_loans(customer_id, lambda: self.build(customer_id))
+        if out is None:
+            return Response({"error": "customer not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(out, status=status.HTTP_200_OK)
+
+    @classmethod
+    def loans(cls, customer):
+        return (
+            Loan.objects.filter(customer=customer, is_active=True)
+            .annotate(repayments_left=repayments_left_expression())
+            .order_by("loan_id")
+            .values_list(*cls.fields)
+        )
+
+    @staticmethod
+    def row(values):
+        loan_id, loan_amount, interest_rate, monthly_repayment, repayments_left = values
+        return {
+            "loan_id": loan_id,
+            "loan_amount": float(loan_amount),
+            "interest_rate": float(interest_rate),
+            "monthly_installment": float(monthly_repayment),
+            "repayments_left": repayments_left
+        }
+
+    @classmethod
+    def build(cls, customer_id):
+        try:
+            customer = get_customer_by_identifier(customer_id)
+        except Customer.DoesNotExist:
+            return None
+        return [cls.row(values) for values in cls.loans(customer)]
+
+    def page(self, request, customer_id):
+        try:
+            limit = int(request.query_params.get("limit", settings.VIEW_LOANS_MAX_LIMIT))
+            cursor = int(request.query_params.get("cursor", 0))
+        except ValueError:
+            return Response({"error": "limit and cursor must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, settings.VIEW_LOANS_MAX_LIMIT))
         try:
             customer = get_customer_by_identifier(customer_id)
-            print(f"Customer id: {customer_id}")
         except Customer.DoesNotExist:
             return Response({"error": "customer not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        loans = Loan.objects.filter(customer=customer, is_active=True)
-        today = timezone.now().date()
-        out = []
-        for l in loans:
-            repayments_left = months_between(today, l.end_date)
-            out.append({
-                "loan_id": l.loan_id,
-                "loan_amount": float(l.loan_amount),
-                "interest_rate": float(l.interest_rate),
-                "monthly_installment": float(l.monthly_repayment),
-                "repayments_left": repayments_left
-            })
-        return Response(out, status=status.HTTP_200_OK)
+        # one extra row tells us whether there is a next page
+        rows = list(self.loans(customer).filter(loan_id__gt=cursor)[:limit + 1])
+        response = Response([self.row(values) for values in rows[:limit]], status=status.HTTP_200_OK)
+        if len(rows) > limit:
+            next_cursor = rows[limit - 1][0]
+            response["X-Next-Cursor"] = str(next_cursor)
+            response["Link"] = '<{}?limit={}&cursor={}>; rel="next"'.format(
+                request.build_absolute_uri(request.path), limit, next_cursor
+            )
+        return response
+
+    def stream(self, customer_id):
+        try:
+            customer = get_customer_by_identifier(customer_id)
+        except Customer.DoesNotExist:
+            return Response({"error": "customer not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        # the body is read after the middleware has left read_from(): pin the alias now
+        loans = self.loans(customer).using(router.db_for_read(Loan))
+
+        def chunks():
+            yield "["
+            for index, values in enumerate(loans.iterator(chunk_size=settings.STREAM_CHUNK_SIZE)):
+                yield ("," if index else "") + json.dumps(self.row(values))
+            yield "]"
+
+        return StreamingHttpResponse(chunks(), content_type="application/json")
+
+def metrics_view(request):
+    """
+    GET /metrics
+    Request, database and ingest metrics in the Prometheus text format.
+    """
+    body, content_type = metrics.render()
+    return HttpResponse(body, content_type=content_type)
+
+class CacheStatsView(APIView):
+    """
+    GET /api/cache/stats
+    Hit/miss counters of the view-loan(s) response cache.
+    """
+    def get(self, request):
+        return Response(cache.cache_stats(), status=status.HTTP_200_OK)
+
+class ConnectionStatsView(APIView):
+    """
+    GET /api/db/stats
+    Connection reuse and (when DB_POOL is on) pool utilization / wait times for
+    the process that serves the request.
+    """
+    def get(self, request):
+        return Response(connection_stats(), status=status.HTTP_200_OK)
+
+class PortfolioSummaryView(APIView):
+    """
+    GET /api/portfolio/summary?days=30
+    Active exposure by interest slab, credit-score band and monthly-income band, and
+    new loans per day for the last `days` days (1-366). Read from the rollups kept
+    by loans.portfolio, so the cost does not grow with the portfolio.
+    """
+    def get(self, request):
+        ser = PortfolioSummaryQuerySerializer(data=request.query_params)
+        if not ser.is_valid():
+            return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(portfolio.portfolio_summary(**ser.validated_data), status=status.HTTP_200_OK)
+
+class ExportLoansView(View):
+    """
+    GET /api/export/loans
+    Query params: format=csv|ndjson (default csv), active=true|false,
+    start_date_from / start_date_to (YYYY-MM-DD, inclusive, on the start date),
+    include_archived=true|false (default true).
+    Streams every matching loan with its customer; see loans.export. A plain
+    Django view, since DRF reserves ?format= for renderer selection.
+    """
+    def get(self, request):
+        ser = LoanExportQuerySerializer(data=request.GET.dict())
+        if not ser.is_valid():
+            return JsonResponse(ser.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = dict(ser.validated_data)
+        fmt = params.pop("format")
+
+        response = StreamingHttpResponse(
+            export.encode(export.iter_loan_rows(**params), fmt), content_type=export.FORMATS[fmt],
+        )
+        response["Content-Disposition"] = f'attachment; filename="loans.{fmt}"'
+        return response